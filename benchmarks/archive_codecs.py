@@ -0,0 +1,116 @@
+"""
+    Juggler - Dirty dependency management and packaging for compiled code
+    Copyright (C) 2014  Christian Meyer
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+'''
+Compares pack and unpack time and archive size of the codecs juggler can publish with.
+
+    python benchmarks/archive_codecs.py --size 64
+
+The tree packed is generated: static libraries made of repeated code-like sections with random
+constants mixed in, and plain text headers, roughly in the proportions of our usual packages.
+'''
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from juggler import compression
+
+def create_tree(root, size_mb, seed):
+    generator = random.Random(seed)
+    opcodes = [''.join(chr(generator.randrange(256)) for _ in range(16)) for _ in range(512)]
+    remaining = size_mb * 1024 * 1024
+    library_index = 0
+    while remaining > 0:
+        library_size = min(remaining, generator.randrange(1, 8) * 1024 * 1024)
+        chunks = []
+        written = 0
+        while written < library_size:
+            if generator.random() < 0.2:
+                chunk = os.urandom(64)
+            else:
+                chunk = ''.join(generator.choice(opcodes) for _ in range(16))
+            chunks.append(chunk)
+            written += len(chunk)
+        library_dir = os.path.join(root, 'lib')
+        if not os.path.isdir(library_dir):
+            os.makedirs(library_dir)
+        with open(os.path.join(library_dir, 'libPart%03d.a' % library_index), 'wb') as library:
+            library.write(''.join(chunks)[:library_size])
+        remaining -= library_size
+        library_index += 1
+
+    include_dir = os.path.join(root, 'include', 'project')
+    os.makedirs(include_dir)
+    for header_index in range(200):
+        with open(os.path.join(include_dir, 'header%03d.h' % header_index), 'w') as header:
+            for line_index in range(generator.randrange(20, 400)):
+                header.write('    int function_%d_%d(const struct context *ctx, unsigned int flags);\n' % (header_index, line_index))
+
+def pack(tree, filename, codec, level, threads):
+    compression.write_archive(filename, codec, level, threads, lambda archive: archive.add(tree, arcname='.'))
+
+def unpack(filename, codec, target):
+    with compression.open_archive(filename, codec) as archive:
+        archive.extractall(target)
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Compare the archive codecs supported by juggler')
+    parser.add_argument('--size', type=int, default=32, help='Size of the generated libraries in MB, defaults to 32')
+    parser.add_argument('--threads', type=int, default=4, help='Threads used for the parallel gzip variant, defaults to 4')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the generated tree')
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        tree = os.path.join(work_dir, 'tree')
+        create_tree(tree, args.size, args.seed)
+        variants = []
+        for codec in compression.get_supported_codecs():
+            if codec == 'tar':
+                variants.append(('tar', None, 1))
+            else:
+                variants.extend([(codec, 1, 1), (codec, None, 1), (codec, 9, 1)])
+        variants.append(('gz', None, args.threads))
+
+        print '%-16s %10s %10s %12s' % ('codec', 'pack s', 'unpack s', 'size MB')
+        for codec, level, threads in variants:
+            label = codec if level is None else '%s:%d' % (codec, level)
+            if threads > 1:
+                label += ' x%d' % threads
+            filename = os.path.join(work_dir, 'archive' + compression.get_extension(codec))
+            target = os.path.join(work_dir, 'unpacked')
+            start = time.time()
+            pack(tree, filename, codec, level, threads)
+            packed = time.time()
+            unpack(filename, codec, target)
+            unpacked = time.time()
+            print '%-16s %10.2f %10.2f %12.2f' % (label, packed - start, unpacked - packed, os.path.getsize(filename) / 1048576.0)
+            os.remove(filename)
+            shutil.rmtree(target)
+    finally:
+        shutil.rmtree(work_dir)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
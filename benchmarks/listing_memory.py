@@ -0,0 +1,118 @@
+"""
+    Juggler - Dirty dependency management and packaging for compiled code
+    Copyright (C) 2014  Christian Meyer
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+'''
+Measures the memory and time taken by loading a large generated listing several times, as if the
+same packages were offered by several remote repositories.
+
+    python benchmarks/listing_memory.py --packages 2000 --builds 50 --remotes 3
+
+Memory is the growth of the resident set size while the listings are loaded and kept, so the numbers
+are only comparable between runs on the same machine and python.
+'''
+
+import os
+import gc
+import sys
+import time
+import random
+import shutil
+import hashlib
+import resource
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from juggler import listing, version
+from xml.etree import ElementTree
+
+def get_resident_bytes():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        # the peak instead of the current size, still fine as long as nothing is freed in between
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def write_listing(filename, packages, builds, seed):
+    generator = random.Random(seed)
+    root = ElementTree.Element('Listing')
+    for package in range(packages):
+        name = 'Package%05d' % package
+        for flavor in ('vanilla', 'debug'):
+            package_element = ElementTree.SubElement(root, 'Package', {'name': name, 'flavor': flavor})
+            for build in range(builds):
+                build_version = '%d.%d.%d-b%d' % (build // 25, build % 25 // 5, build % 5, generator.randint(1, 400))
+                build_element = ElementTree.SubElement(package_element, 'Build', {
+                    'version': build_version, 'codec': 'gz',
+                    'digest': hashlib.sha256('%s %s %s' % (name, flavor, build_version)).hexdigest(),
+                    'size': str(generator.randint(1024, 64 * 1024 * 1024))})
+                if package > 0:
+                    requires = ElementTree.SubElement(build_element, 'Requires')
+                    ElementTree.SubElement(requires, 'Package', {'name': 'Package%05d' % generator.randrange(package), 'version': 'v1'})
+    ElementTree.ElementTree(root).write(filename, encoding='utf-8')
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Memory taken by loaded listings')
+    parser.add_argument('--packages', type=int, default=2000, help='packages in the listing, each in two flavors')
+    parser.add_argument('--builds', type=int, default=50, help='builds per package and flavor')
+    parser.add_argument('--remotes', type=int, default=3, help='number of times the listing is loaded and kept')
+    parser.add_argument('--lookups', type=int, default=100000, help='package lookups timed on the loaded listings')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix='juggler_memory.')
+    try:
+        filename = os.path.join(work_dir, listing.get_listing_filename())
+        write_listing(filename, args.packages, args.builds, args.seed)
+
+        gc.collect()
+        before = get_resident_bytes()
+        started = time.time()
+        # the remotes of a fetch share their versions like this
+        interned = listing.InternTable()
+        loaded = [listing.load_listing(filename, 'http://remote%d.example.com/repository' % remote, interned=interned)
+                  for remote in range(args.remotes)]
+        # builds are sorted on the first lookup, that belongs to what a loaded listing takes
+        for remote in loaded:
+            for info in remote.get_package_infos():
+                info.get_builds()
+        load_seconds = time.time() - started
+        gc.collect()
+        grown = get_resident_bytes() - before
+
+        generator = random.Random(args.seed)
+        spec = version.parse_spec('v1')
+        started = time.time()
+        for _ in xrange(args.lookups):
+            remote = loaded[generator.randrange(len(loaded))]
+            remote.get_package('Package%05d' % generator.randrange(args.packages), spec)
+        lookup_seconds = time.time() - started
+
+        total_builds = args.packages * 2 * args.builds * args.remotes
+        print 'builds loaded         %d' % total_builds
+        print 'load and sort         %.2f s' % load_seconds
+        print 'resident growth       %.1f MiB' % (grown / (1024.0 * 1024.0))
+        print 'per build             %d bytes' % (grown // max(1, total_builds))
+        print '%d lookups        %.2f s' % (args.lookups, lookup_seconds)
+    finally:
+        shutil.rmtree(work_dir)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,256 @@
+"""
+    Juggler - Dirty dependency management and packaging for compiled code
+    Copyright (C) 2014  Christian Meyer
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+'''
+Times the hot paths of fetch and publish against generated repositories and writes the results
+as JSON, optionally comparing them with an earlier run.
+
+    python benchmarks/repository_suite.py --packages 500 --builds 20 --output baseline.json
+    python benchmarks/repository_suite.py --packages 500 --builds 20 --compare baseline.json
+
+The remote repository has packages x flavors x builds builds, package N requires package N+1
+within chains of ten. Only the newest vanilla build of every package gets an archive of the
+given size. With --http the remote is served by the stand-in server of the tests instead of
+being read through file:// URLs.
+
+Every benchmark runs --repeat times, the median is compared with the baseline and counts as a
+regression if it is more than --threshold slower. The exit status is 1 if any benchmark regressed.
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import tarfile
+import argparse
+import StringIO
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from juggler import compression, dependency, listing, publisher, store, version
+from juggler.test.stand_in_server import StandInRepositoryServer
+from xml.etree import ElementTree
+
+CHAIN_LENGTH = 10
+
+def get_package_name(index):
+    return 'Package%05d' % index
+
+def get_flavors(count):
+    return ['vanilla'] + ['flavor%d' % index for index in range(1, count)]
+
+def get_build_version(build):
+    return 'v%d.%d-b%d' % (1 + build // 10, build % 10, build % 3)
+
+def get_requirements(index, packages):
+    if index + 1 < packages and index % CHAIN_LENGTH != CHAIN_LENGTH - 1:
+        return [(get_package_name(index + 1), '>=1.0.0')]
+    return []
+
+def write_archive(filename, size, generator):
+    payload = ''.join(chr(generator.getrandbits(8)) for _ in range(size))
+    def pack(archive):
+        info = tarfile.TarInfo('lib/libPayload.a')
+        info.size = len(payload)
+        archive.addfile(info, StringIO.StringIO(payload))
+    compression.write_archive(filename, 'gz', None, 1, pack)
+
+def create_remote_repository(root, packages, builds, flavors, archive_size, seed):
+    generator = random.Random(seed)
+    remote_listing = listing.Listing(root)
+    newest = []
+    for index in range(packages):
+        requirements = get_requirements(index, packages)
+        for flavor in get_flavors(flavors):
+            for build in range(builds):
+                entry = remote_listing.add_package(get_package_name(index), get_build_version(build), flavor, {'codec': 'gz'}, requirements)
+            if flavor == 'vanilla':
+                newest.append(entry)
+    remote_listing.store(root)
+    for entry in newest:
+        write_archive(os.path.join(root, entry.get_filename()), archive_size, generator)
+
+def create_project_tree(root, size, seed):
+    generator = random.Random(seed)
+    library_dir = os.path.join(root, 'lib')
+    include_dir = os.path.join(root, 'include')
+    os.makedirs(library_dir)
+    os.makedirs(include_dir)
+    with open(os.path.join(library_dir, 'libProject.a'), 'wb') as library:
+        library.write(''.join(chr(generator.getrandbits(8)) for _ in range(size)))
+    for index in range(50):
+        with open(os.path.join(include_dir, 'header%02d.h' % index), 'w') as header:
+            header.write(''.join('int function_%d_%d(void);\n' % (index, line) for line in range(100)))
+
+@contextlib.contextmanager
+def quiet():
+    # deploy and publish report through messages, which prints
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            yield
+        finally:
+            sys.stdout = stdout
+
+def measure(repeat, run, prepare=None):
+    timings = []
+    for _ in range(repeat):
+        if prepare is not None:
+            prepare()
+        start = time.time()
+        with quiet():
+            run()
+        timings.append(time.time() - start)
+    timings.sort()
+    return {'min': timings[0], 'median': timings[len(timings) // 2], 'runs': len(timings)}
+
+def run_benchmarks(args, work_dir):
+    remote_dir = os.path.join(work_dir, 'remote')
+    local_dir = os.path.join(work_dir, 'local')
+    os.makedirs(remote_dir)
+    create_remote_repository(remote_dir, args.packages, args.builds, args.flavors, args.archive_size * 1024, args.seed)
+    listing_filename = os.path.join(remote_dir, listing.get_listing_filename())
+
+    server = None
+    remote_url = 'file://%s' % remote_dir
+    if args.http:
+        server = StandInRepositoryServer(remote_dir)
+        server.start()
+        remote_url = server.get_url()
+
+    try:
+        results = {}
+        results['load_listing'] = measure(args.repeat, lambda: listing.load_listing(listing_filename, remote_dir))
+
+        loaded = listing.load_listing(listing_filename, remote_dir)
+        generator = random.Random(args.seed)
+        specs = [version.parse_spec(spec) for spec in ['', 'v1', '>=1.2.0,<2.0.0', 'v1.4-b1', '!=1.0.0-b0']]
+        lookups = [(get_package_name(generator.randrange(args.packages)), generator.choice(specs), generator.choice(get_flavors(args.flavors)))
+                   for _ in range(10000)]
+        def look_up():
+            for name, spec, flavor in lookups:
+                loaded.get_package(name, spec, False, flavor)
+        results['get_package_x10000'] = measure(args.repeat, look_up)
+
+        required = [{'name': get_package_name(index), 'version': version.parse_spec('')}
+                    for index in range(0, min(args.packages, args.required * CHAIN_LENGTH), CHAIN_LENGTH)]
+        def reset_local():
+            store.remove_tree(local_dir)
+        def create_manager():
+            return dependency.DependencyManager(local_dir, [remote_url], args.download_threads)
+        results['create_manager'] = measure(args.repeat, create_manager, reset_local)
+
+        reset_local()
+        source_manager = create_manager()
+        sources = [required[index % len(required)] for index in range(10000)]
+        def find_sources():
+            for package in sources:
+                source_manager.find_best_source(package, False, 'vanilla')
+        results['find_best_source_x10000'] = measure(args.repeat, find_sources)
+
+        def resolve():
+            manager = create_manager()
+            start = time.time()
+            manager.resolve_dependencies(required, False, 'vanilla')
+            resolve.timings.append(time.time() - start)
+        resolve.timings = []
+        measure(args.repeat, resolve, reset_local)
+        resolve.timings.sort()
+        # resolution alone, without creating the manager
+        results['resolve_dependencies'] = {'min': resolve.timings[0], 'median': resolve.timings[len(resolve.timings) // 2],
+                                           'runs': len(resolve.timings)}
+
+        deploy_dir = os.path.join(work_dir, 'deployed')
+        def reset_deployment():
+            reset_local()
+            store.remove_tree(deploy_dir)
+        results['deploy'] = measure(args.repeat, lambda: create_manager().deploy(required, deploy_dir, False, 'vanilla'), reset_deployment)
+
+        project_dir = os.path.join(work_dir, 'project')
+        create_project_tree(project_dir, args.archive_size * 1024, args.seed)
+        content = ElementTree.fromstring('<Content><SourcePath target=".">lib</SourcePath><Headers target="include">include</Headers></Content>')
+        publish_dir = os.path.join(work_dir, 'published')
+        def publish():
+            publisher.Publisher(content, project_dir, project_dir).publish(publish_dir, 'Project', version.parse_version('v1.0-b1'), 'vanilla')
+        results['publish'] = measure(args.repeat, publish, lambda: store.remove_tree(publish_dir))
+        return results
+    finally:
+        if server is not None:
+            server.stop()
+
+def compare(results, baseline, threshold):
+    '''returns the names of the benchmarks whose median is more than threshold slower than in the baseline'''
+    regressions = []
+    for name, result in sorted(results.items()):
+        if not name in baseline:
+            continue
+        if result['median'] > baseline[name]['median'] * (1 + threshold):
+            regressions.append(name)
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Time fetch and publish against generated repositories')
+    parser.add_argument('--packages', type=int, default=200, help='Number of packages in the remote repository, defaults to 200')
+    parser.add_argument('--builds', type=int, default=20, help='Builds per package and flavor, defaults to 20')
+    parser.add_argument('--flavors', type=int, default=2, help='Flavors per package, defaults to 2')
+    parser.add_argument('--archive_size', type=int, default=64, help='Size of every archive in KB, defaults to 64')
+    parser.add_argument('--required', type=int, default=5, help='Number of package chains the deployed project requires, defaults to 5')
+    parser.add_argument('--download_threads', type=int, default=1, help='Download threads of the deploy benchmark, defaults to 1')
+    parser.add_argument('--http', action='store_true', default=False, help='Serve the remote repository over HTTP instead of file://')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs of every benchmark, defaults to 5')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the generated repositories')
+    parser.add_argument('--output', default=None, help='Write the results as JSON to this file')
+    parser.add_argument('--compare', default=None, help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Slowdown of the median that counts as a regression, defaults to 0.2')
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        results = run_benchmarks(args, work_dir)
+    finally:
+        store.remove_tree(work_dir)
+
+    parameters = dict((key, getattr(args, key)) for key in ('packages', 'builds', 'flavors', 'archive_size', 'required',
+                                                            'download_threads', 'http', 'repeat', 'seed'))
+    report = {'parameters': parameters, 'results': results}
+    regressions = []
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get('parameters') != parameters:
+            print 'Warning: the baseline was measured with other parameters: %s' % baseline.get('parameters')
+        regressions = compare(results, baseline['results'], args.threshold)
+        report['regressions'] = regressions
+
+    print '%-24s %10s %10s %12s' % ('benchmark', 'min s', 'median s', 'baseline s')
+    for name, result in sorted(results.items()):
+        baseline_median = ''
+        if args.compare is not None and name in baseline['results']:
+            baseline_median = '%.4f' % baseline['results'][name]['median']
+        print '%-24s %10.4f %10.4f %12s%s' % (name, result['min'], result['median'], baseline_median,
+                                              '  REGRESSION' if name in regressions else '')
+    if args.output is not None:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -19,9 +19,7 @@
 """
 
 import argparse
-import config
-import dependency
-import publisher
+import daemon
 import os
 import sys
 import messages
@@ -34,49 +32,205 @@ def create_argparser():
                                                     This program comes with ABSOLUTELY NO WARRANTY. This is free software,
                                                     and you are welcome to redistribute it under certain conditions.""")
     
-    parser.add_argument('COMMAND', action='store', choices=['fetch', 'publish'])
-    parser.add_argument('SOURCE_PATH', action='store', help='Path to the project to be juggled. Must be a directory containing a juggle.xml')
-    parser.add_argument('BINARY_PATH', action='store', help='Path to the directory where the binary files will be built, can be the same as SOURCE_PATH.')
+    parser.add_argument('COMMAND', action='store', choices=['fetch', 'plan', 'publish', 'gc', 'daemon'], help='plan resolves like fetch and prints what fetch would download and deploy as JSON, without doing it. gc removes the least recently used downloaded builds from the local repository and takes no paths. daemon serves fetch, plan and publish commands with the listings kept in memory until it is terminated.')
+    parser.add_argument('SOURCE_PATH', action='store', nargs='?', help='Path to the project to be juggled. Must be a directory containing a juggle.xml')
+    parser.add_argument('BINARY_PATH', action='store', nargs='?', help='Path to the directory where the binary files will be built, can be the same as SOURCE_PATH.')
     parser.add_argument('--build_number', action='store', default='local', help='Specify the build number to use when publishing, defaults to local')
     parser.add_argument('--user_config', action='store', default='~/.juggler/global.xml', help='Specify a juggler configuration explicitly. Defaults to ~/.juggler/global.xml')
     parser.add_argument('--flavor', action='store', default='vanilla', help='Specify the flavor of the build. Only packages of this flavor will be fetched and only the package of this flavor will be published. Defaults to vanilla.')
     parser.add_argument('--do_not_use_local_builds', action='store_true', default=False, help='Prevents juggler from pulling local builds from repositories. Only regular builds will be considered.')
+    parser.add_argument('--frozen', action='store_true', default=False, help='Fetch exactly the packages recorded in the juggle.lock of the project. No listings are loaded and no versions are resolved.')
+    parser.add_argument('--download_threads', action='store', type=int, default=None, help='Number of packages to download and extract concurrently when fetching. Overrides the DownloadThreads setting of your juggler configuration, which defaults to 1.')
+    parser.add_argument('--compression_threads', action='store', type=int, default=None, help='Number of threads compressing the archive when publishing. Overrides the CompressionThreads setting of your juggler configuration, which defaults to 1.')
+    parser.add_argument('--codec', action='store', default=None, help='Codec of the published archive: tar, gz, bz2 or xz (if supported by your python), optionally followed by a level as in gz:9. Overrides the Codec setting of your juggler configuration, which defaults to gz.')
+    parser.add_argument('--delta', action='store_true', default=False, help='Also publish a delta against the previous build of the package, fetching the new build only transfers the changed files for those who have the previous one.')
+    parser.add_argument('--budget', action='store', type=int, default=None, help='MiB the local repository may take after gc. Overrides the CacheBudget setting of your juggler configuration, gc refuses to run without either, --budget 0 removes every downloaded build.')
+    parser.add_argument('--include_published', action='store_true', default=False, help='Let gc also remove builds that were published to the local repository instead of downloaded.')
+    parser.add_argument('--trace', action='store', default=None, metavar='FILE', help='Write timed spans of every phase and package, with byte counts and throughput, to FILE as Chrome trace events (chrome://tracing, Perfetto).')
+    parser.add_argument('--profile', action='store', default=None, metavar='FILE', help='Profile juggler with cProfile and write the statistics to FILE, they can be read with the pstats module.')
+    parser.add_argument('--plan_output', action='store', default=None, metavar='FILE', help='Write the JSON plan of the plan command to FILE instead of stdout.')
+    parser.add_argument('--daemon_socket', action='store', default=daemon.DEFAULT_SOCKET_PATH, help='Unix socket of the juggler daemon. fetch, plan and publish are run by the daemon serving there, or by this process if there is none. Defaults to %s' % daemon.DEFAULT_SOCKET_PATH)
+    parser.add_argument('--no_daemon', action='store_true', default=False, help='Run fetch, plan and publish in this process even if a juggler daemon is serving.')
+    parser.add_argument('--remote', action='store', default=None, help='Publish to the HTTP repository at this URL instead of the local repository. The archive is uploaded while it is packed and the listing of the repository is updated afterwards.')
 
     return parser
 
-def main(argv):
+def main(argv, listing_cache=None):
+    '''listing_cache is only given by the daemon running the command'''
     parser = create_argparser()
     args = parser.parse_args(argv)
-    
+    if args.COMMAND == 'daemon':
+        if listing_cache is not None:
+            parser.error('the daemon can not start another daemon')
+        return serve_daemon(args)
+    if listing_cache is None and args.COMMAND in ('fetch', 'plan', 'publish') and not args.no_daemon:
+        try:
+            exit_code = daemon.forward(args.daemon_socket, argv)
+        except daemon.DaemonFailed as e:
+            messages.DaemonFailed(e)
+            return -1
+        if exit_code is not None:
+            return exit_code
+
+    import tracing
+    if args.trace is not None:
+        tracing.enable()
+    if args.profile is not None:
+        tracing.start_profile()
+    try:
+        with tracing.span(args.COMMAND, 'juggler'):
+            return run(parser, args, listing_cache)
+    finally:
+        if args.profile is not None:
+            tracing.stop_profile(args.profile)
+        if args.trace is not None:
+            tracing.write(args.trace)
+            tracing.disable()
+
+def write_plan(filename, flavor, deployment_path, planned, stale):
+    import json
+    known_bytes = [package['download_bytes'] for package in planned if package['download_bytes'] is not None]
+    plan = {'flavor': flavor,
+            'deployment': os.path.abspath(deployment_path),
+            'packages': planned,
+            'stale': stale,
+            'download_bytes': sum(known_bytes),
+            'unknown_sizes': len(planned) - len(known_bytes)}
+    document = json.dumps(plan, indent=2, sort_keys=True) + '\n'
+    if filename is None:
+        sys.stdout.write(document)
+    else:
+        with open(filename, 'w') as plan_file:
+            plan_file.write(document)
+
+def serve_daemon(args):
+    import listing
+    listing_cache = listing.ListingCache()
+
+    def run_command(argv):
+        # a command that failed may have left its messages indented
+        messages.indent_level = 0
+        return main(argv, listing_cache)
+
+    messages.ServingDaemon(os.path.expanduser(args.daemon_socket))
+    try:
+        daemon.serve(args.daemon_socket, run_command)
+    except daemon.DaemonFailed as e:
+        messages.DaemonFailed(e)
+        return -1
+    return 0
+
+def run(parser, args, listing_cache=None):
+    # imported only here, a client handing its command to the daemon never needs them
+    import cache
+    import compression
+    import config
+    import dependency
+    import lockfile
+    import publisher
+    import tracing
+    import upload
+
+    if args.COMMAND != 'gc' and (args.SOURCE_PATH is None or args.BINARY_PATH is None):
+        parser.error('%s needs the SOURCE_PATH and BINARY_PATH of the project' % args.COMMAND)
+
+    try:
+        with tracing.span('load configuration', 'juggler'):
+            global_config = config.JugglerConfig()
+            global_config.load(os.path.expanduser(args.user_config))
+    except config.ConfigurationError as e:
+        messages.ConfigurationErrorDetected(e)
+        return -1
+
+    if args.COMMAND == 'gc':
+        budget = args.budget if args.budget is not None else global_config.cache_budget
+        if budget is None:
+            parser.error('gc needs a --budget or a CacheBudget in your juggler configuration, --budget 0 removes every downloaded build')
+        budget = max(0, budget) * 1024 * 1024
+        messages.CollectingGarbage(global_config.local_repository, budget)
+        messages.CollectedGarbage(cache.collect_garbage(global_config.local_repository, budget, args.include_published))
+        return 0
+
     deployment_path = os.path.join(args.BINARY_PATH, '.juggler')
+    cache_budget = None if global_config.cache_budget is None else global_config.cache_budget * 1024 * 1024
     try:
-        global_config = config.JugglerConfig()
-        global_config.load(os.path.expanduser(args.user_config))
-        
         project_config = config.ProjectConfig()
         project_config.load(os.path.expanduser(os.path.join(args.SOURCE_PATH, 'juggle.xml')))
     except config.ConfigurationError as e:
         messages.ConfigurationErrorDetected(e)
         return -1
         
-    if args.COMMAND == 'fetch':
+    if args.COMMAND in ('fetch', 'plan'):
+        lockfile_path = os.path.join(args.SOURCE_PATH, lockfile.get_lockfile_filename())
+        stdout = sys.stdout
+        if args.COMMAND == 'plan' and args.plan_output is None:
+            # the plan is all that goes to stdout, everything else is printed to stderr
+            sys.stdout = sys.stderr
         try:
-            messages.FetchingRequiredPackages(global_config.local_repository, global_config.remote_repositories)
-            dep_manager = dependency.DependencyManager(global_config.local_repository, global_config.remote_repositories)
-            dep_manager.deploy(project_config.required_packages, deployment_path, args.do_not_use_local_builds, args.flavor)
-        except dependency.RequiredPackageNotAvailable as e:
+            download_threads = global_config.download_threads
+            if args.download_threads is not None:
+                download_threads = max(1, args.download_threads)
+            if args.frozen:
+                locked_packages = lockfile.load_lockfile(lockfile_path)
+                lockfile.check_lockfile(locked_packages, project_config.required_packages, args.flavor)
+                messages.FetchingLockedPackages(global_config.local_repository, lockfile_path)
+                dep_manager = dependency.DependencyManager(global_config.local_repository, [], download_threads,
+                                                           deploy_mode=global_config.deploy_mode, cache_budget=cache_budget,
+                                                           listing_cache=listing_cache)
+                resolved = dep_manager.resolve_locked(locked_packages)
+            else:
+                messages.FetchingRequiredPackages(global_config.local_repository, global_config.remote_repositories)
+                dep_manager = dependency.DependencyManager(global_config.local_repository,
+                                                           global_config.remote_repositories,
+                                                           download_threads,
+                                                           global_config.listing_max_age,
+                                                           [package['name'] for package in project_config.required_packages],
+                                                           args.flavor,
+                                                           global_config.deploy_mode,
+                                                           global_config.remote_priorities,
+                                                           global_config.remote_timeouts,
+                                                           global_config.range_connections,
+                                                           global_config.stream_extraction,
+                                                           cache_budget,
+                                                           listing_cache)
+                resolved = dep_manager.resolve_dependencies(project_config.required_packages, args.do_not_use_local_builds, args.flavor)
+            if args.COMMAND == 'plan':
+                planned = dep_manager.plan_resolved(resolved, deployment_path)
+                stale = dependency.get_stale_packages(deployment_path, [package['name'] for package in planned])
+                sys.stdout = stdout
+                write_plan(args.plan_output, args.flavor, deployment_path, planned, stale)
+            else:
+                locked_packages = dep_manager.deploy_resolved(resolved, deployment_path)
+                if not args.frozen:
+                    lockfile.store_lockfile(lockfile_path, locked_packages)
+        except (dependency.RequiredPackageNotAvailable, lockfile.LockfileError) as e:
             messages.FetchingFailed(e)
             return -1
+        finally:
+            sys.stdout = stdout
     elif args.COMMAND == 'publish':
         try:
             name = project_config.name
             version = project_config.get_publishing_version(args.build_number)
             flavor = args.flavor
-            repo = global_config.local_repository
+            repo = global_config.local_repository if args.remote is None else args.remote
             messages.PublishingProject(name, version, flavor, repo)
+            compression_threads = global_config.compression_threads
+            if args.compression_threads is not None:
+                compression_threads = max(1, args.compression_threads)
+            codec, level = global_config.codec
+            if args.codec is not None:
+                codec, level = compression.parse_codec(args.codec)
             distributer = publisher.Publisher(project_config.content_node, args.SOURCE_PATH, args.BINARY_PATH)
-            distributer.publish(repo, name, version, flavor)
-        except publisher.PackedPathNotFound as e:
+            if args.remote is None:
+                distributer.publish(repo, name, version, flavor, project_config.required_packages, compression_threads, codec, level, args.delta)
+            else:
+                if args.delta:
+                    messages.DeltaSkipped(name, 'deltas are only published to the local repository')
+                timeouts = global_config.remote_timeouts.get(repo, (global_config.connect_timeout, global_config.read_timeout))
+                distributer.publish_remote(repo, name, version, flavor, project_config.required_packages, compression_threads, codec, level,
+                                           timeouts)
+        except (publisher.PackedPathNotFound, publisher.InvalidSourceDateEpoch, compression.UnknownCodec, upload.UploadFailed) as e:
             messages.PublishingFailed(e)
             return -1
     else:
@@ -0,0 +1,147 @@
+"""
+    Juggler - Dirty dependency management and packaging for compiled code
+    Copyright (C) 2014  Christian Meyer
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import time
+from juggler import listing, store
+
+'''
+access log of a local repository, one line per use of an archive by a fetch
+
+    RequiredPackage_vanilla-1.0.0-b3.tar.gz 1427025600.0
+
+Lines are appended in a single write while holding the shared lock of the listing, so concurrent
+fetches do not garble each other. The last
+line of an archive gives its last use, archives missing from the log count as used when they
+were written. Collecting garbage rewrites the log with one line per remaining archive.
+'''
+def get_access_log_filename():
+    return 'juggler_access.log'
+
+def record_access(local_repository, archive_filenames, now=None):
+    if not archive_filenames:
+        return
+    now = time.time() if now is None else now
+    lines = ''.join('%s %r\n' % (os.path.basename(filename), now) for filename in archive_filenames)
+    # fetches share the lock, collecting garbage rewrites the log under the exclusive lock
+    with listing.ListingLock(local_repository, exclusive=False):
+        with open(os.path.join(local_repository, get_access_log_filename()), 'ab') as access_log:
+            access_log.write(lines)
+
+def load_access_times(local_repository):
+    access_times = {}
+    filename = os.path.join(local_repository, get_access_log_filename())
+    if not os.path.isfile(filename):
+        return access_times
+    with open(filename, 'rb') as access_log:
+        lines = access_log.read().split('\n')
+    for line in lines[:-1]:
+        archive_filename, _, accessed = line.rpartition(' ')
+        try:
+            access_times[archive_filename] = max(float(accessed), access_times.get(archive_filename, 0))
+        except ValueError:
+            continue
+    return access_times
+
+def get_tree_size(path):
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            size += os.lstat(os.path.join(dirpath, filename)).st_size
+    return size
+
+class CachedBuild():
+    def __init__(self, info, build, attributes, requirements, archive_filename, store_path, last_access):
+        self.info = info
+        self.build = build
+        self.attributes = attributes
+        self.requirements = requirements
+        self.archive_filename = archive_filename
+        self.store_path = store_path
+        self.last_access = last_access
+        self.size = os.path.getsize(archive_filename) + get_tree_size(store_path)
+
+    def is_downloaded(self):
+        return 'origin' in self.attributes
+
+    def get_name(self):
+        return self.info.get_name()
+
+    def get_flavor(self):
+        return self.info.get_flavor()
+
+def collect_garbage(local_repository, budget, include_published=False, keep=()):
+    '''
+    removes the least recently used downloaded builds from the local repository until its archives and
+    their store extractions take up at most budget bytes. Builds published to this repository are only
+    removed with include_published, archives named in keep never. Returns the removed CachedBuilds.
+    '''
+    package_store = store.PackageStore(store.get_store_directory(local_repository), None)
+    keep = set(os.path.basename(filename) for filename in keep)
+    with listing.ListingLock(local_repository):
+        current = listing.load_snapshot(local_repository)
+        listing.replay_journal(local_repository, current)
+        access_times = load_access_times(local_repository)
+
+        cached_builds = []
+        uncached_builds = []
+        for info in current.get_package_infos():
+            for build, attributes, requirements in info.iter_builds():
+                entry = info.make_entry(build)
+                archive_filename = os.path.join(local_repository, entry.get_filename())
+                if not os.path.isfile(archive_filename):
+                    uncached_builds.append((info, build, attributes, requirements))
+                    continue
+                last_access = access_times.get(entry.get_filename(), os.path.getmtime(archive_filename))
+                cached_builds.append(CachedBuild(info, build, attributes, requirements, archive_filename,
+                                                 package_store.get_path(entry), last_access))
+
+        usage = sum(cached.size for cached in cached_builds)
+        evicted = []
+        for cached in sorted(cached_builds, key=lambda cached: cached.last_access):
+            if usage <= budget:
+                break
+            if not (cached.is_downloaded() or include_published) or os.path.basename(cached.archive_filename) in keep:
+                continue
+            os.remove(cached.archive_filename)
+            store.remove_tree(cached.store_path)
+            if os.path.exists(cached.store_path + '.stamp'):
+                os.remove(cached.store_path + '.stamp')
+            usage -= cached.size
+            evicted.append(cached)
+        if not evicted:
+            return evicted
+
+        # the listing only keeps builds whose archives are still there, or were never in this repository
+        evicted_ids = set(id(cached) for cached in evicted)
+        remaining = listing.Listing(local_repository, journaled=True)
+        for info, build, attributes, requirements in uncached_builds:
+            remaining.load_package(info.get_name(), str(build), info.get_flavor(), attributes, requirements)
+        for cached in cached_builds:
+            if not id(cached) in evicted_ids:
+                remaining.load_package(cached.get_name(), str(cached.build), cached.get_flavor(), cached.attributes, cached.requirements)
+        remaining.write_snapshot(local_repository)
+        listing.remove_journal(local_repository)
+
+        remaining_archives = set(os.path.basename(cached.archive_filename) for cached in cached_builds if not id(cached) in evicted_ids)
+        access_log = os.path.join(local_repository, get_access_log_filename())
+        with open(access_log + '.tmp', 'wb') as compacted_log:
+            compacted_log.write(''.join('%s %r\n' % (filename, accessed) for filename, accessed in sorted(access_times.items())
+                                        if filename in remaining_archives))
+        os.rename(access_log + '.tmp', access_log)
+    return evicted
@@ -0,0 +1,209 @@
+"""
+    Juggler - Dirty dependency management and packaging for compiled code
+    Copyright (C) 2014  Christian Meyer
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import mmap
+import json
+import struct
+from juggler import version
+
+'''
+compact listing index, written next to juggler_listing.xml
+
+    header    magic, size and mtime of the XML listing it was built from, counts and section offsets
+    strings   string_count + 1 little endian uint32 offsets into the utf-8 blob that follows them
+    packages  one (name, flavor, first record, record count) entry per name@flavor, sorted by name and flavor
+    records   one (major, minor, patch, prerelease, build, metadata) entry per build, sorted by version within a package
+
+prerelease and build refer to the string table with their identifiers joined by dots, metadata refers to a
+JSON encoded [attributes, requirements] pair. NO_STRING marks an empty component. The index is only used
+while the XML listing still has the recorded size and mtime.
+'''
+MAGIC = 'JUGLIDX2'
+HEADER = struct.Struct('<8sQdIIIQQQ')
+PACKAGE = struct.Struct('<IIII')
+RECORD = struct.Struct('<IIIIII')
+STRING_OFFSET = struct.Struct('<I')
+NO_STRING = 0xFFFFFFFF
+
+class InvalidIndex(Exception):
+    pass
+
+class IndexedBuilds(object):
+    def __init__(self, index, first_record, record_count):
+        self.__index = index
+        self.__first_record = first_record
+        self.__record_count = record_count
+
+    def __len__(self):
+        return self.__record_count
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += self.__record_count
+        if position < 0 or position >= self.__record_count:
+            raise IndexError('build %d is not part of this package' % position)
+        return self.__index.read_version(self.__first_record + position)
+
+    def __iter__(self):
+        for position in xrange(self.__record_count):
+            yield self[position]
+
+    def get_metadata(self, position):
+        return self.__index.read_metadata(self.__first_record + position)
+
+class CompactIndex():
+    def __init__(self, data):
+        self.__data = data
+        if len(data) < HEADER.size:
+            raise InvalidIndex('the index is truncated')
+        (magic, self.__xml_size, self.__xml_mtime, self.__string_count, self.__package_count, self.__record_count,
+         self.__strings_offset, self.__packages_offset, self.__records_offset) = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise InvalidIndex('the index does not start with %s' % MAGIC)
+        if len(data) < self.__records_offset + self.__record_count * RECORD.size:
+            raise InvalidIndex('the index is truncated')
+        self.__blob_offset = self.__strings_offset + (self.__string_count + 1) * STRING_OFFSET.size
+        self.__versions = {}
+
+    def matches(self, xml_stat):
+        return self.__xml_size == xml_stat.st_size and self.__xml_mtime == xml_stat.st_mtime
+
+    def is_empty(self):
+        return self.__package_count == 0
+
+    def read_string(self, string_index):
+        if string_index == NO_STRING:
+            return None
+        position = self.__strings_offset + string_index * STRING_OFFSET.size
+        begin = STRING_OFFSET.unpack_from(self.__data, position)[0]
+        end = STRING_OFFSET.unpack_from(self.__data, position + STRING_OFFSET.size)[0]
+        return self.__data[self.__blob_offset + begin:self.__blob_offset + end]
+
+    def read_version(self, record_index):
+        major, minor, patch, prerelease, build, _ = RECORD.unpack_from(self.__data, self.__records_offset + record_index * RECORD.size)
+        version_string = '%d.%d.%d' % (major, minor, patch)
+        if prerelease != NO_STRING:
+            version_string += '-' + self.read_string(prerelease)
+        if build != NO_STRING:
+            version_string += '+' + self.read_string(build)
+        return version.intern_version(version_string, self.__versions)
+
+    def read_metadata(self, record_index):
+        metadata = RECORD.unpack_from(self.__data, self.__records_offset + record_index * RECORD.size)[5]
+        if metadata == NO_STRING:
+            return ({}, [])
+        attributes, requirements = json.loads(self.read_string(metadata))
+        return (attributes, [tuple(requirement) for requirement in requirements])
+
+    def read_package(self, package_index):
+        return PACKAGE.unpack_from(self.__data, self.__packages_offset + package_index * PACKAGE.size)
+
+    def get_keys(self):
+        keys = []
+        for package_index in xrange(self.__package_count):
+            name, flavor, _, _ = self.read_package(package_index)
+            keys.append((self.read_string(name).decode('utf-8'), self.read_string(flavor).decode('utf-8')))
+        return keys
+
+    def get_builds(self, name, flavor):
+        wanted = (name.encode('utf-8'), flavor.encode('utf-8'))
+        low = 0
+        high = self.__package_count
+        while low < high:
+            middle = (low + high) // 2
+            name_index, flavor_index, first_record, record_count = self.read_package(middle)
+            current = (self.read_string(name_index), self.read_string(flavor_index))
+            if current < wanted:
+                low = middle + 1
+            elif current > wanted:
+                high = middle
+            else:
+                return IndexedBuilds(self, first_record, record_count)
+        return None
+
+def get_index_filename():
+    return 'juggler_listing.idx'
+
+def write_index(filename, packages, xml_stat):
+    '''packages is an iterable of (name, flavor, builds), builds yields (version, attributes, requirements) sorted by version'''
+    strings = {}
+    blob = []
+    blob_size = [0]
+    def intern_string(value):
+        if value is None:
+            return NO_STRING
+        encoded = value.encode('utf-8') if isinstance(value, unicode) else value
+        if not encoded in strings:
+            strings[encoded] = len(blob)
+            blob.append(encoded)
+            blob_size[0] += len(encoded)
+        return strings[encoded]
+
+    package_entries = []
+    records = []
+    for name, flavor, builds in packages:
+        first_record = len(records)
+        for build, attributes, requirements in builds:
+            metadata = None
+            if attributes or requirements:
+                metadata = json.dumps([attributes, requirements], sort_keys=True)
+            records.append(RECORD.pack(build.major, build.minor, build.patch,
+                                       intern_string('.'.join(build.prerelease) if build.prerelease else None),
+                                       intern_string('.'.join(build.build) if build.build else None),
+                                       intern_string(metadata)))
+        package_entries.append(((name.encode('utf-8'), flavor.encode('utf-8')),
+                                intern_string(name), intern_string(flavor), first_record, len(records) - first_record))
+    package_entries.sort()
+
+    strings_offset = HEADER.size
+    packages_offset = strings_offset + (len(blob) + 1) * STRING_OFFSET.size + blob_size[0]
+    records_offset = packages_offset + len(package_entries) * PACKAGE.size
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'wb') as index_file:
+        index_file.write(HEADER.pack(MAGIC, xml_stat.st_size, xml_stat.st_mtime, len(blob), len(package_entries), len(records),
+                                     strings_offset, packages_offset, records_offset))
+        offset = 0
+        for value in blob:
+            index_file.write(STRING_OFFSET.pack(offset))
+            offset += len(value)
+        index_file.write(STRING_OFFSET.pack(offset))
+        index_file.write(''.join(blob))
+        for _, name_index, flavor_index, first_record, record_count in package_entries:
+            index_file.write(PACKAGE.pack(name_index, flavor_index, first_record, record_count))
+        index_file.write(''.join(records))
+    os.rename(temp_filename, filename)
+
+def open_index(filename, xml_stat):
+    '''returns None if there is no usable index for the XML listing with the given stat'''
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, 'rb') as index_file:
+        try:
+            data = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (mmap.error, ValueError):
+            return None
+    try:
+        index = CompactIndex(data)
+    except (InvalidIndex, struct.error):
+        data.close()
+        return None
+    if not index.matches(xml_stat):
+        data.close()
+        return None
+    return index
@@ -0,0 +1,196 @@
+"""
+    Juggler - Dirty dependency management and packaging for compiled code
+    Copyright (C) 2014  Christian Meyer
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import zlib
+import struct
+import tarfile
+import collections
+from multiprocessing.pool import ThreadPool
+
+BLOCK_SIZE = 1024 * 1024
+DEFAULT_GZIP_LEVEL = 6
+
+# archives of listings without a codec attribute are gzip compressed
+DEFAULT_CODEC = 'gz'
+EXTENSIONS = {'tar': '.tar', 'gz': '.tar.gz', 'bz2': '.tar.bz2', 'xz': '.tar.xz'}
+LEVELS = {'gz': range(0, 10), 'bz2': range(1, 10), 'xz': range(0, 10)}
+
+class UnknownCodec(Exception):
+    pass
+
+def get_supported_codecs():
+    # xz needs a tarfile with lzma support, which python 2 does not ship
+    return sorted(codec for codec in EXTENSIONS if codec in tarfile.TarFile.OPEN_METH)
+
+def parse_codec(string):
+    '''parses codec names like gz, gz:9 or bz2, returns the codec and its level or None'''
+    codec, _, level_string = string.strip().partition(':')
+    if not codec in EXTENSIONS:
+        raise UnknownCodec('%s is not a codec I know, use one of %s' % (codec, ', '.join(sorted(EXTENSIONS))))
+    if not codec in get_supported_codecs():
+        raise UnknownCodec('The python running me can not write %s archives' % codec)
+    if not level_string:
+        return codec, None
+    level = int(level_string) if level_string.isdigit() else None
+    if not level in LEVELS.get(codec, []):
+        raise UnknownCodec('%s is not a valid compression level for %s' % (level_string, codec))
+    return codec, level
+
+def get_extension(codec):
+    return EXTENSIONS.get(codec, '.tar.%s' % codec)
+
+class CompressorWriter(object):
+    '''write only file object passing everything through a compressor object of bz2 or lzma'''
+    def __init__(self, fileobj, compressor):
+        self.__fileobj = fileobj
+        self.__compressor = compressor
+
+    def write(self, data):
+        compressed = self.__compressor.compress(data)
+        if compressed:
+            self.__fileobj.write(compressed)
+
+    def close(self):
+        self.__fileobj.write(self.__compressor.flush())
+
+    def abort(self):
+        pass
+
+def get_compressing_writer(fileobj, codec, level, threads):
+    if codec == 'gz':
+        # tarfile would put the current time and the file name into the gzip header
+        return ParallelGzipWriter(fileobj, threads, DEFAULT_GZIP_LEVEL if level is None else level)
+    if codec == 'bz2':
+        import bz2
+        return CompressorWriter(fileobj, bz2.BZ2Compressor(9 if level is None else level))
+    if codec == 'xz':
+        import lzma
+        return CompressorWriter(fileobj, lzma.LZMACompressor(preset=level))
+    return None
+
+def write_archive_to(fileobj, codec, level, threads, pack):
+    '''pack(archive) has to add the members, equal members give equal bytes whatever the number of threads'''
+    if not codec in get_supported_codecs():
+        raise UnknownCodec('The python running me can not write %s archives' % codec)
+    writer = get_compressing_writer(fileobj, codec, level, threads)
+    try:
+        archive = tarfile.open(fileobj=writer or fileobj, mode='w|')
+        pack(archive)
+        archive.close()
+    except:
+        if writer is not None:
+            writer.abort()
+        raise
+    if writer is not None:
+        writer.close()
+
+def write_archive(filename, codec, level, threads, pack):
+    with open(filename, 'wb') as archive_file:
+        write_archive_to(archive_file, codec, level, threads, pack)
+
+def open_archive(filename, codec, stream=False):
+    '''streamed archives can only be read front to back, but do not need to seek in the decompressed data'''
+    if not codec in get_supported_codecs():
+        raise UnknownCodec('I can not read %s, the python running me does not support %s archives' % (filename, codec))
+    separator = '|' if stream else ':'
+    return tarfile.open(filename, mode='r' + separator if codec == 'tar' else 'r%s%s' % (separator, codec))
+
+def open_stream(fileobj, codec):
+    '''reads an archive front to back from a file object that can not seek, like a network response'''
+    if not codec in get_supported_codecs():
+        raise UnknownCodec('I can not read this archive, the python running me does not support %s archives' % codec)
+    return tarfile.open(fileobj=fileobj, mode='r|' if codec == 'tar' else 'r|%s' % codec)
+
+def compress_block(data, level, last):
+    # every block gets a compressor of its own, the sync flush ends it on a byte boundary
+    # so the raw deflate output of consecutive blocks forms one valid deflate stream
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+class ParallelGzipWriter(object):
+    '''
+    Write only file object producing a single member gzip stream. The input is cut into blocks that
+    are deflated independently on a pool of threads, zlib releases the GIL while it compresses.
+    The output does not depend on the number of threads.
+    '''
+    def __init__(self, fileobj, threads=1, level=6, block_size=BLOCK_SIZE):
+        self.__fileobj = fileobj
+        self.__threads = threads
+        self.__level = level
+        self.__block_size = block_size
+        self.__buffer = []
+        self.__buffered = 0
+        self.__crc = zlib.crc32('')
+        self.__size = 0
+        self.__pending = collections.deque()
+        self.__pool = ThreadPool(threads) if threads > 1 else None
+        self.__closed = False
+        # magic, deflate, no flags, no mtime, no extra flags, unknown OS
+        self.__fileobj.write('\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff')
+
+    def write(self, data):
+        if not data:
+            return
+        self.__crc = zlib.crc32(data, self.__crc)
+        self.__size += len(data)
+        self.__buffer.append(data)
+        self.__buffered += len(data)
+        while self.__buffered >= self.__block_size:
+            pending = ''.join(self.__buffer)
+            self.__buffer = [pending[self.__block_size:]]
+            self.__buffered = len(pending) - self.__block_size
+            self.__submit(pending[:self.__block_size], False)
+
+    def __submit(self, block, last):
+        if self.__pool is None:
+            self.__fileobj.write(compress_block(block, self.__level, last))
+            return
+        self.__pending.append(self.__pool.apply_async(compress_block, (block, self.__level, last)))
+        # bounds the memory spent on blocks that wait for their predecessors
+        while len(self.__pending) > 2 * self.__threads:
+            self.__fileobj.write(self.__pending.popleft().get())
+
+    def close(self):
+        if self.__closed:
+            return
+        self.__closed = True
+        try:
+            self.__submit(''.join(self.__buffer), True)
+            self.__buffer = []
+            while self.__pending:
+                self.__fileobj.write(self.__pending.popleft().get())
+            self.__fileobj.write(struct.pack('<II', self.__crc & 0xFFFFFFFF, self.__size & 0xFFFFFFFF))
+        finally:
+            if self.__pool is not None:
+                self.__pool.close()
+                self.__pool.join()
+
+    def __enter__(self):
+        return self
+
+    def abort(self):
+        self.__closed = True
+        if self.__pool is not None:
+            self.__pool.terminate()
+            self.__pool.join()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
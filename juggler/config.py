@@ -19,6 +19,9 @@
 from exceptions import Exception
 import os
 import version
+import compression
+import download
+import store
 from xml.etree import ElementTree
 
 class ConfigurationError(Exception):
@@ -39,6 +42,7 @@ example project configuration
         <BinaryPath target=lib>build/libProject.a</Path>
         <SourcePath target=script>script/myscript.sh</Path>
         <Headers target=include/myproject>thisproject/mypublicheaders</Headers>
+        <Headers target=include/other include="*.hpp *.inl" exclude="detail/*">thisproject/otherheaders</Headers> <!-- include defaults to common C and C++ header extensions -->
     </Content>
 </Project>
 '''
@@ -94,15 +98,37 @@ example juggler configuration
     <Remote>
         http://readonly.url.to.server/somewhere
     </Remote>
-    <Remote>
+    <Remote priority="-1" connect_timeout="2" read_timeout="10"> <!-- optional, remotes of higher priority are asked first, only if none of their builds fits the next priority is tried, defaults to 0 -->
         http://readonly.url.to.server/somewhereelse
     </Remote>
+    <DownloadThreads>4</DownloadThreads> <!-- optional, defaults to 1 -->
+    <RangeConnections>4</RangeConnections> <!-- optional, connections downloading the byte ranges of one large archive, spread over every remote serving the identical archive, defaults to 1 -->
+    <ListingMaxAge>300</ListingMaxAge> <!-- optional, seconds before cached remote listings are revalidated, defaults to 0 -->
+    <ConnectTimeout>10</ConnectTimeout> <!-- optional, seconds to wait for a remote to accept the connection, the connect_timeout of a Remote overrides it, defaults to 10 -->
+    <ReadTimeout>60</ReadTimeout> <!-- optional, seconds to wait for a remote to send more data, the read_timeout of a Remote overrides it, defaults to 60 -->
+    <CompressionThreads>4</CompressionThreads> <!-- optional, threads compressing published archives, defaults to 1 -->
+    <CacheBudget>10240</CacheBudget> <!-- optional, MiB the archives and store of the local repository may take, every fetch removes the least recently used downloaded builds beyond it, unlimited by default -->
+    <StreamExtraction>true</StreamExtraction> <!-- optional, extract downloaded archives while they arrive instead of after the download, defaults to false -->
+    <DeployMode>symlink</DeployMode> <!-- optional, extract, symlink or hardlink, see store.py, defaults to extract -->
+    <Codec>gz:6</Codec> <!-- optional, tar, gz, bz2 or xz with an optional level, codec of published archives, defaults to gz -->
 </Repositories>
 '''
 class JugglerConfig:
     def __init__(self):
         self.local_repository = None
         self.remote_repositories = []
+        self.remote_priorities = {}
+        self.remote_timeouts = {}
+        self.connect_timeout = download.DEFAULT_CONNECT_TIMEOUT
+        self.read_timeout = download.DEFAULT_READ_TIMEOUT
+        self.download_threads = 1
+        self.range_connections = 1
+        self.stream_extraction = False
+        self.cache_budget = None
+        self.listing_max_age = 0
+        self.compression_threads = 1
+        self.codec = (compression.DEFAULT_CODEC, None)
+        self.deploy_mode = 'extract'
 
     def load(self, filename):
         if not os.path.isfile(filename):
@@ -122,5 +148,65 @@ class JugglerConfig:
         else:
             os.mkdir(self.local_repository)
         
+        self.download_threads = parse_integer(root, 'DownloadThreads', self.download_threads, 1)
+        self.range_connections = parse_integer(root, 'RangeConnections', self.range_connections, 1)
+        self.stream_extraction = parse_boolean(root, 'StreamExtraction', self.stream_extraction)
+        self.cache_budget = parse_integer(root, 'CacheBudget', self.cache_budget, 0)
+        self.listing_max_age = parse_integer(root, 'ListingMaxAge', self.listing_max_age, 0)
+        self.connect_timeout = parse_integer(root, 'ConnectTimeout', self.connect_timeout, 1)
+        self.read_timeout = parse_integer(root, 'ReadTimeout', self.read_timeout, 1)
+
         for item in root.findall('Remote'):
-            self.remote_repositories.append(item.text.strip())
+            url = item.text.strip()
+            self.remote_repositories.append(url)
+            try:
+                self.remote_priorities[url] = int(item.attrib.get('priority', 0))
+            except ValueError:
+                raise ConfigurationError("The priority given for the remote repository %s in my configuration (%s) is not an integer." % (url, item.attrib['priority']))
+            self.remote_timeouts[url] = (parse_timeout(item, 'connect_timeout', self.connect_timeout),
+                                         parse_timeout(item, 'read_timeout', self.read_timeout))
+
+        self.compression_threads = parse_integer(root, 'CompressionThreads', self.compression_threads, 1)
+        deploy_mode_element = root.find('DeployMode')
+        if deploy_mode_element is not None:
+            self.deploy_mode = (deploy_mode_element.text or '').strip()
+            if not self.deploy_mode in store.DEPLOY_MODES:
+                raise ConfigurationError("The deploy mode given in my configuration (%s) is not one of %s." % (self.deploy_mode, ', '.join(store.DEPLOY_MODES)))
+        codec_element = root.find('Codec')
+        if codec_element is not None:
+            try:
+                self.codec = compression.parse_codec(codec_element.text or '')
+            except compression.UnknownCodec as e:
+                raise ConfigurationError("The codec given in my configuration is not usable: %s" % e)
+
+def parse_integer(root, tag, default, minimum):
+    element = root.find(tag)
+    if element is None:
+        return default
+    try:
+        value = int(element.text.strip())
+    except (AttributeError, ValueError):
+        value = minimum - 1
+    if value < minimum:
+        raise ConfigurationError("The value given for %s in my configuration (%s) is not an integer of at least %d." % (tag, element.text, minimum))
+    return value
+
+def parse_boolean(root, tag, default):
+    element = root.find(tag)
+    if element is None:
+        return default
+    value = (element.text or '').strip().lower()
+    if not value in ('true', 'false'):
+        raise ConfigurationError("The value given for %s in my configuration (%s) is neither true nor false." % (tag, element.text))
+    return value == 'true'
+
+def parse_timeout(remote, attribute, default):
+    if not attribute in remote.attrib:
+        return default
+    try:
+        value = int(remote.attrib[attribute])
+    except ValueError:
+        value = 0
+    if value < 1:
+        raise ConfigurationError("The %s given for the remote repository %s in my configuration (%s) is not a positive integer." % (attribute, remote.text.strip(), remote.attrib[attribute]))
+    return value
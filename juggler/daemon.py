@@ -0,0 +1,185 @@
+"""
+    Juggler - Dirty dependency management and packaging for compiled code
+    Copyright (C) 2014  Christian Meyer
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import signal
+import socket
+import threading
+
+'''
+juggler daemon, keeping parsed listings and resolutions in memory between commands
+
+    juggler daemon                         serves on ~/.juggler/daemon.sock until it is terminated
+    juggler fetch SOURCE_PATH BINARY_PATH  is run by the daemon if one is serving
+
+The client sends its arguments, working directory and environment as a line of JSON. The daemon runs the command
+in its own process with them, one command at a time, and answers with lines of JSON: {"output": ...} for what
+the command prints, {"error": ...} for what it prints to stderr and {"exit": ...} once it is done. Nothing but the standard library is imported
+here, so handing a command to the daemon does not pay for loading the rest of juggler.
+'''
+DEFAULT_SOCKET_PATH = '~/.juggler/daemon.sock'
+
+class DaemonFailed(Exception):
+    pass
+
+def connect(socket_path):
+    '''returns a socket connected to the daemon, None if no daemon is serving on socket_path'''
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except socket.error:
+        connection.close()
+        return None
+    return connection
+
+def forward(socket_path, argv, output=None, error_output=None):
+    '''runs the command on the daemon, returns its exit code or None if there is no daemon to run it'''
+    socket_path = os.path.expanduser(socket_path)
+    connection = connect(socket_path)
+    if connection is None:
+        return None
+    output = output or sys.stdout
+    error_output = error_output or sys.stderr
+    try:
+        # latin-1 maps every byte to a character, so variables that are no valid utf-8 arrive unchanged
+        environment = dict((key.decode('latin-1'), value.decode('latin-1')) for key, value in os.environ.items())
+        connection.sendall(json.dumps({'argv': list(argv), 'cwd': os.getcwd(), 'env': environment}) + '\n')
+        for line in connection.makefile('rb'):
+            answer = json.loads(line)
+            if 'exit' in answer:
+                return answer['exit']
+            if 'error' in answer:
+                error_output.write(answer['error'].encode('utf-8'))
+                error_output.flush()
+            else:
+                output.write(answer.get('output', u'').encode('utf-8'))
+                output.flush()
+    except (socket.error, ValueError) as error:
+        raise DaemonFailed('The juggler daemon on %s failed: %s' % (socket_path, error))
+    finally:
+        connection.close()
+    raise DaemonFailed('The juggler daemon on %s stopped before the command was done' % socket_path)
+
+class ConnectionWriter():
+    '''stands in for sys.stdout or sys.stderr while the daemon runs a command, sends complete lines to the client'''
+    def __init__(self, connection, stream, lock):
+        self.__connection = connection
+        self.__stream = stream
+        self.__pending = ''
+        # downloading threads print as well, and both streams share the connection
+        self.__lock = lock
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        with self.__lock:
+            self.__pending += data
+            lines, newline, self.__pending = self.__pending.rpartition('\n')
+            if newline:
+                self.send({self.__stream: (lines + newline).decode('utf-8', 'replace')})
+
+    def flush(self):
+        pass
+
+    def close(self):
+        with self.__lock:
+            if self.__pending:
+                self.send({self.__stream: self.__pending.decode('utf-8', 'replace')})
+                self.__pending = ''
+
+    def send(self, answer):
+        try:
+            self.__connection.sendall(json.dumps(answer) + '\n')
+        except socket.error:
+            # the client went away, the command is still run to the end
+            pass
+
+def get_exit_code(exit):
+    if exit.code is None:
+        return 0
+    return exit.code if isinstance(exit.code, int) else 1
+
+def handle(connection, run):
+    try:
+        request = json.loads(connection.makefile('rb').readline())
+        argv = [str(argument) for argument in request['argv']]
+        cwd = request['cwd']
+        environment = dict((key.encode('latin-1'), value.encode('latin-1')) for key, value in request['env'].items())
+    except (socket.error, ValueError, KeyError, TypeError, AttributeError, UnicodeError):
+        return
+    lock = threading.Lock()
+    writer = ConnectionWriter(connection, 'output', lock)
+    error_writer = ConnectionWriter(connection, 'error', lock)
+    stdout, stderr, daemon_cwd = sys.stdout, sys.stderr, os.getcwd()
+    # SOURCE_DATE_EPOCH, HOME for ~ and the proxies have to be those of the client
+    daemon_environment = dict(os.environ)
+    sys.stdout, sys.stderr = writer, error_writer
+    try:
+        os.environ.clear()
+        os.environ.update(environment)
+        os.chdir(cwd)
+        exit_code = run(argv)
+    except SystemExit as exit:
+        # argparse exits on invalid arguments
+        exit_code = get_exit_code(exit)
+    except Exception:
+        import traceback
+        traceback.print_exc()
+        exit_code = -1
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        os.chdir(daemon_cwd)
+        os.environ.clear()
+        os.environ.update(daemon_environment)
+    writer.close()
+    error_writer.close()
+    writer.send({'exit': exit_code})
+
+def serve(socket_path, run):
+    '''runs run(argv) for every client connecting to socket_path until the process is terminated'''
+    socket_path = os.path.expanduser(socket_path)
+    if os.path.exists(socket_path):
+        running = connect(socket_path)
+        if running is not None:
+            running.close()
+            raise DaemonFailed('Another juggler daemon is serving on %s' % socket_path)
+        # left behind by a daemon that was killed
+        os.remove(socket_path)
+    if not os.path.isdir(os.path.dirname(socket_path)):
+        os.makedirs(os.path.dirname(socket_path))
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # commands are run as the user of the daemon, nobody else may connect
+    umask = os.umask(0177)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(umask)
+    server.listen(64)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            connection, _ = server.accept()
+            try:
+                handle(connection, run)
+            finally:
+                connection.close()
+    finally:
+        server.close()
+        os.remove(socket_path)
@@ -0,0 +1,165 @@
+"""
+    Juggler - Dirty dependency management and packaging for compiled code
+    Copyright (C) 2014  Christian Meyer
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+import tarfile
+import StringIO
+from juggler import compression
+from xml.etree import ElementTree
+
+'''
+A delta archive turns the archive of one build (the base) into the archive of a later build of the
+same package. It is an archive of the later build's codec holding
+
+    .juggler_delta.xml   the members of the later archive in order and where each one comes from
+    ...                  every member that is not an identical regular file of the base, in order
+
+<Delta base="1.0.0-b1">
+    <Member name="lib/libProject.a" source="delta"/>
+    <Member name="include/project/a.h" source="base"/>
+</Delta>
+
+Archives written by juggler are reproducible, so putting the members back together and compressing
+them with the codec and level of the later build gives back its archive byte for byte. Consumers
+check that against the digest in the listing before they trust it.
+'''
+DELTA_MANIFEST = '.juggler_delta.xml'
+
+class InvalidDelta(Exception):
+    pass
+
+def get_member_key(member):
+    # everything the tar header of a member is made of, besides its content
+    return (member.name, member.type, member.mode, member.uid, member.gid, member.uname, member.gname,
+            member.mtime, member.size, member.linkname)
+
+def hash_member(archive, member):
+    digest = hashlib.sha256()
+    data = archive.extractfile(member)
+    while True:
+        chunk = data.read(1024 * 1024)
+        if not chunk:
+            break
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def read_member_digests(filename, codec):
+    members = {}
+    archive = compression.open_archive(filename, codec, stream=True)
+    try:
+        while True:
+            member = archive.next()
+            if member is None:
+                break
+            if member.isreg():
+                members[member.name] = (get_member_key(member), hash_member(archive, member))
+    finally:
+        archive.close()
+    return members
+
+def create_delta(base_filename, base_codec, base_version, full_filename, codec, level, delta_filename):
+    '''writes the delta from the base archive to the full one, returns the number of members taken from the base'''
+    base_members = read_member_digests(base_filename, base_codec)
+    root = ElementTree.Element('Delta', {'base': base_version})
+    from_base = 0
+    archive = compression.open_archive(full_filename, codec, stream=True)
+    try:
+        while True:
+            member = archive.next()
+            if member is None:
+                break
+            source = 'delta'
+            if member.isreg() and member.name in base_members:
+                key, digest = base_members[member.name]
+                if key == get_member_key(member) and digest == hash_member(archive, member):
+                    source = 'base'
+                    from_base += 1
+            ElementTree.SubElement(root, 'Member', {'name': member.name, 'source': source})
+    finally:
+        archive.close()
+    manifest = ElementTree.tostring(root, encoding='utf-8')
+
+    def pack(delta_archive):
+        info = tarfile.TarInfo(DELTA_MANIFEST)
+        info.size = len(manifest)
+        delta_archive.addfile(info, StringIO.StringIO(manifest))
+        full_archive = compression.open_archive(full_filename, codec, stream=True)
+        try:
+            for element in root.findall('Member'):
+                member = full_archive.next()
+                if element.get('source') == 'delta':
+                    delta_archive.addfile(member, full_archive.extractfile(member) if member.isreg() else None)
+        finally:
+            full_archive.close()
+    compression.write_archive(delta_filename, codec, level, 1, pack)
+    return from_base
+
+class BaseReader():
+    '''
+    hands out the members of the base archive by name while reading it front to back. Deltas list
+    members in the order of the base archive unless the content of the package was rearranged, only
+    then the base is read again from the start.
+    '''
+    def __init__(self, filename, codec):
+        self.__filename = filename
+        self.__codec = codec
+        self.__archive = compression.open_archive(filename, codec, stream=True)
+
+    def get(self, name):
+        for restart in (False, True):
+            if restart:
+                self.__archive.close()
+                self.__archive = compression.open_archive(self.__filename, self.__codec, stream=True)
+            while True:
+                member = self.__archive.next()
+                if member is None:
+                    break
+                if member.name == name and member.isreg():
+                    return member, self.__archive.extractfile(member)
+        raise InvalidDelta('The base archive %s does not contain %s' % (self.__filename, name))
+
+    def close(self):
+        self.__archive.close()
+
+def apply_delta(base_filename, base_codec, delta_filename, codec, level, target_filename):
+    delta_archive = compression.open_archive(delta_filename, codec, stream=True)
+    try:
+        first = delta_archive.next()
+        if first is None or first.name != DELTA_MANIFEST:
+            raise InvalidDelta('%s does not start with %s' % (delta_filename, DELTA_MANIFEST))
+        try:
+            root = ElementTree.fromstring(delta_archive.extractfile(first).read())
+        except ElementTree.ParseError as error:
+            raise InvalidDelta('Unable to parse the manifest of %s: %s' % (delta_filename, error))
+        base = BaseReader(base_filename, base_codec)
+        try:
+            def pack(full_archive):
+                for element in root.findall('Member'):
+                    if element.get('source') == 'base':
+                        member, data = base.get(element.get('name'))
+                    else:
+                        member = delta_archive.next()
+                        if member is None or member.name != element.get('name'):
+                            raise InvalidDelta('%s does not contain %s where I expected it' % (delta_filename, element.get('name')))
+                        data = delta_archive.extractfile(member) if member.isreg() else None
+                    full_archive.addfile(member, data)
+            compression.write_archive(target_filename, codec, level, 1, pack)
+        finally:
+            base.close()
+    finally:
+        delta_archive.close()
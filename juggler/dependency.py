@@ -16,77 +16,611 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import cache
+import compression
+import delta
+import download
 import listing
+import manifest
 import messages
+import resolver
+import store
+import tracing
+import version
 import os
+import sys
 import urllib
 import tarfile
-import shutil
+import threading
+import Queue
 
 class RequiredPackageNotAvailable(Exception):
     pass
 
+def get_stale_packages(target_directory, required_names):
+    '''the deployed packages that are not required anymore'''
+    if not os.path.isdir(target_directory):
+        return []
+    stale = []
+    for name in sorted(os.listdir(target_directory)):
+        stale_dir = os.path.join(target_directory, name)
+        if name in required_names or not (os.path.isdir(stale_dir) or os.path.islink(stale_dir)):
+            continue
+        stale.append(name)
+    return stale
+
 class DependencyManager:
-    def __init__(self, local_repository, remote_repositories):
+    def __init__(self, local_repository, remote_repositories, download_threads=1, listing_max_age=0, wanted_names=None, flavor=None,
+                 deploy_mode='extract', remote_priorities=None, remote_timeouts=None, range_connections=1, stream_extraction=False,
+                 cache_budget=None, listing_cache=None):
+        '''listing_cache is the listing.ListingCache of the daemon, listings are loaded from scratch without it'''
+        self.__download_threads = download_threads
+        self.__cache_budget = cache_budget
+        self.__stream_extraction = stream_extraction
+        self.__range_connections = range_connections
+        self.__remote_timeouts = remote_timeouts or {}
+        self.__merged_index = {}
+        self.__store = None
+        if deploy_mode != 'extract':
+            self.__store = store.PackageStore(store.get_store_directory(local_repository), deploy_mode)
+        self.__listing_lock = threading.Lock()
+        self.__listing_cache = listing_cache
         listing.prepare_local_repository(local_repository)
-        self.__local_listing = listing.load_local_listing(local_repository)
+        if listing_cache is None:
+            self.__local_listing = listing.load_local_listing(local_repository)
+        else:
+            self.__local_listing = listing_cache.get_local_listing(local_repository)
+            # cached listings serve every command of the daemon, so they hold all packages
+            wanted_names = None
         self.__remote_listing = []
-        for repo in remote_repositories:
+        self.__remote_priorities = []
+        loaded = self.load_remote_listings(local_repository, remote_repositories, listing_max_age, wanted_names, flavor,
+                                           self.__remote_timeouts)
+        dependency_graph = None if wanted_names is None else {}
+        loaded_remotes = []
+        for repo, cache_directory, remote, graph, error in loaded:
+            if error is not None:
+                messages.UnableToAccessRemoteRepository(repo, error)
+                continue
+            self.__remote_listing.append(remote)
+            self.__remote_priorities.append((remote_priorities or {}).get(repo, 0))
+            loaded_remotes.append((repo, cache_directory))
+            if dependency_graph is not None:
+                for name, required_names in graph.items():
+                    dependency_graph.setdefault(name, set()).update(required_names)
+
+        if wanted_names is not None:
+            # packages required by the wanted ones were skipped while loading, they are picked up from
+            # the cached remote listings in a second pass
+            missing_names = self.collect_required_names(wanted_names, dependency_graph, flavor) - set(wanted_names)
+            if missing_names:
+                for (repo, cache_directory), remote in zip(loaded_remotes, self.__remote_listing):
+                    listing.load_remote_listing(repo, cache_directory, float('inf'), missing_names, flavor, listing=remote)
+
+    def load_remote_listings(self, local_repository, remote_repositories, listing_max_age, wanted_names, flavor, remote_timeouts):
+        '''
+        loads every remote listing on a thread of its own, so fetching takes as long as the slowest
+        remote that answers in time rather than all of them together. Returns (url, cache directory,
+        listing, dependency graph, error) in the order of the remotes, error is None for loaded ones.
+        '''
+        results = [None] * len(remote_repositories)
+        failures = []
+        # remotes mostly offer the same builds, their listings share the versions
+        interned = listing.InternTable()
+
+        def load(index, repo):
+            cache_directory = listing.get_listing_cache_directory(local_repository, repo)
+            graph = None if wanted_names is None else {}
+            timeouts = remote_timeouts.get(repo, download.DEFAULT_TIMEOUTS)
             try:
-                self.__remote_listing.append(listing.load_remote_listing(repo))
+                if self.__listing_cache is None:
+                    remote = listing.load_remote_listing(repo, cache_directory, listing_max_age, wanted_names, flavor, graph,
+                                                         timeouts=timeouts, interned=interned)
+                else:
+                    remote = self.__listing_cache.get_remote_listing(repo, cache_directory, listing_max_age, timeouts)
+                results[index] = (repo, cache_directory, remote, graph, None)
             except listing.FileNotFound as error:
-                messages.UnableToAccessRemoteRepository(repo, error)
+                results[index] = (repo, cache_directory, None, None, error)
+            except:
+                failures.append(sys.exc_info())
+
+        threads = [threading.Thread(target=load, args=(index, repo)) for index, repo in enumerate(remote_repositories)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if failures:
+            # anything but an unreachable remote is raised as if the listings were loaded one by one
+            raise failures[0][0], failures[0][1], failures[0][2]
+        return results
+
+    def collect_required_names(self, names, dependency_graph, flavor):
+        collected = set()
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            if name in collected:
+                continue
+            collected.add(name)
+            required_names = set(dependency_graph.get(name, []))
+            required_names.update(self.__local_listing.get_required_names(name, flavor or 'vanilla'))
+            pending.extend(required_names - collected)
+        return collected
 
     def deploy(self, required_packages, target_directory, ignore_local_builds, flavor):
-        for package in required_packages:
-            source_info = self.resolve_source(ignore_local_builds, flavor, package)
-            archive_filename = self.fetch_archive(source_info)
-            extract_dir = os.path.join(target_directory, package['name'])
-            self.extract_archive(archive_filename, extract_dir)
-
-        # TODO remove unused dependencies from project dep folder
-        self.__local_listing.store(self.__local_listing.get_root())
-
-    def resolve_source(self, ignore_local_builds, flavor, package):
-        source_info = self.find_best_source(package, ignore_local_builds, flavor)
-        if source_info is None:
-            raise RequiredPackageNotAvailable('None of the repositories known to me contain the required package %s with version %s' % (package['name'], package['version']))
+        '''resolves and deploys the required packages, returns what has to be recorded in the lockfile'''
+        return self.deploy_resolved(self.resolve_dependencies(required_packages, ignore_local_builds, flavor), target_directory)
+
+    def deploy_locked(self, locked_packages, target_directory):
+        '''deploys exactly the packages recorded in a lockfile, without consulting any listing'''
+        return self.deploy_resolved(self.resolve_locked(locked_packages), target_directory)
+
+    def resolve_locked(self, locked_packages):
+        '''returns (package, source_info) for the packages recorded in a lockfile, like resolve_dependencies'''
+        resolved = []
+        for locked in locked_packages:
+            package = {'name': locked['name'], 'version': version.parse_spec('==%s' % locked['version'])}
+            source_info = self.get_locked_source_info(locked)
+            messages.UsingLockedPackage(locked['name'], locked['flavor'], locked['version'], source_info['package'].get_path())
+            resolved.append((package, source_info))
+        return resolved
+
+    def plan(self, required_packages, target_directory, ignore_local_builds, flavor):
+        '''resolves the required packages like deploy, but only describes what deploying them would do'''
+        return self.plan_resolved(self.resolve_dependencies(required_packages, ignore_local_builds, flavor), target_directory)
+
+    def plan_resolved(self, resolved, target_directory):
+        '''
+        returns a dictionary for every resolved package: the chosen build, the repository and URL it comes
+        from, whether its archive is in the local repository already and whether it is deployed, and the
+        bytes a fetch would download, None if the listing does not tell. Nothing is downloaded or changed.
+        '''
+        deployed = manifest.load_manifest(target_directory)
+        planned = []
+        for package, source_info in resolved:
+            entry = source_info['package']
+            source_url, archive_filename = self.get_archive_location(source_info)
+            cached = os.path.isfile(archive_filename)
+            download_bytes = 0
+            delta_base = None
+            if source_url is not None and not cached:
+                base = self.find_delta_base(entry)
+                if base is not None and entry.get_attribute('delta_size') is not None:
+                    delta_base = str(base.get_version())
+                    download_bytes = int(entry.get_attribute('delta_size'))
+                elif entry.get_attribute('size') is not None:
+                    download_bytes = int(entry.get_attribute('size'))
+                else:
+                    download_bytes = None
+            planned.append({'name': package['name'],
+                            'spec': str(package['version']),
+                            'version': str(entry.get_version()),
+                            'flavor': entry.get_flavor(),
+                            'source_type': source_info['source_type'],
+                            'repository': entry.get_path(),
+                            'url': source_url,
+                            'archive': archive_filename,
+                            'digest': source_info.get('digest', entry.get_attribute('digest')),
+                            'cached': cached,
+                            'deployed': deployed.is_current(package['name'], entry, archive_filename, source_info.get('digest')),
+                            'delta_base': delta_base,
+                            'download_bytes': download_bytes})
+        return planned
+
+    def deploy_resolved(self, resolved, target_directory):
+        deployed = manifest.load_manifest(target_directory)
+        deployments = []
+        for package, source_info in resolved:
+            _, archive_filename = self.get_archive_location(source_info)
+            if deployed.is_current(package['name'], source_info['package'], archive_filename, source_info.get('digest')):
+                messages.PackageAlreadyDeployed(package['name'])
+                continue
+            deployed.remove_entry(package['name'])
+            deployments.append((package['name'], source_info, os.path.join(target_directory, package['name'])))
+
+        self.remove_stale_packages(deployed, [package['name'] for package, _source_info in resolved])
+        deployed.store()
+
+        try:
+            if self.__download_threads > 1 and len(deployments) > 1:
+                self.deploy_concurrently(deployments, deployed)
+            else:
+                for name, source_info, extract_dir in deployments:
+                    archive_filename, digest = self.fetch_archive(source_info, extract_dir)
+                    deployed.set_entry(name, source_info['package'], archive_filename, digest)
+        finally:
+            deployed.store()
+            # fetches only append to the journal, like publishing does
+            self.__local_listing.store(self.__local_listing.get_root(), compact_journal=False)
+
+        used_archives = [self.get_archive_location(source_info)[1] for _package, source_info in resolved]
+        cache.record_access(self.__local_listing.get_root(), used_archives)
+        if self.__cache_budget is not None:
+            evicted = cache.collect_garbage(self.__local_listing.get_root(), self.__cache_budget, keep=used_archives)
+            messages.CollectedGarbage(evicted)
+
+        return [self.get_locked_package(source_info, deployed.get_entry(package['name'])['digest'])
+                for package, source_info in resolved]
+
+    def deploy_concurrently(self, deployments, deployed):
+        # messages are emitted up front and errors are raised afterwards in the order
+        # of the required packages, so the output does not depend on thread scheduling
+        work = Queue.Queue()
+        for index, (name, source_info, extract_dir) in enumerate(deployments):
+            source_url, _ = self.get_archive_location(source_info)
+            if source_url is not None:
+                messages.DownloadingPackage(source_url)
+            work.put((index, name, source_info, extract_dir))
+
+        errors = [None] * len(deployments)
+        outputs = [[] for _deployment in deployments]
+        manifest_lock = threading.Lock()
+        def worker():
+            while True:
+                try:
+                    index, name, source_info, extract_dir = work.get_nowait()
+                except Queue.Empty:
+                    return
+                messages.StartCapture()
+                try:
+                    archive_filename, digest = self.retrieve_archive(source_info, extract_dir)
+                    with manifest_lock:
+                        deployed.set_entry(name, source_info['package'], archive_filename, digest)
+                except Exception as error:
+                    errors[index] = error
+                finally:
+                    outputs[index] = messages.StopCapture()
+
+        workers = [threading.Thread(target=worker) for index in range(min(self.__download_threads, len(deployments)))]
+        for thread in workers:
+            thread.daemon = True
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        for lines in outputs:
+            messages.PrintCaptured(lines)
+        for error in errors:
+            if error is not None:
+                raise error
+
+    def remove_stale_packages(self, deployed, required_names):
+        for name in deployed.get_names():
+            if not name in required_names:
+                deployed.remove_entry(name)
+
+        target_directory = deployed.get_path()
+        for name in get_stale_packages(target_directory, required_names):
+            messages.RemovingStalePackage(name)
+            store.remove_tree(os.path.join(target_directory, name))
+
+    def resolve_dependencies(self, required_packages, ignore_local_builds, flavor):
+        '''returns (package, source_info) for the required packages and everything they require'''
+        def get_candidates(name, spec):
+            return self.get_candidates({'name': name, 'version': spec}, ignore_local_builds, flavor)
+        resolution = None
+        if self.__listing_cache is not None:
+            key = (self.__local_listing.get_root(),
+                   tuple((remote.get_root(), priority) for remote, priority in zip(self.__remote_listing, self.__remote_priorities)),
+                   tuple((package['name'], str(package['version'])) for package in required_packages),
+                   ignore_local_builds, flavor)
+            resolution = self.__listing_cache.get_resolution(key)
+        if resolution is None:
+            try:
+                with tracing.span('resolve', 'fetch', required=len(required_packages)):
+                    resolution = resolver.Resolver(get_candidates).resolve(required_packages)
+            except resolver.ResolutionFailed as error:
+                raise RequiredPackageNotAvailable(str(error))
+            if self.__listing_cache is not None:
+                self.__listing_cache.store_resolution(key, resolution)
+
+        resolved = []
+        for name, spec, entry in resolution:
+            package = {'name': name, 'version': spec}
+            source_info = self.get_source_info(entry)
+            messages.ResolvedPackage(package, flavor, entry, source_info['source_type'])
+            resolved.append((package, source_info))
+        return resolved
+
+    def get_index_entry(self, name, flavor):
+        '''
+        returns the builds of name@flavor in all repositories as tiers of equal priority, highest first.
+        Each tier is a pair of lists, the versions in ascending order and the package infos they come
+        from. On equal versions the local repository wins over the remotes and remotes are taken in
+        configured order. The local repository belongs to the highest tier, packages it already holds
+        are never downloaded again. Tiers are built on the first lookup of a package and kept.
+        '''
+        key = (name, flavor)
+        if key in self.__merged_index:
+            return self.__merged_index[key]
+        top_priority = max(self.__remote_priorities or [0])
+        sources = [(top_priority, self.__local_listing)] + zip(self.__remote_priorities, self.__remote_listing)
+        tiers = {}
+        for order, (priority, source) in enumerate(sources):
+            info = source.get_package_info(name, flavor)
+            if info is None:
+                continue
+            candidates = tiers.setdefault(priority, [])
+            for build in info.get_builds():
+                candidates.append((version.get_sort_key(build), -order, build, info))
+
+        merged = []
+        for priority in sorted(tiers, reverse=True):
+            builds = []
+            infos = []
+            last_key = None
+            for sort_key, _, build, info in sorted(tiers[priority], key=lambda candidate: candidate[:2]):
+                if sort_key == last_key:
+                    # sorted by descending order on equal versions, the last one is preferred
+                    infos[-1] = info
+                    continue
+                last_key = sort_key
+                builds.append(build)
+                infos.append(info)
+            merged.append((builds, infos))
+        self.__merged_index[key] = merged
+        return merged
+
+    def get_candidates(self, package, ignore_local_builds, flavor):
+        '''yields the matching builds newest first, taken from the highest priority tier that has any'''
+        for builds, infos in self.get_index_entry(package['name'], flavor):
+            found = False
+            for position in listing.iter_matches(builds, package['version'], ignore_local_builds):
+                found = True
+                yield infos[position].make_entry(builds[position])
+            if found:
+                return
+
+    def get_source_info(self, entry):
+        if entry.get_path() == self.__local_listing.get_root():
+            return {'package': entry, 'source': self.__local_listing, 'source_type': 'local'}
+        for remote in self.__remote_listing:
+            if entry.get_path() == remote.get_root():
+                return {'package': entry, 'source': remote, 'source_type': 'remote'}
+        return None
+
+    def get_locked_source_info(self, locked):
+        attributes = {'codec': locked['codec']}
+        if locked['source'] != 'local':
+            attributes['origin'] = locked['source']
+        entry = listing.PackageEntry(locked['name'], self.__local_listing.get_root(), version.parse_version(locked['version']),
+                                     locked['flavor'], attributes, locked['requirements'])
+        if os.path.isfile(os.path.join(self.__local_listing.get_root(), entry.get_filename())):
+            return {'package': entry, 'source': self.__local_listing, 'source_type': 'local', 'digest': locked['digest']}
+        if locked['source'] == 'local':
+            raise RequiredPackageNotAvailable('%s %s is locked to a local build, but %s is not in the local repository anymore'
+                                              % (locked['name'], locked['version'], entry.get_filename()))
+        entry = listing.PackageEntry(locked['name'], locked['source'], entry.get_version(),
+                                     locked['flavor'], {'codec': locked['codec']}, locked['requirements'])
+        return {'package': entry, 'source': None, 'source_type': 'remote', 'digest': locked['digest']}
+
+    def get_locked_package(self, source_info, digest):
+        entry = source_info['package']
+        if source_info['source_type'] == 'remote':
+            source = entry.get_path()
         else:
-            messages.ResolvedPackage(package, flavor, source_info['package'], source_info['source_type'])
-        return source_info
+            source = entry.get_attribute('origin', 'local')
+        return {'name': entry.get_name(),
+                'version': str(entry.get_version()),
+                'flavor': entry.get_flavor(),
+                'source': source,
+                'digest': digest,
+                'codec': entry.get_codec(),
+                'requirements': entry.get_metadata()[1]}
 
     def find_best_source(self, package, ignore_local_builds, flavor):
-        best = {'package': self.__local_listing.get_package(package['name'], package['version'], ignore_local_builds, flavor),
-                'source': self.__local_listing,
-                'source_type': 'local'}
-        for remote in self.__remote_listing:
-            candidate_package = remote.get_package(package['name'], package['version'], ignore_local_builds, flavor)
-            if candidate_package is None:
-                continue
-            if best['package'] is None or (best['package'].get_version() < candidate_package.get_version()):
-                best['package'] = candidate_package
-                best['source'] = remote
-                best['source_type'] = 'remote'
-        if best['package'] is None:
+        best = next(self.get_candidates(package, ignore_local_builds, flavor), None)
+        if best is None:
             return None
-        return best
+        return self.get_source_info(best)
 
-    def fetch_archive(self, source_info):
-        target_file = None
+    def get_archive_location(self, source_info):
+        filename = source_info['package'].get_filename()
         if source_info['source_type'] == 'local':
-            target_file = os.path.join(source_info['package'].get_path(), source_info['package'].get_filename())
-        else:
-            filename = source_info['package'].get_filename()
-            source_url = '/'.join([source_info['package'].get_path(), filename])
-            target_file = os.path.join(self.__local_listing.get_root(), filename)
+            return None, os.path.join(source_info['package'].get_path(), filename)
+        source_url = '/'.join([source_info['package'].get_path(), filename])
+        return source_url, os.path.join(self.__local_listing.get_root(), filename)
+
+    def fetch_archive(self, source_info, extract_dir):
+        source_url, _ = self.get_archive_location(source_info)
+        if source_url is not None:
             messages.DownloadingPackage(source_url)
+        return self.retrieve_archive(source_info, extract_dir)
+
+    def retrieve_archive(self, source_info, extract_dir):
+        '''puts the archive into the local repository and installs it, returns its filename and digest if known'''
+        source_url, target_file = self.get_archive_location(source_info)
+        entry = source_info['package']
+        with tracing.span(entry.get_name(), 'package', version=str(entry.get_version()), flavor=entry.get_flavor(), source=entry.get_path()):
+            if source_url is not None and self.can_stream(entry, source_url):
+                return target_file, self.stream_archive(source_info, source_url, target_file, extract_dir)
+            if source_url is not None:
+                self.download_archive(source_info, source_url, target_file)
+            else:
+                self.verify_archive(source_info, target_file)
+            self.install_archive(source_info, target_file, extract_dir)
+            return target_file, source_info.get('digest')
+
+    def verify_archive(self, source_info, archive_filename, listed_digest=None):
+        expected = source_info.get('digest', listed_digest)
+        if expected is None:
+            return
+        with tracing.span('verify', 'fetch', package=source_info['package'].get_name()) as verify_span:
+            verify_span.add_bytes(os.path.getsize(archive_filename))
+            if manifest.compute_digest(archive_filename) != expected:
+                raise RequiredPackageNotAvailable('The archive %s does not match the digest recorded for it'
+                                                  % source_info['package'].get_filename())
+
+    def download_archive(self, source_info, source_url, target_file):
+        if not self.reconstruct_archive(source_info, target_file):
+            with tracing.span('download', 'fetch', package=source_info['package'].get_name(), url=source_url) as download_span:
+                try:
+                    self.download_full_archive(source_info['package'], source_url, target_file)
+                except (IOError, download.DownloadFailed) as error:
+                    if os.path.exists(target_file):
+                        os.remove(target_file)
+                    raise RequiredPackageNotAvailable('I could not download %s: %s' % (source_url, error))
+                download_span.add_bytes(os.path.getsize(target_file))
+        try:
+            self.verify_archive(source_info, target_file, source_info['package'].get_attribute('digest'))
+        except RequiredPackageNotAvailable:
+            os.remove(target_file)
+            raise
+        self.register_download(source_info)
+
+    def register_download(self, source_info):
+        with self.__listing_lock:
+            attributes, requirements = source_info['package'].get_metadata()
+            attributes['origin'] = source_info['package'].get_path()
+            self.__local_listing.add_package(source_info['package'].get_name(),
+                                             str(source_info['package'].get_version()),
+                                             source_info['package'].get_flavor(),
+                                             attributes,
+                                             requirements)
+
+    def find_mirrors(self, entry):
+        '''the remotes serving the identical archive, the one the entry was taken from first'''
+        mirrors = [entry.get_path()]
+        digest = entry.get_attribute('digest')
+        if digest is None:
+            return mirrors
+        spec = version.parse_spec('==%s' % entry.get_version())
+        for remote in self.__remote_listing:
+            if remote.get_root() in mirrors:
+                continue
+            mirrored = remote.get_package(entry.get_name(), spec, True, entry.get_flavor())
+            if mirrored is not None and mirrored.get_attribute('digest') == digest and mirrored.get_attribute('size') == entry.get_attribute('size'):
+                mirrors.append(remote.get_root())
+        return mirrors
+
+    def is_ranged(self, entry, source_url):
+        size = entry.get_attribute('size')
+        return self.__range_connections > 1 and size is not None and int(size) >= download.MIN_RANGED_SIZE and download.is_rangeable(source_url)
+
+    def can_stream(self, entry, source_url):
+        # deltas and ranges need the whole archive on disk before anything can be extracted
+        return self.__stream_extraction and not self.is_ranged(entry, source_url) and self.find_delta_base(entry) is None
+
+    def stream_archive(self, source_info, source_url, target_file, extract_dir):
+        '''
+        extracts the archive while it is downloaded, the response is copied to the local repository on
+        the way. The digest can only be checked at the end, a mismatch removes the extracted files again.
+        Returns the digest of the archive.
+        '''
+        entry = source_info['package']
+        expected = source_info.get('digest', entry.get_attribute('digest'))
+        partial_file = target_file + '.part'
+        try:
+            response = download.open_url(source_url, self.__remote_timeouts.get(entry.get_path(), download.DEFAULT_TIMEOUTS))
+        except IOError as error:
+            raise RequiredPackageNotAvailable('I could not download %s: %s' % (source_url, error))
+        streamed = {}
+
+        def extract(path):
+            store.remove_tree(path)
+            with tracing.span('download and extract', 'fetch', package=entry.get_name(), url=source_url) as stream_span:
+                with open(partial_file, 'wb') as copy:
+                    tee = download.TeeReader(response, copy)
+                    try:
+                        archive = compression.open_stream(tee, entry.get_codec())
+                    except compression.UnknownCodec as error:
+                        raise RequiredPackageNotAvailable(str(error))
+                    with archive:
+                        archive.extractall(path)
+                    tee.drain()
+                stream_span.add_bytes(tee.get_size())
+            if expected is not None and tee.get_digest() != expected:
+                store.remove_tree(path)
+                raise RequiredPackageNotAvailable('The archive %s does not match the digest recorded for it' % entry.get_filename())
+            os.rename(partial_file, target_file)
+            streamed['digest'] = tee.get_digest()
+
+        try:
+            if self.__store is None:
+                extract(extract_dir)
+            else:
+                self.__store.deploy(self.__store.ensure_extracted(entry, target_file, extract), extract_dir)
+        except (IOError, tarfile.TarError) as error:
+            if self.__store is None:
+                store.remove_tree(extract_dir)
+            raise RequiredPackageNotAvailable('I could not download %s: %s' % (source_url, error))
+        finally:
+            response.close()
+            if os.path.exists(partial_file):
+                os.remove(partial_file)
+        self.register_download(source_info)
+        return streamed.get('digest')
+
+    def download_full_archive(self, entry, source_url, target_file):
+        if not self.is_ranged(entry, source_url):
             urllib.urlretrieve(source_url, target_file)
-            self.__local_listing.add_package(source_info['package'].get_name(), str(source_info['package'].get_version()), source_info['package'].get_flavor())
-        return target_file
-
-    def extract_archive(self, archive_filename, extract_dir):
-        # TODO only extract packages that are newer than the dependency in the build
-        if os.path.exists(extract_dir):
-            shutil.rmtree(extract_dir)
-        with tarfile.open(archive_filename, 'r') as archive:
+            return
+        size = entry.get_attribute('size')
+        mirrors = [mirror for mirror in self.find_mirrors(entry) if download.is_rangeable(mirror)]
+        urls = ['/'.join([mirror, entry.get_filename()]) for mirror in mirrors]
+        timeouts = dict((url, self.__remote_timeouts.get(mirror, download.DEFAULT_TIMEOUTS)) for url, mirror in zip(urls, mirrors))
+        ranged_download = download.RangedDownload(urls, int(size), self.__range_connections, timeouts)
+        ranged_download.run(target_file)
+        messages.DownloadedRanges(entry.get_name(), [(mirror.url, mirror.transferred, mirror.get_throughput(), mirror.error)
+                                                     for mirror in ranged_download.get_mirrors()])
+
+    def find_delta_base(self, entry):
+        base_version = entry.get_attribute('delta_base')
+        if base_version is None or entry.get_attribute('digest') is None:
+            return None
+        with self.__listing_lock:
+            base = self.__local_listing.get_package(entry.get_name(), version.parse_spec('==%s' % base_version), False, entry.get_flavor())
+        if base is None or not os.path.isfile(os.path.join(self.__local_listing.get_root(), base.get_filename())):
+            return None
+        return base
+
+    def reconstruct_archive(self, source_info, target_file):
+        '''rebuilds the archive from a delta against a build in the local repository, returns False if that is not possible'''
+        entry = source_info['package']
+        base = self.find_delta_base(entry)
+        if base is None:
+            return False
+        delta_file = target_file + '.delta'
+        rebuilt_file = target_file + '.rebuilt'
+        try:
+            try:
+                with tracing.span('download delta', 'fetch', package=entry.get_name(), base=str(base.get_version())) as delta_span:
+                    urllib.urlretrieve('/'.join([entry.get_path(), entry.get_delta_filename()]), delta_file)
+                    delta_span.add_bytes(os.path.getsize(delta_file))
+                with tracing.span('apply delta', 'fetch', package=entry.get_name()):
+                    delta.apply_delta(os.path.join(self.__local_listing.get_root(), base.get_filename()), base.get_codec(),
+                                      delta_file, entry.get_codec(), entry.get_level(), rebuilt_file)
+            except (IOError, OSError, delta.InvalidDelta, compression.UnknownCodec, tarfile.TarError) as error:
+                messages.DeltaNotUsable(entry.get_name(), error)
+                return False
+            if manifest.compute_digest(rebuilt_file) != entry.get_attribute('digest'):
+                messages.DeltaNotUsable(entry.get_name(), 'the rebuilt archive does not match the digest in the listing')
+                return False
+            os.rename(rebuilt_file, target_file)
+            return True
+        finally:
+            for leftover in (delta_file, rebuilt_file):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+    def install_archive(self, source_info, archive_filename, extract_dir):
+        codec = source_info['package'].get_codec()
+        with tracing.span('extract', 'fetch', package=source_info['package'].get_name(), codec=codec) as extract_span:
+            extract_span.add_bytes(os.path.getsize(archive_filename))
+            if self.__store is None:
+                self.extract_archive(archive_filename, codec, extract_dir)
+                return
+            store_path = self.__store.ensure_extracted(source_info['package'], archive_filename,
+                                                       lambda path: self.extract_archive(archive_filename, codec, path))
+        with tracing.span('link', 'fetch', package=source_info['package'].get_name(), mode=self.__store.get_mode()):
+            self.__store.deploy(store_path, extract_dir)
+
+    def extract_archive(self, archive_filename, codec, extract_dir):
+        store.remove_tree(extract_dir)
+        try:
+            archive = compression.open_archive(archive_filename, codec)
+        except compression.UnknownCodec as error:
+            raise RequiredPackageNotAvailable(str(error))
+        with archive:
             archive.extractall(extract_dir)
@@ -0,0 +1,254 @@
+"""
+    Juggler - Dirty dependency management and packaging for compiled code
+    Copyright (C) 2014  Christian Meyer
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import time
+import hashlib
+import httplib
+import urllib2
+import threading
+import collections
+
+# seconds to wait for a connection and for every read on it, configurable per remote in global.xml
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 60
+DEFAULT_TIMEOUTS = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)
+
+class _TimeoutHTTPConnection(httplib.HTTPConnection):
+    def __init__(self, host, read_timeout=None, **kwargs):
+        httplib.HTTPConnection.__init__(self, host, **kwargs)
+        self.__read_timeout = read_timeout
+
+    def connect(self):
+        # the timeout given by urllib2 only limits connecting, reads get a timeout of their own
+        httplib.HTTPConnection.connect(self)
+        self.sock.settimeout(self.__read_timeout)
+
+class _TimeoutHTTPSConnection(httplib.HTTPSConnection):
+    def __init__(self, host, read_timeout=None, **kwargs):
+        httplib.HTTPSConnection.__init__(self, host, **kwargs)
+        self.__read_timeout = read_timeout
+
+    def connect(self):
+        httplib.HTTPSConnection.connect(self)
+        self.sock.settimeout(self.__read_timeout)
+
+class _TimeoutHTTPHandler(urllib2.HTTPHandler):
+    def __init__(self, read_timeout):
+        urllib2.HTTPHandler.__init__(self)
+        self.__read_timeout = read_timeout
+
+    def http_open(self, request):
+        return self.do_open(lambda host, **kwargs: _TimeoutHTTPConnection(host, self.__read_timeout, **kwargs), request)
+
+class _TimeoutHTTPSHandler(urllib2.HTTPSHandler):
+    def __init__(self, read_timeout):
+        urllib2.HTTPSHandler.__init__(self)
+        self.__read_timeout = read_timeout
+
+    def https_open(self, request):
+        return self.do_open(lambda host, **kwargs: _TimeoutHTTPSConnection(host, self.__read_timeout, **kwargs), request)
+
+def open_url(request, timeouts=None):
+    '''
+    urllib2.urlopen with separate connect and read timeouts in seconds, None waits forever.
+    Both surface as IOError (socket.timeout or urllib2.URLError) like any other network failure.
+    '''
+    connect_timeout, read_timeout = timeouts or (None, None)
+    opener = urllib2.build_opener(_TimeoutHTTPHandler(read_timeout), _TimeoutHTTPSHandler(read_timeout))
+    return opener.open(request, timeout=connect_timeout)
+
+class TeeReader():
+    '''
+    file object reading from a response while writing everything read to a copy, and hashing it.
+    drain() reads whatever the consumer left over, so the copy is complete.
+    '''
+    def __init__(self, source, copy):
+        self.__source = source
+        self.__copy = copy
+        self.__digest = hashlib.sha256()
+        self.__size = 0
+
+    def read(self, size=-1):
+        data = self.__source.read(size) if size >= 0 else self.__source.read()
+        self.__copy.write(data)
+        self.__digest.update(data)
+        self.__size += len(data)
+        return data
+
+    def drain(self):
+        while self.read(64 * 1024):
+            pass
+
+    def get_digest(self):
+        return self.__digest.hexdigest()
+
+    def get_size(self):
+        return self.__size
+
+# archives are only split into ranges if they are large enough to make that worth the extra requests
+RANGE_SIZE = 8 * 1024 * 1024
+MIN_RANGED_SIZE = 4 * RANGE_SIZE
+# failed ranges in a row after which a mirror is no longer asked, single timeouts are tried again
+RANGE_ATTEMPTS = 3
+
+class DownloadFailed(Exception):
+    pass
+
+class RangesNotServed(DownloadFailed):
+    pass
+
+def is_rangeable(url):
+    return url.split(':', 1)[0] in ('http', 'https')
+
+def fetch_range(url, start, end, target_file, timeouts=None):
+    '''writes the bytes start to end (inclusive) of url into target_file at the same offset'''
+    request = urllib2.Request(url)
+    request.add_header('Range', 'bytes=%d-%d' % (start, end))
+    response = open_url(request, timeouts)
+    try:
+        if response.getcode() != 206 or not (response.info().get('Content-Range') or '').startswith('bytes %d-%d/' % (start, end)):
+            raise RangesNotServed('%s does not serve byte ranges' % url)
+        target_file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = response.read(min(remaining, 64 * 1024))
+            if not chunk:
+                raise DownloadFailed('%s ended %d bytes before the end of the range %d-%d' % (url, remaining, start, end))
+            target_file.write(chunk)
+            remaining -= len(chunk)
+    finally:
+        response.close()
+
+def fetch_whole(url, size, target_file, timeouts=None):
+    '''writes all of url into target_file, for servers that answer requests for ranges with the whole file'''
+    response = open_url(url, timeouts)
+    try:
+        target_file.seek(0)
+        written = 0
+        for chunk in iter(lambda: response.read(64 * 1024), ''):
+            target_file.write(chunk)
+            written += len(chunk)
+    finally:
+        response.close()
+    if written != size:
+        raise DownloadFailed('%s sent %d bytes instead of %d' % (url, written, size))
+
+class Mirror():
+    def __init__(self, url):
+        self.url = url
+        self.transferred = 0
+        self.seconds = 0.0
+        self.active = 0
+        self.failures = 0
+        self.error = None
+
+    def get_throughput(self):
+        return self.transferred / self.seconds if self.seconds > 0 else None
+
+class RangedDownload():
+    '''
+    downloads one file of known size as byte ranges over several connections, from any number of
+    mirrors serving the identical file. Connections take the next range from a shared queue and
+    pick a mirror each time, mirrors nobody tried yet first and then the one with the best measured
+    throughput per connection, so the remaining ranges move to the faster mirrors as the download goes.
+    A failed range goes back to the queue. A mirror is dropped once it failed RANGE_ATTEMPTS ranges
+    in a row, or right away if it does not serve ranges at all. If no mirror is left and ranges are
+    missing, the whole file is downloaded in one stream from a mirror that only served it that way.
+    '''
+    def __init__(self, urls, size, connections, timeouts=None, range_size=None):
+        self.__mirrors = [Mirror(url) for url in urls]
+        self.__size = size
+        self.__connections = connections
+        self.__timeouts = timeouts or {}
+        range_size = range_size or RANGE_SIZE
+        self.__ranges = collections.deque((start, min(start + range_size, size) - 1) for start in range(0, size, range_size))
+        self.__lock = threading.Lock()
+
+    def get_mirrors(self):
+        return self.__mirrors
+
+    def choose_mirror(self):
+        usable = [mirror for mirror in self.__mirrors if mirror.error is None]
+        if not usable:
+            return None
+        untried = [mirror for mirror in usable if mirror.get_throughput() is None and mirror.active == 0]
+        if untried:
+            return untried[0]
+        return max(usable, key=lambda mirror: (mirror.get_throughput() or 0) / (mirror.active + 1))
+
+    def __work(self, target_filename):
+        with open(target_filename, 'r+b') as target_file:
+            while True:
+                with self.__lock:
+                    if not self.__ranges:
+                        return
+                    mirror = self.choose_mirror()
+                    if mirror is None:
+                        return
+                    start, end = self.__ranges.popleft()
+                    mirror.active += 1
+                started = time.time()
+                try:
+                    fetch_range(mirror.url, start, end, target_file, self.__timeouts.get(mirror.url, DEFAULT_TIMEOUTS))
+                    error = None
+                except (IOError, DownloadFailed) as failure:
+                    error = failure
+                with self.__lock:
+                    mirror.active -= 1
+                    if error is None:
+                        mirror.transferred += end - start + 1
+                        mirror.seconds += time.time() - started
+                        mirror.failures = 0
+                    else:
+                        mirror.failures += 1
+                        if isinstance(error, RangesNotServed) or mirror.failures >= RANGE_ATTEMPTS:
+                            mirror.error = error
+                        self.__ranges.appendleft((start, end))
+
+    def run(self, target_filename):
+        with open(target_filename, 'wb') as target_file:
+            target_file.truncate(self.__size)
+        threads = [threading.Thread(target=self.__work, args=(target_filename,))
+                   for _ in range(min(self.__connections, len(self.__ranges)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.__ranges:
+            self.__fetch_whole(target_filename)
+
+    def __fetch_whole(self, target_filename):
+        for mirror in self.__mirrors:
+            if not isinstance(mirror.error, RangesNotServed):
+                continue
+            started = time.time()
+            try:
+                with open(target_filename, 'r+b') as target_file:
+                    fetch_whole(mirror.url, self.__size, target_file, self.__timeouts.get(mirror.url, DEFAULT_TIMEOUTS))
+            except (IOError, DownloadFailed) as error:
+                mirror.error = error
+                continue
+            # it served the file after all, just not in ranges
+            mirror.error = None
+            mirror.transferred = self.__size
+            mirror.seconds = time.time() - started
+            self.__ranges.clear()
+            return
+        raise DownloadFailed('No mirror could serve %d of the ranges: %s' % (
+                len(self.__ranges), '; '.join('%s: %s' % (mirror.url, mirror.error) for mirror in self.__mirrors)))
@@ -17,10 +17,25 @@
 """
 
 import os
-import urllib
-from juggler import version
+import errno
+import bisect
+import operator
+import time
+import zlib
+import shutil
+import hashlib
+import urllib2
+import StringIO
+import tempfile
+import threading
+try:
+    import fcntl
+except ImportError:
+    # no locking where fcntl is missing, concurrent juggler processes may lose listing updates there
+    fcntl = None
+from juggler import version, compact, compression, download, tracing
 from xml.etree import ElementTree
-from semantic_version import Version, Spec
+from semantic_version import Version, Spec, SpecItem
 
 class FileNotFound(Exception):
     pass
@@ -31,30 +46,98 @@ class InvalidFile(Exception):
 class InvalidRepository(Exception):
     pass
 
-class PackageInfo():
-    def __init__(self, name, root, flavor):
-        self.builds = []
-        self.__name = name
-        self.__root = root
-        self.__flavor = flavor
+def intern_string(value):
+    # names, flavors, roots and attribute names repeat in every build, unicode can not be interned
+    return intern(value) if type(value) is str else value
+
+def pack_metadata(attributes, requirements, attribute_keys):
+    '''
+    the attributes and requirements of a build as tuples, they take a fraction of a dict and a list.
+    attribute_keys maps each set of attribute names to the tuple of them shared by all builds having it.
+    '''
+    names = frozenset(attributes)
+    keys = attribute_keys.get(names)
+    if keys is None:
+        keys = attribute_keys.setdefault(names, tuple(sorted(intern_string(key) for key in names)))
+    return (keys, tuple(map(attributes.__getitem__, keys)),
+            tuple((intern_string(name), intern_string(spec)) for name, spec in requirements))
+
+def unpack_metadata(packed):
+    keys, values, requirements = packed
+    return dict(zip(keys, values)), list(requirements)
+
+class InternTable():
+    '''
+    versions and attribute names shared by the builds of the listings loaded with the table, nothing is
+    ever dropped from it, so it must not outlive those listings
+    '''
+    def __init__(self):
+        self.__versions = {}
+        self.__attribute_keys = {}
+
+    def get_version(self, version_string):
+        return version.intern_version(version_string, self.__versions)
+
+    def get_attribute_keys(self):
+        return self.__attribute_keys
+
+class PackageInfo(object):
+    __slots__ = ('__builds', '__released_builds', '__pending_builds', '__metadata', '__name', '__root', '__flavor', '__attribute_keys')
+
+    def __init__(self, name, root, flavor, attribute_keys=None):
+        self.__builds = []
+        self.__released_builds = []
+        self.__pending_builds = []
+        self.__metadata = {}
+        self.__name = intern_string(name)
+        self.__root = intern_string(root)
+        self.__flavor = intern_string(flavor)
+        # shared by the package infos of a listing, see pack_metadata
+        self.__attribute_keys = {} if attribute_keys is None else attribute_keys
     
-    def add_build(self, build_version):
+    def add_build(self, build_version, attributes=None, requirements=None):
         assert isinstance(build_version, Version)
-        if not build_version in self.builds:
-            self.builds.append(build_version)
-        return PackageEntry(self.__name, self.__root, build_version, self.get_flavor())
+        self.__pending_builds.append(build_version)
+        if attributes or requirements:
+            self.__metadata[build_version] = pack_metadata(attributes or {}, requirements or [], self.__attribute_keys)
+        elif build_version in self.__metadata:
+            del self.__metadata[build_version]
+
+    def get_builds(self):
+        if self.__pending_builds:
+            self.__merge_pending_builds()
+        return self.__builds
+
+    def __merge_pending_builds(self):
+        # builds are collected unsorted and merged in one go on the next lookup,
+        # loading a listing therefore costs a single sort per package
+        merged = sorted(((version.get_sort_key(build), build) for build in self.__builds + self.__pending_builds), key=operator.itemgetter(0))
+        self.__builds = [build for index, (key, build) in enumerate(merged) if index == 0 or merged[index - 1][0] != key]
+        self.__released_builds = [build for build in self.__builds if not is_local_build(build)]
+        self.__pending_builds = []
+
+    def get_metadata(self, build_version):
+        packed = self.__metadata.get(build_version)
+        return ({}, []) if packed is None else unpack_metadata(packed)
+
+    def iter_builds(self):
+        for build in self.get_builds():
+            attributes, requirements = self.get_metadata(build)
+            yield build, attributes, requirements
+
+    def make_entry(self, build_version):
+        attributes, requirements = self.get_metadata(build_version)
+        return PackageEntry(self.__name, self.__root, build_version, self.__flavor, attributes, requirements)
+
+    def get_entries(self, spec, ignore_local_build):
+        builds = self.get_builds()
+        if ignore_local_build:
+            builds = self.__released_builds
+        for position in iter_matches(builds, spec):
+            yield self.make_entry(builds[position])
     
     def get_entry(self, spec, ignore_local_build):
-        best_match = None
-        for build in self.builds:
-            if ignore_local_build and build.prerelease == (u'local',):
-                continue
-            if spec.match(build):
-                if build > best_match or best_match == None:
-                    best_match = build
-        if best_match is None:
-            return None
-        return PackageEntry(self.__name, self.__root, best_match, self.get_flavor())
+        return next(self.get_entries(spec, ignore_local_build), None)
         
     def get_name(self):
         return self.__name
@@ -62,12 +145,96 @@ class PackageInfo():
     def get_flavor(self):
         return self.__flavor
 
-class PackageEntry():
-    def __init__(self, name, root, build_version, flavor):
+class IndexedPackageInfo(object):
+    __slots__ = ('__builds', '__name', '__root', '__flavor')
+
+    def __init__(self, name, root, flavor, builds):
+        self.__builds = builds
+        self.__name = name
+        self.__root = root
+        self.__flavor = flavor
+
+    def get_builds(self):
+        return self.__builds
+
+    def get_metadata(self, build_version):
+        position = bisect.bisect_left(self.__builds, build_version)
+        if position < len(self.__builds) and self.__builds[position] == build_version:
+            return self.__builds.get_metadata(position)
+        return ({}, [])
+
+    def iter_builds(self):
+        for position in xrange(len(self.__builds)):
+            attributes, requirements = self.__builds.get_metadata(position)
+            yield self.__builds[position], attributes, requirements
+
+    def make_entry(self, build_version):
+        attributes, requirements = self.get_metadata(build_version)
+        return PackageEntry(self.__name, self.__root, build_version, self.__flavor, attributes, requirements)
+
+    def get_entries(self, spec, ignore_local_build):
+        for position in iter_matches(self.__builds, spec, ignore_local_build):
+            attributes, requirements = self.__builds.get_metadata(position)
+            yield PackageEntry(self.__name, self.__root, self.__builds[position], self.__flavor, attributes, requirements)
+
+    def get_entry(self, spec, ignore_local_build):
+        return next(self.get_entries(spec, ignore_local_build), None)
+
+    def get_name(self):
+        return self.__name
+
+    def get_flavor(self):
+        return self.__flavor
+
+def is_local_build(build_version):
+    return build_version.prerelease == (u'local',)
+
+def is_monotonic(partial_version):
+    # fields left out of a partial version are skipped when comparing, only if all of them come last
+    # (v1.2 but not v1.2-b3, which ignores the patch) does the comparison follow the order of the builds
+    fields = [partial_version.minor, partial_version.patch, partial_version.prerelease, partial_version.build]
+    return None not in fields or all(field is None for field in fields[fields.index(None):])
+
+def get_spec_bounds(builds, spec):
+    # comparing a complete version against the partial version of a spec item is monotonic
+    # in the sort order of the builds, so every such item narrows down a contiguous range
+    low = 0
+    high = len(builds)
+    for item in spec.specs:
+        if item.kind == SpecItem.KIND_ANY or not is_monotonic(item.spec):
+            continue
+        if item.kind in (SpecItem.KIND_GTE, SpecItem.KIND_EQUAL):
+            low = max(low, bisect.bisect_left(builds, item.spec))
+        elif item.kind == SpecItem.KIND_GT:
+            low = max(low, bisect.bisect_right(builds, item.spec))
+        if item.kind in (SpecItem.KIND_LTE, SpecItem.KIND_EQUAL):
+            high = min(high, bisect.bisect_right(builds, item.spec))
+        elif item.kind == SpecItem.KIND_LT:
+            high = min(high, bisect.bisect_left(builds, item.spec))
+    return low, high
+
+def iter_matches(builds, spec, ignore_local_build=False):
+    '''yields the positions of all builds matching spec, newest first'''
+    low, high = get_spec_bounds(builds, spec)
+    for position in xrange(high - 1, low - 1, -1):
+        build = builds[position]
+        if ignore_local_build and is_local_build(build):
+            continue
+        if spec.match(build):
+            yield position
+
+class PackageEntry(object):
+    # entries are made on every lookup, they hold the interned strings of their package info
+    __slots__ = ('__name', '__version', '__root', '__flavor', '__attributes', '__requirements', '__parsed_requirements')
+
+    def __init__(self, name, root, build_version, flavor, attributes=None, requirements=None):
         self.__name = name
         self.__version = build_version
         self.__root = root
         self.__flavor = flavor
+        self.__attributes = attributes or {}
+        self.__requirements = requirements or []
+        self.__parsed_requirements = None
 
     def get_name(self):
         return self.__name
@@ -81,59 +248,466 @@ class PackageEntry():
     def get_flavor(self):
         return self.__flavor
 
+    def get_attribute(self, key, default=None):
+        return self.__attributes.get(key, default)
+
+    def get_metadata(self):
+        return dict(self.__attributes), list(self.__requirements)
+
+    def get_requirements(self):
+        if self.__parsed_requirements is None:
+            self.__parsed_requirements = [{'name': name, 'version': version.parse_spec(spec)} for name, spec in self.__requirements]
+        return self.__parsed_requirements
+
+    def get_codec(self):
+        return self.__attributes.get('codec', compression.DEFAULT_CODEC)
+
+    def get_level(self):
+        level = self.__attributes.get('level')
+        return None if level is None else int(level)
+
     def get_filename(self):
-        return '%s_%s-%s.tar.gz' % (self.__name, self.__flavor, str(self.__version))
+        return '%s_%s-%s%s' % (self.__name, self.__flavor, str(self.__version), compression.get_extension(self.get_codec()))
+
+    def get_delta_filename(self):
+        return '%s_%s-%s.delta%s' % (self.__name, self.__flavor, str(self.__version), compression.get_extension(self.get_codec()))
 
 class Listing():
-    def __init__(self, root='.'):
+    def __init__(self, root='.', index=None, journaled=False, interned=None):
         self.__packages = {}
         self.__root = root
+        self.__index = index
+        self.__journaled = journaled
+        self.__added = []
+        self.__interned = InternTable() if interned is None else interned
     
     def is_empty(self):
-        return len(self.__packages) == 0
+        return len(self.__packages) == 0 and (self.__index is None or self.__index.is_empty())
     
-    def add_package(self, name, version_string, flavor='vanilla'):
+    def add_package(self, name, version_string, flavor='vanilla', attributes=None, requirements=None):
+        '''adds a build, it is written to the journal of the repository by the next store'''
+        build_version = self.load_package(name, version_string, flavor, attributes, requirements)
+        self.__added.append((name, version_string, flavor, dict(attributes or {}), list(requirements or [])))
+        return self.get_package_info(name, flavor).make_entry(build_version)
+
+    def has_changes(self):
+        return len(self.__added) > 0
+
+    def load_package(self, name, version_string, flavor='vanilla', attributes=None, requirements=None):
+        '''adds a build that is already stored, used while loading listings, returns its version'''
         key = '%s@%s' % (name, flavor)
         if not key in self.__packages:
-            self.__packages[key] = PackageInfo(name, self.__root, flavor)
-        return self.__packages[key].add_build(version.parse_version(version_string))
+            indexed = self.__get_indexed_package(name, flavor)
+            self.__packages[key] = PackageInfo(name, self.__root, flavor, self.__interned.get_attribute_keys())
+            if indexed is not None:
+                for build, build_attributes, build_requirements in indexed.iter_builds():
+                    self.__packages[key].add_build(build, build_attributes, build_requirements)
+        build_version = self.__interned.get_version(version_string)
+        self.__packages[key].add_build(build_version, attributes, requirements)
+        return build_version
+
+    def __get_indexed_package(self, name, flavor):
+        if self.__index is None:
+            return None
+        builds = self.__index.get_builds(name, flavor)
+        if builds is None:
+            return None
+        return IndexedPackageInfo(name, self.__root, flavor, builds)
+
+    def get_package_info(self, name, flavor='vanilla'):
+        key = '%s@%s' % (name, flavor)
+        if key in self.__packages:
+            return self.__packages[key]
+        return self.__get_indexed_package(name, flavor)
     
     def get_package(self, name, spec=version.parse_spec('*'), ignore_local_build=False, flavor='vanilla'):
         assert isinstance(spec, Spec)
-        key = '%s@%s' % (name, flavor)
-        if key in self.__packages:
-            return self.__packages[key].get_entry(spec, ignore_local_build=ignore_local_build)
-        else:
+        info = self.get_package_info(name, flavor)
+        if info is None:
             return None
+        return info.get_entry(spec, ignore_local_build=ignore_local_build)
+
+    def get_packages(self, name, spec=version.parse_spec('*'), ignore_local_build=False, flavor='vanilla'):
+        '''yields every matching build, newest first'''
+        info = self.get_package_info(name, flavor)
+        if info is None:
+            return iter([])
+        return info.get_entries(spec, ignore_local_build=ignore_local_build)
+
+    def get_required_names(self, name, flavor='vanilla'):
+        info = self.get_package_info(name, flavor)
+        required_names = set()
+        if info is not None:
+            for _, _, requirements in info.iter_builds():
+                required_names.update(required_name for required_name, _ in requirements)
+        return required_names
     
     def get_root(self):
         return self.__root
+
+    def get_package_infos(self):
+        '''returns the information about every package, sorted by name and flavor'''
+        packages = {}
+        if self.__index is not None:
+            for name, flavor in self.__index.get_keys():
+                packages[(name, flavor)] = self.__get_indexed_package(name, flavor)
+        for info in self.__packages.values():
+            packages[(info.get_name(), info.get_flavor())] = info
+        return [packages[key] for key in sorted(packages)]
     
-    def store(self, path):
+    def write(self, listing_file):
+        '''writes the XML listing into an open file'''
         root = ElementTree.Element('Listing')
-        for key in self.__packages:
-            pack = ElementTree.SubElement(root, 'Package', {'name': self.__packages[key].get_name(), 'flavor': self.__packages[key].get_flavor()})
-            for build in self.__packages[key].builds:
-                ElementTree.SubElement(pack, 'Build', {'version': str(build)})
-        tree = ElementTree.ElementTree(root)
-        tree.write(os.path.join(path, get_listing_filename()), encoding="utf-8")
+        for info in self.get_package_infos():
+            pack = ElementTree.SubElement(root, 'Package', {'name': info.get_name(), 'flavor': info.get_flavor()})
+            for build, attributes, requirements in info.iter_builds():
+                build_attributes = dict(attributes)
+                build_attributes['version'] = str(build)
+                build_element = ElementTree.SubElement(pack, 'Build', build_attributes)
+                if requirements:
+                    requires_element = ElementTree.SubElement(build_element, 'Requires')
+                    for required_name, spec in requirements:
+                        ElementTree.SubElement(requires_element, 'Package', {'name': required_name, 'version': spec})
+        ElementTree.ElementTree(root).write(listing_file, encoding="utf-8")
+
+    def store(self, path, compact_journal=True):
+        '''
+        listings loaded from path with load_local_listing only append the builds added since to the
+        journal of the repository, nothing is written if none were added. The journal is compacted into
+        the XML listing if compact_journal is set or it grew too large. Any other listing replaces the
+        listing of the repository completely.
+        '''
+        if not self.__journaled or path != self.__root:
+            with ListingLock(path):
+                self.write_snapshot(path)
+                remove_journal(path)
+            self.__added = []
+            return
+        if not self.__added and self.__index is not None:
+            return
+        with ListingLock(path):
+            append_journal(path, self.__added)
+            if compact_journal or self.__index is None or get_journal_size(path) >= COMPACT_JOURNAL_SIZE:
+                compact_listing(path)
+        self.__added = []
+
+    def write_snapshot(self, path):
+        '''writes the XML listing and its index, readers see either the old or the new listing'''
+        packages = self.get_package_infos()
+        filename = os.path.join(path, get_listing_filename())
+        with open(filename + '.tmp', 'wb') as listing_file:
+            self.write(listing_file)
+        os.rename(filename + '.tmp', filename)
+        compact.write_index(os.path.join(path, compact.get_index_filename()),
+                            [(info.get_name(), info.get_flavor(), info.iter_builds()) for info in packages],
+                            os.stat(filename))
 
 def get_listing_filename():
     return 'juggler_listing.xml'
 
+'''
+journal of a local repository, builds added since the XML listing was last written, one per line
+
+<Package name="RequiredPackage" flavor="vanilla"><Build version="1.0.0-b3" codec="gz"><Requires>...</Requires></Build></Package>
+
+Lines are only ever appended while holding the exclusive lock on juggler_listing.lock, a line
+without its newline was cut short and is ignored. Compaction merges the journal into the XML
+listing and removes it. Readers hold the shared lock while reading the listing and the journal.
+'''
+COMPACT_JOURNAL_SIZE = 64 * 1024
+
+def get_journal_filename():
+    return 'juggler_listing.journal'
+
+def get_lock_filename():
+    return 'juggler_listing.lock'
+
+class ListingLock():
+    def __init__(self, path, exclusive=True):
+        self.__filename = os.path.join(path, get_lock_filename())
+        self.__exclusive = exclusive
+        self.__lock_file = None
+
+    def __enter__(self):
+        if fcntl is None:
+            return self
+        try:
+            self.__lock_file = open(self.__filename, 'a')
+        except IOError:
+            if self.__exclusive:
+                raise
+            # repositories that can not be written to can not change underneath us either
+            return self
+        fcntl.flock(self.__lock_file.fileno(), fcntl.LOCK_EX if self.__exclusive else fcntl.LOCK_SH)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.__lock_file is not None:
+            fcntl.flock(self.__lock_file.fileno(), fcntl.LOCK_UN)
+            self.__lock_file.close()
+            self.__lock_file = None
+
+def format_journal_record(name, version_string, flavor, attributes, requirements):
+    package = ElementTree.Element('Package', {'name': name, 'flavor': flavor})
+    build_attributes = dict(attributes)
+    build_attributes['version'] = version_string
+    build = ElementTree.SubElement(package, 'Build', build_attributes)
+    if requirements:
+        requires = ElementTree.SubElement(build, 'Requires')
+        for required_name, spec in requirements:
+            ElementTree.SubElement(requires, 'Package', {'name': required_name, 'version': spec})
+    # the XML writer escapes line breaks in attribute values, so every record is a single line
+    return ElementTree.tostring(package) + '\n'
+
+def append_journal(path, added):
+    if not added:
+        return
+    records = ''.join(format_journal_record(*build) for build in added)
+    with open(os.path.join(path, get_journal_filename()), 'ab') as journal:
+        journal.write(records)
+
+def get_journal_size(path):
+    try:
+        return os.path.getsize(os.path.join(path, get_journal_filename()))
+    except OSError:
+        return 0
+
+def remove_journal(path):
+    filename = os.path.join(path, get_journal_filename())
+    if os.path.exists(filename):
+        os.remove(filename)
+
+def replay_journal(path, listing, offset=0):
+    '''replays the records from offset on, returns the offset behind the last complete record'''
+    filename = os.path.join(path, get_journal_filename())
+    if not os.path.isfile(filename):
+        return 0
+    with open(filename, 'rb') as journal:
+        journal.seek(offset)
+        records = journal.read()
+    lines = records.split('\n')
+    # the last part is empty unless the last record was cut short
+    for line in lines[:-1]:
+        try:
+            package = ElementTree.fromstring(line)
+        except ElementTree.ParseError:
+            continue
+        for build in package.findall('Build'):
+            attributes = dict(build.attrib)
+            version_string = attributes.pop('version')
+            requirements = [(required.attrib['name'], required.attrib.get('version', ''))
+                            for required in build.findall('./Requires/Package')]
+            listing.load_package(package.attrib['name'], version_string, package.attrib.get('flavor', 'vanilla'), attributes, requirements)
+    return offset + len(records) - len(lines[-1])
+
+def load_snapshot(path):
+    filename = os.path.join(path, get_listing_filename())
+    if not os.path.isfile(filename):
+        return Listing(path, journaled=True)
+    index = compact.open_index(os.path.join(path, compact.get_index_filename()), os.stat(filename))
+    if index is not None:
+        return Listing(path, index, journaled=True)
+    return load_listing(filename, path, listing=Listing(path, journaled=True))
+
+def compact_listing(path):
+    '''merges the journal into the XML listing, the caller has to hold the exclusive lock'''
+    merged = load_snapshot(path)
+    replay_journal(path, merged)
+    merged.write_snapshot(path)
+    remove_journal(path)
+
 def create_empty_listing(path):
     listing_path = os.path.join(path, get_listing_filename())
     with open(listing_path, 'w') as listing_file:
         listing_file.write('<Listing/>')
 
-def load_remote_listing(url):
+def get_listing_cache_directory(local_repository, url):
+    return os.path.join(local_repository, 'remote_listings', hashlib.sha1(url).hexdigest())
+
+def load_remote_listing(url, cache_directory=None, max_age=0, wanted_names=None, flavor=None, dependency_graph=None, listing=None,
+                        timeouts=None, interned=None):
+    '''
+    timeouts are the connect and read timeouts in seconds, see download.open_url, interned is passed on to load_listing.
+    Builds in the journal of the repository are loaded as well, publishing into it only compacts the journal now and then.
+    '''
     remotename = '/'.join([url, get_listing_filename()])
-    remotefile = None
+    if cache_directory is None:
+        with tracing.span('load listing', 'listing', url=url):
+            # the journal is read first, a compaction in between moves its builds into the listing read after it
+            records = fetch_remote_journal(get_remote_journal_name(remotename), timeouts)
+            try:
+                remotefile = download.open_url(remotename, timeouts)
+                try:
+                    listing = load_listing(remotefile, url, wanted_names, flavor, dependency_graph, listing, interned)
+                finally:
+                    remotefile.close()
+            except IOError as error:
+                raise FileNotFound('%s could not be accessed: %s' % (remotename, error))
+            return load_journal_records(records, url, wanted_names, flavor, dependency_graph, listing)
+    with tracing.span('fetch listing', 'listing', url=url):
+        cached_listing = fetch_cached_listing(remotename, cache_directory, max_age, timeouts)
+    with tracing.span('parse listing', 'listing', url=url) as parse_span:
+        parse_span.add_bytes(os.path.getsize(cached_listing))
+        listing = load_listing(cached_listing, url, wanted_names, flavor, dependency_graph, listing, interned)
+        return load_journal_records(read_cached_journal(cache_directory), url, wanted_names, flavor, dependency_graph, listing)
+
+def get_remote_journal_name(remotename):
+    return '/'.join([remotename.rsplit('/', 1)[0], get_journal_filename()])
+
+def fetch_remote_journal(journalname, timeouts=None):
+    '''the records in the journal of a remote repository, empty if it has none'''
+    try:
+        response = download.open_url(journalname, timeouts)
+    except urllib2.HTTPError as error:
+        if error.code == 404:
+            return ''
+        raise FileNotFound('%s could not be accessed: %s' % (journalname, error))
+    except urllib2.URLError as error:
+        # file URLs of missing files
+        if getattr(error.reason, 'errno', None) == errno.ENOENT:
+            return ''
+        raise FileNotFound('%s could not be accessed: %s' % (journalname, error))
+    except IOError as error:
+        raise FileNotFound('%s could not be accessed: %s' % (journalname, error))
     try:
-        remotefile = urllib.urlopen(remotename)
+        return response.read()
     except IOError as error:
+        raise FileNotFound('%s could not be downloaded: %s' % (journalname, error))
+    finally:
+        response.close()
+
+def read_cached_journal(cache_directory):
+    try:
+        with open(os.path.join(cache_directory, get_journal_filename()), 'rb') as journal:
+            return journal.read()
+    except IOError:
+        return ''
+
+def load_journal_records(records, root, wanted_names=None, flavor=None, dependency_graph=None, listing=None):
+    '''adds the builds of the complete records of a journal to listing like load_listing does'''
+    # a record cut short at the end is still being written
+    complete = records[:records.rfind('\n') + 1]
+    if not complete and listing is not None:
+        return listing
+    return load_listing(StringIO.StringIO('<Listing>%s</Listing>' % complete), root, wanted_names, flavor, dependency_graph, listing)
+
+'''
+example cache information, stored next to the cached copy of a remote listing
+<CacheInfo url="http://readonly.url.to.server/somewhere/juggler_listing.xml"
+           etag="&quot;5b2c-51d2&quot;"
+           last_modified="Sun, 22 Mar 2015 12:00:00 GMT"
+           fetched="1427025600.0"/>
+'''
+def get_cache_info_filename():
+    return 'cache_info.xml'
+
+def load_cache_info(cache_directory):
+    filename = os.path.join(cache_directory, get_cache_info_filename())
+    if not os.path.isfile(filename):
+        return {}
+    try:
+        return dict(ElementTree.parse(filename).getroot().attrib)
+    except ElementTree.ParseError:
+        return {}
+
+def create_temporary_file(filename):
+    '''
+    opens a new file next to filename, to be renamed into its place once it is complete. Every caller
+    gets a file of its own, so juggler processes sharing a repository never write into each other's.
+    '''
+    handle, temporary_filename = tempfile.mkstemp(prefix=os.path.basename(filename) + '.', suffix='.tmp',
+                                                  dir=os.path.dirname(filename))
+    return os.fdopen(handle, 'wb'), temporary_filename
+
+def store_cache_info(cache_directory, info):
+    filename = os.path.join(cache_directory, get_cache_info_filename())
+    info_file, temporary_filename = create_temporary_file(filename)
+    try:
+        with info_file:
+            ElementTree.ElementTree(ElementTree.Element('CacheInfo', info)).write(info_file, encoding="utf-8")
+        os.rename(temporary_filename, filename)
+    except:
+        os.remove(temporary_filename)
+        raise
+
+def store_cached_journal(cache_directory, records):
+    # an unchanged journal keeps its file, the listing cache of the daemon goes by file stamps
+    if read_cached_journal(cache_directory) == records:
+        return
+    filename = os.path.join(cache_directory, get_journal_filename())
+    journal_file, temporary_filename = create_temporary_file(filename)
+    try:
+        with journal_file:
+            journal_file.write(records)
+        os.rename(temporary_filename, filename)
+    except:
+        os.remove(temporary_filename)
+        raise
+
+def fetch_cached_listing(remotename, cache_directory, max_age, timeouts=None):
+    '''the journal of the repository is kept next to the cached listing, see read_cached_journal'''
+    cached_listing = os.path.join(cache_directory, get_listing_filename())
+    info = load_cache_info(cache_directory)
+    is_cached = info.get('url') == remotename and os.path.isfile(cached_listing)
+    if is_cached and max_age > 0 and time.time() - float(info.get('fetched', 0)) < max_age:
+        return cached_listing
+    # read before the listing, a compaction in between moves its builds into the listing
+    records = fetch_remote_journal(get_remote_journal_name(remotename), timeouts)
+
+    request = urllib2.Request(remotename)
+    request.add_header('Accept-Encoding', 'gzip')
+    if is_cached and 'etag' in info:
+        request.add_header('If-None-Match', info['etag'])
+    if is_cached and 'last_modified' in info:
+        request.add_header('If-Modified-Since', info['last_modified'])
+
+    try:
+        response = download.open_url(request, timeouts)
+    except urllib2.HTTPError as error:
+        if error.code == 304 and is_cached:
+            store_cached_journal(cache_directory, records)
+            info['fetched'] = repr(time.time())
+            store_cache_info(cache_directory, info)
+            return cached_listing
         raise FileNotFound('%s could not be accessed: %s' % (remotename, error))
-    return load_listing(remotefile, url)
+    except IOError as error:
+        raise FileNotFound('%s could not be accessed: %s' % (remotename, error))
+
+    if not os.path.isdir(cache_directory):
+        try:
+            os.makedirs(cache_directory)
+        except OSError:
+            # another juggler process has just created it
+            if not os.path.isdir(cache_directory):
+                raise
+    cache_file, temporary_filename = create_temporary_file(cached_listing)
+    try:
+        with cache_file:
+            if response.info().get('Content-Encoding') == 'gzip':
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                for chunk in iter(lambda: response.read(64 * 1024), ''):
+                    cache_file.write(decompressor.decompress(chunk))
+                cache_file.write(decompressor.flush())
+            else:
+                shutil.copyfileobj(response, cache_file, 64 * 1024)
+    except (IOError, zlib.error) as error:
+        os.remove(temporary_filename)
+        raise FileNotFound('%s could not be downloaded: %s' % (remotename, error))
+    except:
+        os.remove(temporary_filename)
+        raise
+    finally:
+        response.close()
+    os.rename(temporary_filename, cached_listing)
+    store_cached_journal(cache_directory, records)
+
+    info = {'url': remotename, 'fetched': repr(time.time())}
+    if response.info().get('ETag') is not None:
+        info['etag'] = response.info().get('ETag')
+    if response.info().get('Last-Modified') is not None:
+        info['last_modified'] = response.info().get('Last-Modified')
+    store_cache_info(cache_directory, info)
+    return cached_listing
 
 def load_local_listing(path):
     if path is None:
@@ -142,24 +716,141 @@ def load_local_listing(path):
     filename = os.path.join(path, get_listing_filename())
     if not os.path.isfile(filename):
         raise FileNotFound('%s is a directory or missing' % filename)
-    
-    return load_listing(filename, path)
 
-def load_listing(source, root):
-    xmltree = None
+    with tracing.span('load local listing', 'listing', path=path):
+        with ListingLock(path, exclusive=False):
+            listing = load_snapshot(path)
+            replay_journal(path, listing)
+    return listing
+
+def get_file_stamp(filename):
     try:
-        xmltree = ElementTree.parse(source)
+        info = os.stat(filename)
+    except OSError:
+        return None
+    # a file replaced by rename gets a new inode, even within the resolution of mtime
+    return (info.st_ino, info.st_size, info.st_mtime)
+
+class ListingCache():
+    '''
+    parsed listings kept in memory by the juggler daemon between the commands it runs. A cached listing
+    is only parsed again if its file changed. Of the local repository just the journal records appended
+    since are replayed, unless the XML listing itself was rewritten. Resolutions are kept as long as
+    none of the listings changes, get_generation counts those changes. Remote listings share an intern
+    table, a new one is started whenever a listing is replaced so the table never outlives its listings.
+    '''
+    def __init__(self):
+        self.__local = {}
+        self.__remote = {}
+        self.__resolutions = {}
+        self.__generation = 0
+        self.__interned = InternTable()
+        self.__lock = threading.Lock()
+
+    def get_generation(self):
+        return self.__generation
+
+    def __changed(self):
+        with self.__lock:
+            self.__generation += 1
+
+    def get_local_listing(self, path):
+        filename = os.path.join(path, get_listing_filename())
+        if not os.path.isfile(filename):
+            raise FileNotFound('%s is a directory or missing' % filename)
+
+        with tracing.span('refresh local listing', 'listing', path=path):
+            with ListingLock(path, exclusive=False):
+                stamp = get_file_stamp(filename)
+                cached = self.__local.get(path)
+                # builds added but never stored only exist in memory, the listing is loaded again without them
+                if cached is None or cached[0] != stamp or cached[2].has_changes() or get_journal_size(path) < cached[1]:
+                    local_listing = load_snapshot(path)
+                    offset = replay_journal(path, local_listing)
+                    self.__changed()
+                else:
+                    _, offset, local_listing = cached
+                    replayed = replay_journal(path, local_listing, offset)
+                    if replayed != offset:
+                        offset = replayed
+                        self.__changed()
+                self.__local[path] = (stamp, offset, local_listing)
+        return local_listing
+
+    def get_remote_listing(self, url, cache_directory, max_age=0, timeouts=None):
+        '''the listing is revalidated like load_remote_listing does, it is only parsed again if it changed'''
+        remotename = '/'.join([url, get_listing_filename()])
+        with tracing.span('fetch listing', 'listing', url=url):
+            cached_listing = fetch_cached_listing(remotename, cache_directory, max_age, timeouts)
+        stamp = (get_file_stamp(cached_listing), get_file_stamp(os.path.join(cache_directory, get_journal_filename())))
+        with self.__lock:
+            cached = self.__remote.get(cached_listing)
+            if cached is not None and cached[0] != stamp:
+                self.__interned = InternTable()
+            interned = self.__interned
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        with tracing.span('parse listing', 'listing', url=url) as parse_span:
+            parse_span.add_bytes(os.path.getsize(cached_listing))
+            remote = load_listing(cached_listing, url, interned=interned)
+            load_journal_records(read_cached_journal(cache_directory), url, listing=remote)
+        with self.__lock:
+            self.__remote[cached_listing] = (stamp, remote)
+        self.__changed()
+        return remote
+
+    def get_resolution(self, key):
+        generation, resolution = self.__resolutions.get(key, (None, None))
+        return resolution if generation == self.__generation else None
+
+    def store_resolution(self, key, resolution):
+        self.__resolutions = dict((cached_key, cached) for cached_key, cached in self.__resolutions.items()
+                                  if cached[0] == self.__generation)
+        self.__resolutions[key] = (self.__generation, resolution)
+
+def load_listing(source, root, wanted_names=None, flavor=None, dependency_graph=None, listing=None, interned=None):
+    '''parses the listing incrementally, only packages named in wanted_names (and of the given flavor)
+    are kept if those are given, everything already processed is dropped from the element tree.
+    The names required by the builds of every package of that flavor are collected in dependency_graph
+    if it is given, builds are added to listing if it is given. A new listing shares the versions and
+    attribute names of its builds with the other listings of the InternTable interned, if it is given.'''
+    if listing is None:
+        listing = Listing(root, interned=interned)
+    wanted_names = None if wanted_names is None else set(wanted_names)
+    depth = 0
+    root_element = None
+    package = None
+    wanted = False
+    try:
+        for event, element in ElementTree.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                depth += 1
+                if depth == 1:
+                    root_element = element
+                elif depth == 2 and element.tag == 'Package':
+                    package = (element.attrib.get('name'), element.attrib.get('flavor', 'vanilla'))
+                    if flavor is not None and package[1] != flavor:
+                        package = None
+                    wanted = package is not None and (wanted_names is None or package[0] in wanted_names)
+                continue
+
+            depth -= 1
+            if depth == 2 and element.tag == 'Build':
+                if package is not None:
+                    requirements = [(required.attrib['name'], required.attrib.get('version', ''))
+                                    for required in element.findall('./Requires/Package')]
+                    if dependency_graph is not None:
+                        dependency_graph.setdefault(package[0], set()).update(name for name, _ in requirements)
+                    if wanted:
+                        attributes = dict(element.attrib)
+                        del attributes['version']
+                        listing.load_package(package[0], element.attrib['version'], package[1], attributes, requirements)
+                element.clear()
+            elif depth == 1:
+                package = None
+                root_element.clear()
     except ElementTree.ParseError as error:
         raise InvalidFile('parsing error in %s: %s' % (source, error))
-
-    listing = Listing(root)
-    package_entries = xmltree.findall('./Package')
-    for entry in package_entries:
-        for build in entry.findall('./Build'):
-            if 'flavor' in entry.attrib:
-                listing.add_package(entry.attrib['name'], build.attrib['version'], entry.attrib['flavor'])
-            else:
-                listing.add_package(entry.attrib['name'], build.attrib['version'])
     return listing
 
 def prepare_local_repository(target_repository):
@@ -167,5 +858,5 @@ def prepare_local_repository(target_repository):
         os.makedirs(target_repository)
     elif (not os.path.isdir(target_repository)):
         raise InvalidRepository('I can not prepare your local repository %s, the destination is not a directory.' % target_repository)
-    elif (not os.path.exists(os.path.join(target_repository, get_listing_filename()))):
+    if (not os.path.exists(os.path.join(target_repository, get_listing_filename()))):
         create_empty_listing(target_repository)
@@ -0,0 +1,91 @@
+"""
+    Juggler - Dirty dependency management and packaging for compiled code
+    Copyright (C) 2014  Christian Meyer
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+from juggler import version, compression
+from xml.etree import ElementTree
+
+class LockfileError(Exception):
+    pass
+
+'''
+example lockfile, written next to the juggle.xml of a project whenever its requirements are resolved
+<Lock>
+    <Package name="RequiredPackage" version="1.0.0-b3" flavor="vanilla" source="http://example.com/repository" digest="sha256 of the archive" codec="gz">
+        <Requires>
+            <Package name="IndirectlyRequiredPackage" version="&gt;=0.2.0"/>
+        </Requires>
+    </Package>
+</Lock>
+
+source is the repository the archive was downloaded from, or local for packages that were built locally.
+'''
+def get_lockfile_filename():
+    return 'juggle.lock'
+
+def store_lockfile(filename, locked_packages):
+    root = ElementTree.Element('Lock')
+    for package in sorted(locked_packages, key=lambda package: package['name']):
+        element = ElementTree.SubElement(root, 'Package', {'name': package['name'],
+                                                           'version': package['version'],
+                                                           'flavor': package['flavor'],
+                                                           'source': package['source'],
+                                                           'digest': package['digest'],
+                                                           'codec': package['codec']})
+        if package['requirements']:
+            requires = ElementTree.SubElement(element, 'Requires')
+            for required_name, required_spec in package['requirements']:
+                ElementTree.SubElement(requires, 'Package', {'name': required_name, 'version': required_spec})
+    temp_filename = filename + '.tmp'
+    ElementTree.ElementTree(root).write(temp_filename, encoding="utf-8")
+    os.rename(temp_filename, filename)
+
+def load_lockfile(filename):
+    if not os.path.isfile(filename):
+        raise LockfileError('There is no %s, fetch the required packages once without --frozen to create it' % filename)
+    try:
+        xmltree = ElementTree.parse(filename)
+    except ElementTree.ParseError as error:
+        raise LockfileError('Unable to parse %s: %s' % (filename, error))
+
+    locked_packages = []
+    for element in xmltree.findall('./Package'):
+        package = dict(element.attrib)
+        for key in ('name', 'version', 'flavor', 'source', 'digest'):
+            if not key in package:
+                raise LockfileError('A package in %s has no %s' % (filename, key))
+        try:
+            version.parse_version(package['version'])
+        except (ValueError, IndexError) as error:
+            raise LockfileError('Package %s in %s has an invalid version: %s' % (package['name'], filename, error))
+        package.setdefault('codec', compression.DEFAULT_CODEC)
+        package['requirements'] = [(required.get('name'), required.get('version', ''))
+                                   for required in element.findall('./Requires/Package')]
+        locked_packages.append(package)
+    return locked_packages
+
+def check_lockfile(locked_packages, required_packages, flavor):
+    '''makes sure the lockfile still covers every package required by the project'''
+    locked = dict((package['name'], package) for package in locked_packages)
+    for package in required_packages:
+        entry = locked.get(package['name'])
+        if entry is None:
+            raise LockfileError('%s is required but not locked, fetch without --frozen to update the lockfile' % package['name'])
+        if entry['flavor'] != flavor or not package['version'].match(version.parse_version(entry['version'])):
+            raise LockfileError('%s is locked to %s (%s), which does not satisfy %s (%s), fetch without --frozen to update the lockfile'
+                                % (package['name'], entry['version'], entry['flavor'], package['version'], flavor))
@@ -0,0 +1,119 @@
+"""
+    Juggler - Dirty dependency management and packaging for compiled code
+    Copyright (C) 2014  Christian Meyer
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import hashlib
+from xml.etree import ElementTree
+
+'''
+example deployment manifest, kept in the .juggler directory of a build
+<Manifest>
+    <Package name="RequiredPackage" version="1.0.0-b3" flavor="vanilla" digest="sha256 of the archive" size="1234" mtime="1426982400"/>
+</Manifest>
+'''
+class Manifest():
+    def __init__(self, path):
+        self.__path = path
+        self.__entries = {}
+
+    def get_path(self):
+        return self.__path
+
+    def get_names(self):
+        return self.__entries.keys()
+
+    def get_entry(self, name):
+        return self.__entries.get(name)
+
+    def remove_entry(self, name):
+        if name in self.__entries:
+            del self.__entries[name]
+
+    def restore_entry(self, attributes):
+        self.__entries[attributes['name']] = attributes
+
+    def set_entry(self, name, package_entry, archive_filename, digest=None):
+        stat = os.stat(archive_filename)
+        self.__entries[name] = {'name': name,
+                                'version': str(package_entry.get_version()),
+                                'flavor': package_entry.get_flavor(),
+                                'digest': digest or compute_digest(archive_filename),
+                                'size': str(stat.st_size),
+                                'mtime': str(int(stat.st_mtime))}
+
+    def is_current(self, name, package_entry, archive_filename, digest=None):
+        entry = self.__entries.get(name)
+        if entry is None:
+            return False
+        if digest is not None and entry['digest'] != digest:
+            return False
+        if entry['version'] != str(package_entry.get_version()) or entry['flavor'] != package_entry.get_flavor():
+            return False
+        if not os.path.isdir(os.path.join(self.__path, name)):
+            return False
+        if not os.path.isfile(archive_filename):
+            # the archive was never downloaded into this repository, the version has to do
+            return True
+        stat = os.stat(archive_filename)
+        if entry['size'] == str(stat.st_size) and entry['mtime'] == str(int(stat.st_mtime)):
+            return True
+        if entry['digest'] != compute_digest(archive_filename):
+            return False
+        entry['size'] = str(stat.st_size)
+        entry['mtime'] = str(int(stat.st_mtime))
+        return True
+
+    def store(self):
+        if not os.path.isdir(self.__path):
+            os.makedirs(self.__path)
+        root = ElementTree.Element('Manifest')
+        for name in sorted(self.__entries):
+            ElementTree.SubElement(root, 'Package', self.__entries[name])
+        tree = ElementTree.ElementTree(root)
+        tree.write(os.path.join(self.__path, get_manifest_filename()), encoding="utf-8")
+
+def get_manifest_filename():
+    return 'juggler_manifest.xml'
+
+def compute_digest(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as archive:
+        while True:
+            chunk = archive.read(1024 * 1024)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_manifest(path):
+    deployed = Manifest(path)
+    filename = os.path.join(path, get_manifest_filename())
+    if not os.path.isfile(filename):
+        return deployed
+
+    try:
+        xmltree = ElementTree.parse(filename)
+    except ElementTree.ParseError:
+        # a broken manifest only costs us a full redeployment
+        return deployed
+
+    for element in xmltree.findall('./Package'):
+        attributes = dict(element.attrib)
+        if all(key in attributes for key in ('name', 'version', 'flavor', 'digest', 'size', 'mtime')):
+            deployed.restore_entry(attributes)
+    return deployed
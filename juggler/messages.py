@@ -16,45 +16,73 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import threading
+
 indent_level = 0
 verbose = False
+# messages of worker threads are collected while they run and printed by the main thread afterwards,
+# so their order and indentation do not depend on thread scheduling
+captured = threading.local()
+
+def IsCapturing():
+    return getattr(captured, 'lines', None) is not None
+
+def StartCapture():
+    captured.lines = []
+    captured.indent_level = indent_level
+
+def StopCapture():
+    lines = captured.lines
+    captured.lines = None
+    return lines
+
+def PrintCaptured(lines):
+    for line in lines:
+        print line
+
+def Output(line):
+    if IsCapturing():
+        captured.lines.append(line)
+    else:
+        print line
 
 def Indent():
     global indent_level
-    indent_level += 1
+    if IsCapturing():
+        captured.indent_level += 1
+    else:
+        indent_level += 1
 
 def Unindent():
     global indent_level
-    indent_level -= 1
+    if IsCapturing():
+        captured.indent_level -= 1
+    else:
+        indent_level -= 1
 
 def GetIndent():
-    global indent_level
-    indent = ''
-    i = 0
-    while i < indent_level:
-        indent += '  '
-        i += 1
-    return indent
+    level = captured.indent_level if IsCapturing() else indent_level
+    return '  ' * level
 
 def VERBOSE(msg):
     global verbose
     if verbose and not msg is None:
-        print '%s%s' % (GetIndent(), msg)
+        Output('%s%s' % (GetIndent(), msg))
 
 def INFO(msg, verbose=None):
-    print '%s%s' % (GetIndent(), msg) 
+    Output('%s%s' % (GetIndent(), msg))
     Indent()
     VERBOSE(verbose)
     Unindent()
 
 def WARNING(msg, verbose=None):
-    print '%sWarning: %s' % (GetIndent(), msg) 
+    Output('%sWarning: %s' % (GetIndent(), msg))
     Indent()
     VERBOSE(verbose)
     Unindent()
 
 def ERROR(msg, verbose=None):
-    print '%sERROR %s' % (GetIndent(), msg) 
+    Output('%sERROR %s' % (GetIndent(), msg))
     Indent()
     INFO(verbose)
     Unindent()
@@ -79,6 +107,13 @@ def FetchingRequiredPackages(local_repo, remote_repos):
     Unindent()
     Unindent()
 
+def FetchingLockedPackages(local_repo, lockfile):
+    INFO('Fetching locked packages')
+    Indent()
+    VERBOSE('Versions locked in %s' % lockfile)
+    VERBOSE('Local - %s' % local_repo)
+    Unindent()
+
 def FetchingFailed(exception):
     ERROR('Failed to fetch dependencies', '%s' % exception)
 
@@ -91,6 +126,21 @@ def PublishingProject(name, version, flavor, local_repo):
     VERBOSE('Publishing to %s' % local_repo)
     Unindent()
 
+def PublishedDelta(base_version, delta_size, archive_size):
+    Indent()
+    INFO('Delta against %s - %d bytes instead of %d' % (base_version, delta_size, archive_size))
+    Unindent()
+
+def DeltaSkipped(name, reason):
+    Indent()
+    VERBOSE('No delta published for %s, %s' % (name, reason))
+    Unindent()
+
+def DeltaNotUsable(name, reason):
+    Indent()
+    VERBOSE('Downloading the full archive of %s, the delta is not usable: %s' % (name, reason))
+    Unindent()
+
 def PublishingFailed(exception):
     ERROR('Failed to publish project', '%s' % exception)
 
@@ -100,5 +150,49 @@ def ResolvedPackage(requested_package_info, flavor, resolved_package, source_typ
     VERBOSE('Using artifact from %s (%s)' % (resolved_package.get_path(), source_type))
     Unindent()
 
+def UsingLockedPackage(name, flavor, version, source):
+    INFO('Using locked %s (%s) - version %s' % (name, flavor, version))
+    Indent()
+    VERBOSE('Using artifact from %s' % source)
+    Unindent()
+
 def DownloadingPackage(url):
     INFO('Downloading %s' % url)
+
+def DownloadedRanges(name, mirrors):
+    Indent()
+    for url, transferred, throughput, error in mirrors:
+        if error is not None:
+            VERBOSE('%s - dropped after %d bytes: %s' % (url, transferred, error))
+        elif throughput is not None:
+            VERBOSE('%s - %d bytes at %.1f MiB/s' % (url, transferred, throughput / (1024 * 1024)))
+    Unindent()
+
+def PackageAlreadyDeployed(name):
+    Indent()
+    VERBOSE('%s is already deployed and up to date' % name)
+    Unindent()
+
+def CollectedGarbage(evicted):
+    if not evicted:
+        return
+    INFO('Removed %d builds from the local repository, %d bytes freed' % (len(evicted), sum(cached.size for cached in evicted)))
+    Indent()
+    for cached in evicted:
+        VERBOSE('%s (%s) %s' % (cached.get_name(), cached.get_flavor(), cached.build))
+    Unindent()
+
+def CollectingGarbage(local_repo, budget):
+    INFO('Collecting garbage in %s' % local_repo)
+    Indent()
+    VERBOSE('Keeping at most %d bytes' % budget)
+    Unindent()
+
+def RemovingStalePackage(name):
+    INFO('Removing %s, it is no longer required' % name)
+
+def ServingDaemon(socket_path):
+    INFO('Serving juggler commands on %s' % socket_path)
+
+def DaemonFailed(exception):
+    ERROR('The juggler daemon failed', '%s' % exception)
@@ -17,42 +17,131 @@
 """
 
 import os
-import tarfile
+import stat
+import fnmatch
 import listing
+import manifest
+import messages
+import compression
+import delta
+import upload
+import tracing
 import re
+from semantic_version import Spec
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+DEFAULT_HEADER_PATTERNS = ['*.h', '*.hh', '*.hpp', '*.hxx', '*.inl', '*.ipp', '*.tcc']
 
 class PackedPathNotFound(Exception):
     pass
 
+class InvalidSourceDateEpoch(Exception):
+    pass
+
+def get_normalized_mtime():
+    # every member gets the same timestamp so identical content yields identical archives
+    epoch = os.environ.get('SOURCE_DATE_EPOCH', '0').strip()
+    if not epoch.isdigit():
+        raise InvalidSourceDateEpoch('SOURCE_DATE_EPOCH has to be a number of seconds since 1970, not %s' % epoch)
+    return int(epoch)
+
+def normalize_member(info):
+    info.mtime = get_normalized_mtime()
+    info.uid = 0
+    info.gid = 0
+    info.uname = ''
+    info.gname = ''
+    if info.isdir() or info.mode & stat.S_IXUSR:
+        info.mode = 0755
+    else:
+        info.mode = 0644
+    return info
+
+def add_member(archive, source, arcname):
+    info = normalize_member(archive.gettarinfo(source, arcname))
+    if info.isreg():
+        with open(source, 'rb') as member_file:
+            archive.addfile(info, member_file)
+    else:
+        archive.addfile(info)
+
+def list_directory(path):
+    '''returns (name, is_directory) for the entries of path sorted by name, symlinks are not followed'''
+    if scandir is not None:
+        return sorted((entry.name, entry.is_dir(follow_symlinks=False)) for entry in scandir(path))
+    entries = []
+    for name in os.listdir(path):
+        entries.append((name, stat.S_ISDIR(os.lstat(os.path.join(path, name)).st_mode)))
+    return sorted(entries)
+
+def walk_sorted(root, relative_dir=''):
+    '''yields (relative path, is_directory) for everything below root, depth first and sorted by name'''
+    for name, is_directory in list_directory(os.path.join(root, relative_dir)):
+        relative_path = os.path.join(relative_dir, name)
+        yield relative_path, is_directory
+        if is_directory:
+            for entry in walk_sorted(root, relative_path):
+                yield entry
+
+class PathPatterns:
+    '''glob patterns, those containing a slash are matched against the relative path, all others against the file name'''
+    def __init__(self, patterns):
+        name_patterns = [fnmatch.translate(pattern) for pattern in patterns if not '/' in pattern]
+        path_patterns = [fnmatch.translate(pattern) for pattern in patterns if '/' in pattern]
+        self.__name_expression = re.compile('|'.join(name_patterns)) if name_patterns else None
+        self.__path_expression = re.compile('|'.join(path_patterns)) if path_patterns else None
+
+    def matches(self, relative_path):
+        if self.__name_expression is not None and self.__name_expression.match(os.path.basename(relative_path)):
+            return True
+        return self.__path_expression is not None and self.__path_expression.match(relative_path.replace(os.sep, '/')) is not None
+
+def split_patterns(string):
+    return [pattern for pattern in re.split(r'[,\s]+', string or '') if pattern]
+
 class FilePacker:
     def __init__(self, source, target):
         self.__source = source
         self.__target = target
+
+    def get_source(self):
+        return self.__source
     
     def check(self):
         if not os.path.exists(self.__source):
             raise PackedPathNotFound('I could not find the path %s needed for publishing' % self.__source)
     
     def pack_into(self, tarfile):
-        tarfile.add(name = self.__source, arcname = self.__target)
+        add_member(tarfile, self.__source, self.__target)
+        if os.path.isdir(self.__source) and not os.path.islink(self.__source):
+            for relative_path, _ in walk_sorted(self.__source):
+                add_member(tarfile, os.path.join(self.__source, relative_path), os.path.join(self.__target, relative_path))
 
 class HeaderPacker:
-    def __init__(self, source_dir, target_dir):
+    def __init__(self, source_dir, target_dir, include=DEFAULT_HEADER_PATTERNS, exclude=[]):
         self.__source_dir = source_dir
         self.__target_dir = target_dir
+        self.__include = PathPatterns(include)
+        self.__exclude = PathPatterns(exclude)
+
+    def get_source(self):
+        return self.__source_dir
 
     def check(self):
         if not os.path.exists(self.__source_dir):
-            raise PackedPathNotFound('I could not find the path %s needed for publishing' % self.__source)
+            raise PackedPathNotFound('I could not find the path %s needed for publishing' % self.__source_dir)
     
     def pack_into(self, tarfile):
-        for (dirpath, _, filenames) in os.walk(self.__source_dir):
-            rel_dir = os.path.normpath(os.path.relpath(dirpath, self.__source_dir))
-            for filename in filenames:
-                if not re.match('.*\.h$', filename) is None:
-                    full_src = os.path.join(self.__source_dir, rel_dir, filename)
-                    full_tgt = os.path.join(self.__target_dir, rel_dir, filename)
-                    tarfile.add(name = full_src, arcname = full_tgt)
+        for relative_path, is_directory in walk_sorted(self.__source_dir):
+            if is_directory or not self.__include.matches(relative_path) or self.__exclude.matches(relative_path):
+                continue
+            add_member(tarfile, os.path.join(self.__source_dir, relative_path), os.path.join(self.__target_dir, relative_path))
 
 class Publisher:
     def __init__(self, root_xml_element, source_directory, binary_directory):
@@ -68,20 +157,98 @@ class Publisher:
         for path_element in root_xml_element.findall('Headers'):
             source_path = path_element.text.strip()
             target_path = path_element.attrib['target']
-            self.__packers.append(HeaderPacker(os.path.join(source_directory, source_path), target_path))
+            include = split_patterns(path_element.attrib.get('include')) or DEFAULT_HEADER_PATTERNS
+            exclude = split_patterns(path_element.attrib.get('exclude'))
+            self.__packers.append(HeaderPacker(os.path.join(source_directory, source_path), target_path, include, exclude))
         
+    def pack_into(self, artifact):
+        for packer in self.__packers:
+            with tracing.span('pack', 'publish', packer=packer.__class__.__name__, source=packer.get_source()) as pack_span:
+                # the offset counts the uncompressed tar stream written so far
+                start = artifact.offset
+                packer.pack_into(artifact)
+                pack_span.add_bytes(artifact.offset - start)
+
     def check_packers(self):
+        # an invalid timestamp is reported before anything is written
+        get_normalized_mtime()
         for packer in self.__packers:
             packer.check()
 
-    def publish(self, target_repository, name, version, flavor):
+    def publish(self, target_repository, name, version, flavor, required_packages=[], compression_threads=1,
+                codec=compression.DEFAULT_CODEC, level=None, publish_delta=False):
         listing.prepare_local_repository(target_repository)
         self.check_packers()
         local_listing = listing.load_local_listing(target_repository)
-        new_entry = local_listing.add_package(name, str(version), flavor)
-        archive_name = new_entry.get_filename()
-        artifact = tarfile.TarFile.open(os.path.join(target_repository, archive_name), mode='w:gz')
-        for packer in self.__packers:
-            packer.pack_into(artifact)
-        artifact.close()
-        local_listing.store(target_repository)
+        requirements = [(package['name'], str(package['version'])) for package in required_packages]
+        attributes = {'codec': codec}
+        if level is not None:
+            attributes['level'] = str(level)
+        new_entry = listing.PackageEntry(name, target_repository, version, flavor, attributes)
+        archive_filename = os.path.join(target_repository, new_entry.get_filename())
+        with tracing.span('write archive', 'publish', codec=codec, threads=compression_threads) as archive_span:
+            compression.write_archive(archive_filename, codec, level, compression_threads, self.pack_into)
+            archive_span.add_bytes(os.path.getsize(archive_filename))
+        with tracing.span('digest', 'publish'):
+            attributes['digest'] = manifest.compute_digest(archive_filename)
+        attributes['size'] = str(os.path.getsize(archive_filename))
+
+        delta_filename = os.path.join(target_repository, new_entry.get_delta_filename())
+        if os.path.exists(delta_filename):
+            os.remove(delta_filename)
+        if publish_delta:
+            with tracing.span('delta', 'publish'):
+                self.publish_delta(local_listing, new_entry, archive_filename, delta_filename, attributes)
+        local_listing.add_package(name, str(version), flavor, attributes, requirements)
+        with tracing.span('store listing', 'publish'):
+            # the build is appended to the journal, which is only compacted once it grew too large
+            local_listing.store(target_repository, compact_journal=False)
+
+    def publish_remote(self, repository_url, name, version, flavor, required_packages=[], compression_threads=1,
+                       codec=compression.DEFAULT_CODEC, level=None, timeouts=None):
+        '''
+        streams the archive to an HTTP repository while it is packed and adds it to the listing there,
+        timeouts are the connect and read timeouts in seconds for every request
+        '''
+        self.check_packers()
+        requirements = [(package['name'], str(package['version'])) for package in required_packages]
+        attributes = {'codec': codec}
+        if level is not None:
+            attributes['level'] = str(level)
+        new_entry = listing.PackageEntry(name, repository_url, version, flavor, attributes)
+        archive_upload = upload.ChunkedUpload('/'.join([repository_url, new_entry.get_filename()]), timeouts)
+        with tracing.span('upload archive', 'publish', codec=codec, threads=compression_threads) as upload_span:
+            try:
+                compression.write_archive_to(archive_upload, codec, level, compression_threads, self.pack_into)
+            except:
+                archive_upload.abort()
+                raise
+            archive_upload.close()
+            upload_span.add_bytes(archive_upload.get_size())
+        attributes['digest'] = archive_upload.get_digest()
+        attributes['size'] = str(archive_upload.get_size())
+        with tracing.span('update listing', 'publish', url=repository_url):
+            upload.update_remote_listing(repository_url,
+                                         lambda remote_listing: remote_listing.add_package(name, str(version), flavor, attributes, requirements),
+                                         timeouts)
+
+    def publish_delta(self, local_listing, new_entry, archive_filename, delta_filename, attributes):
+        base = None
+        older = local_listing.get_packages(new_entry.get_name(), Spec('<%s' % new_entry.get_version()), True, new_entry.get_flavor())
+        for candidate in older:
+            if os.path.isfile(os.path.join(local_listing.get_root(), candidate.get_filename())):
+                base = candidate
+                break
+        if base is None:
+            messages.DeltaSkipped(new_entry.get_name(), 'there is no earlier build to compute it against')
+            return
+        delta.create_delta(os.path.join(local_listing.get_root(), base.get_filename()), base.get_codec(), str(base.get_version()),
+                           archive_filename, new_entry.get_codec(), new_entry.get_level(), delta_filename)
+        delta_size = os.path.getsize(delta_filename)
+        if delta_size >= int(attributes['size']) * 0.8:
+            os.remove(delta_filename)
+            messages.DeltaSkipped(new_entry.get_name(), 'it would not be much smaller than the archive')
+            return
+        attributes['delta_base'] = str(base.get_version())
+        attributes['delta_size'] = str(delta_size)
+        messages.PublishedDelta(base.get_version(), delta_size, int(attributes['size']))
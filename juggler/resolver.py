@@ -0,0 +1,185 @@
+"""
+    Juggler - Dirty dependency management and packaging for compiled code
+    Copyright (C) 2014  Christian Meyer
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from semantic_version import Spec
+
+class ResolutionFailed(Exception):
+    pass
+
+class CandidateList():
+    '''the candidates produced by an iterator, newest first, pulled only as far as they are needed'''
+    def __init__(self, iterator):
+        self.__iterator = iterator
+        self.__candidates = []
+        self.__exhausted = False
+
+    def get(self, position):
+        while len(self.__candidates) <= position and not self.__exhausted:
+            candidate = next(self.__iterator, None)
+            if candidate is None:
+                self.__exhausted = True
+            else:
+                self.__candidates.append(candidate)
+        if position < len(self.__candidates):
+            return self.__candidates[position]
+        return None
+
+def combine_specs(specs):
+    return Spec(*sorted(set(str(spec) for spec in specs)))
+
+class Resolver():
+    '''
+    Picks one build for every package that is required directly or by another picked build.
+
+    get_candidates(name, spec) has to return an iterator over the builds of name matching spec,
+    newest first. Builds need to provide get_version() and get_requirements().
+
+    The search assigns packages one after the other, always trying the newest build that satisfies
+    every requirement placed on the package so far. A build is only assigned if its own requirements
+    can still be met. When a package runs out of builds the search jumps back to the most recently
+    assigned package that restricted it (conflict-directed backjumping) instead of the previous one.
+    '''
+    def __init__(self, get_candidates):
+        self.__get_candidates = get_candidates
+        self.__candidate_lists = {}
+
+    def get_candidate_list(self, name, specs):
+        spec = combine_specs(specs)
+        key = (name, str(spec))
+        if not key in self.__candidate_lists:
+            self.__candidate_lists[key] = CandidateList(self.__get_candidates(name, spec))
+        return self.__candidate_lists[key]
+
+    def resolve(self, required_packages):
+        '''returns (name, combined spec, build) for every needed package, required packages first'''
+        self.__constraints = {}
+        self.__order = []
+        self.__frames = []
+        self.__assigned = {}
+        self.__first_conflict = None
+        for package in required_packages:
+            self.__add_constraint(package['name'], package['version'], None)
+
+        while True:
+            name = self.__next_unassigned()
+            if name is None:
+                break
+            frame = {'name': name,
+                     'candidates': self.get_candidate_list(name, self.__get_specs(name)),
+                     'position': 0,
+                     'candidate': None,
+                     'added': [],
+                     'conflicts': self.__get_origins(name)}
+            self.__frames.append(frame)
+            while not self.__assign_next(frame):
+                frame = self.__backjump(frame)
+
+        return [(assigned_name, combine_specs(self.__get_specs(assigned_name)), self.__assigned[assigned_name]['candidate'])
+                for assigned_name in self.__order if assigned_name in self.__assigned]
+
+    def __get_specs(self, name):
+        return [spec for spec, _ in self.__constraints.get(name, [])]
+
+    def __get_origins(self, name):
+        return set(origin for _, origin in self.__constraints.get(name, []) if origin is not None)
+
+    def __add_constraint(self, name, spec, origin):
+        if not name in self.__constraints:
+            self.__constraints[name] = []
+            self.__order.append(name)
+        self.__constraints[name].append((spec, origin))
+
+    def __next_unassigned(self):
+        for name in self.__order:
+            if self.__constraints[name] and not name in self.__assigned:
+                return name
+        return None
+
+    def __is_consistent(self, frame, candidate):
+        for requirement in candidate.get_requirements():
+            required_name = requirement['name']
+            if required_name in self.__assigned:
+                if not requirement['version'].match(self.__assigned[required_name]['candidate'].get_version()):
+                    frame['conflicts'].add(required_name)
+                    self.__record_conflict(frame['name'], candidate, requirement)
+                    return False
+            elif required_name != frame['name']:
+                specs = self.__get_specs(required_name) + [requirement['version']]
+                if self.get_candidate_list(required_name, specs).get(0) is None:
+                    frame['conflicts'].update(self.__get_origins(required_name))
+                    self.__record_conflict(frame['name'], candidate, requirement)
+                    return False
+        return True
+
+    def __record_conflict(self, name, candidate, requirement):
+        if self.__first_conflict is not None:
+            return
+        required_name = requirement['name']
+        self.__first_conflict = '%s %s requires %s %s' % (name, candidate.get_version(), required_name, requirement['version'])
+        if self.__constraints.get(required_name) or required_name in self.__assigned:
+            self.__first_conflict += ', but %s is also restricted to %s' % (required_name, self.__describe_constraints(required_name))
+        else:
+            self.__first_conflict += ', but there is no such version'
+
+    def __assign_next(self, frame):
+        while True:
+            candidate = frame['candidates'].get(frame['position'])
+            frame['position'] += 1
+            if candidate is None:
+                return False
+            if self.__is_consistent(frame, candidate):
+                frame['candidate'] = candidate
+                self.__assigned[frame['name']] = frame
+                for requirement in candidate.get_requirements():
+                    self.__add_constraint(requirement['name'], requirement['version'], frame['name'])
+                    frame['added'].append((requirement['name'], requirement['version']))
+                return True
+
+    def __unassign(self, frame):
+        for name, spec in frame['added']:
+            self.__constraints[name].remove((spec, frame['name']))
+        frame['added'] = []
+        frame['candidate'] = None
+        del self.__assigned[frame['name']]
+
+    def __backjump(self, frame):
+        self.__frames.pop()
+        conflicts = frame['conflicts']
+        culprits = [assigned for assigned in self.__frames if assigned['name'] in conflicts]
+        if not culprits:
+            if frame['candidates'].get(0) is None or self.__first_conflict is None:
+                raise ResolutionFailed('None of the repositories known to me contain a version of %s that satisfies %s'
+                                       % (frame['name'], self.__describe_constraints(frame['name'])))
+            raise ResolutionFailed('I could not find versions of the required packages that fit together: %s' % self.__first_conflict)
+        target = culprits[-1]
+        while self.__frames[-1] is not target:
+            self.__unassign(self.__frames.pop())
+        self.__unassign(target)
+        target['conflicts'].update(conflicts - set([target['name']]))
+        return target
+
+    def __describe_constraints(self, name):
+        reasons = []
+        for spec, origin in self.__constraints.get(name, []):
+            if origin is None:
+                reasons.append('%s (required by the project)' % spec)
+            else:
+                reasons.append('%s (required by %s %s)' % (spec, origin, self.__assigned[origin]['candidate'].get_version()))
+        if name in self.__assigned:
+            reasons.append('%s (already resolved)' % self.__assigned[name]['candidate'].get_version())
+        return ', '.join(reasons)
@@ -0,0 +1,152 @@
+"""
+    Juggler - Dirty dependency management and packaging for compiled code
+    Copyright (C) 2014  Christian Meyer
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import stat
+import errno
+import shutil
+import tempfile
+import compression
+
+'''
+extracted package store, kept in the store directory of the local repository
+
+    store/RequiredPackage_vanilla-1.0.0-b3/        read only extraction of the archive
+    store/RequiredPackage_vanilla-1.0.0-b3.stamp   size and mtime of the archive it was extracted from
+
+extract  every deployment extracts the archive on its own, nothing is kept in the store
+symlink  the deployed package is a symlink to the store directory
+hardlink the deployed package is a tree of directories with the files hardlinked from the store
+'''
+DEPLOY_MODES = ['extract', 'symlink', 'hardlink']
+
+def get_store_directory(local_repository):
+    return os.path.join(local_repository, 'store')
+
+def get_archive_stamp(archive_filename):
+    archive_stat = os.stat(archive_filename)
+    return '%d %d' % (archive_stat.st_size, int(archive_stat.st_mtime))
+
+def make_read_only(path):
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            filepath = os.path.join(dirpath, filename)
+            if not os.path.islink(filepath):
+                os.chmod(filepath, stat.S_IMODE(os.lstat(filepath).st_mode) & ~0222)
+    for dirpath, dirnames, filenames in os.walk(path, topdown=False):
+        # the top directory stays writable, moving a directory to another parent needs that
+        if dirpath != path:
+            os.chmod(dirpath, stat.S_IMODE(os.lstat(dirpath).st_mode) & ~0222)
+
+def remove_tree(path):
+    '''removes deployments and store entries, including symlinks and read only directories'''
+    if os.path.islink(path) or os.path.isfile(path):
+        os.remove(path)
+        return
+    if not os.path.isdir(path):
+        return
+    for dirpath, dirnames, filenames in os.walk(path):
+        os.chmod(dirpath, stat.S_IMODE(os.lstat(dirpath).st_mode) | stat.S_IWUSR | stat.S_IXUSR | stat.S_IRUSR)
+    shutil.rmtree(path)
+
+def link_tree(source, target):
+    os.mkdir(target)
+    for name in sorted(os.listdir(source)):
+        source_path = os.path.join(source, name)
+        target_path = os.path.join(target, name)
+        if os.path.islink(source_path):
+            os.symlink(os.readlink(source_path), target_path)
+        elif os.path.isdir(source_path):
+            link_tree(source_path, target_path)
+        else:
+            try:
+                os.link(source_path, target_path)
+            except OSError as error:
+                if not error.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    raise
+                # the deployment lives on another file system or links are not allowed there
+                shutil.copy2(source_path, target_path)
+
+class PackageStore():
+    def __init__(self, root, mode):
+        self.__root = root
+        self.__mode = mode
+
+    def get_root(self):
+        return self.__root
+
+    def get_mode(self):
+        return self.__mode
+
+    def get_path(self, package_entry):
+        filename = package_entry.get_filename()
+        return os.path.join(self.__root, filename[:-len(compression.get_extension(package_entry.get_codec()))])
+
+    def is_extracted(self, package_entry, archive_filename):
+        store_path = self.get_path(package_entry)
+        if not os.path.isdir(store_path):
+            return False
+        try:
+            with open(store_path + '.stamp') as stamp_file:
+                return stamp_file.read() == get_archive_stamp(archive_filename)
+        except (IOError, OSError):
+            return False
+
+    def ensure_extracted(self, package_entry, archive_filename, extract):
+        '''extract(path) has to unpack the archive into path, it is only called if the store has no current copy'''
+        store_path = self.get_path(package_entry)
+        if self.is_extracted(package_entry, archive_filename):
+            return store_path
+        if not os.path.isdir(self.__root):
+            try:
+                os.makedirs(self.__root)
+            except OSError:
+                if not os.path.isdir(self.__root):
+                    raise
+        # extract next to the final location and move it there in one step, so other juggler
+        # processes sharing the repository never see half extracted packages
+        temp_dir = tempfile.mkdtemp(prefix=os.path.basename(store_path) + '.', suffix='.tmp', dir=self.__root)
+        try:
+            extracted = os.path.join(temp_dir, 'content')
+            extract(extracted)
+            make_read_only(extracted)
+            if os.path.exists(store_path):
+                os.rename(store_path, os.path.join(temp_dir, 'outdated'))
+            try:
+                os.rename(extracted, store_path)
+            except OSError:
+                # another process has just put its extraction in place
+                if not os.path.isdir(store_path):
+                    raise
+            stamp_filename = os.path.join(temp_dir, 'stamp')
+            with open(stamp_filename, 'w') as stamp_file:
+                stamp_file.write(get_archive_stamp(archive_filename))
+            os.rename(stamp_filename, store_path + '.stamp')
+        finally:
+            remove_tree(temp_dir)
+        return store_path
+
+    def deploy(self, store_path, target_dir):
+        remove_tree(target_dir)
+        parent = os.path.dirname(target_dir)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        if self.__mode == 'symlink':
+            os.symlink(os.path.abspath(store_path), target_dir)
+        else:
+            link_tree(store_path, target_dir)
@@ -8,6 +8,7 @@ import unittest
 import tempfile
 import shutil
 import os
+from juggler import store
 
 class JugglerTestCase(unittest.TestCase):
     def _get_test_user_config(self):
@@ -37,7 +38,8 @@ class JugglerTestCase(unittest.TestCase):
 
     def _run_juggler(self, args):
         from juggler.__main__ import main
-        return main(args)
+        # a daemon the user started must not run the commands of the tests, a later --daemon_socket wins
+        return main(['--daemon_socket', os.path.join(self.cnf_dir, 'daemon.sock')] + args)
 
     def setUp(self):
         self.cnf_dir = tempfile.mkdtemp()
@@ -51,5 +53,6 @@ class JugglerTestCase(unittest.TestCase):
         shutil.rmtree(self.cnf_dir)
         shutil.rmtree(self.src_dir)
         shutil.rmtree(self.bin_dir)
-        shutil.rmtree(self.local_repo_dir)
+        # the package store inside the local repository is read only
+        store.remove_tree(self.local_repo_dir)
         shutil.rmtree(self.remote_repo_dir)
\ No newline at end of file
@@ -0,0 +1,159 @@
+'''
+Created on 18.10.2026
+
+@author: Konfuzzyus
+'''
+
+import os
+import sys
+import gzip
+import socket
+import time
+import hashlib
+import email.utils
+import threading
+import StringIO
+import BaseHTTPServer
+import SocketServer
+
+class _ThreadedHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients that timed out close the connection before a delayed reply is sent
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+class _RepositoryRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _get_filename(self):
+        return os.path.join(self.server.stand_in.root, self.path.lstrip('/').split('?')[0])
+
+    def _reply(self, status, headers={}, body=''):
+        self.server.stand_in.record(self.command, self.path, status)
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_GET(self):
+        if self.server.stand_in.delay:
+            time.sleep(self.server.stand_in.delay)
+        if self.server.stand_in.take_failing_get():
+            return self._reply(500)
+        filename = self._get_filename()
+        if not os.path.isfile(filename):
+            return self._reply(404)
+        stat = os.stat(filename)
+        etag = _get_etag(filename)
+        headers = {'ETag': etag,
+                   'Last-Modified': email.utils.formatdate(stat.st_mtime, usegmt=True)}
+        if self.headers.get('If-None-Match') == etag:
+            return self._reply(304, headers)
+        modified_since = self.headers.get('If-Modified-Since')
+        if modified_since is not None and email.utils.mktime_tz(email.utils.parsedate_tz(modified_since)) >= int(stat.st_mtime):
+            return self._reply(304, headers)
+
+        with open(filename, 'rb') as served_file:
+            body = served_file.read()
+        requested_range = self.headers.get('Range')
+        if requested_range is not None and self.server.stand_in.serve_ranges:
+            start, end = [int(position) for position in requested_range.split('=')[1].split('-')]
+            end = min(end, len(body) - 1)
+            headers['Content-Range'] = 'bytes %d-%d/%d' % (start, end, len(body))
+            return self._reply(206, headers, body[start:end + 1])
+        if self.server.stand_in.gzip and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            buf = StringIO.StringIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as compressed:
+                compressed.write(body)
+            body = buf.getvalue()
+            headers['Content-Encoding'] = 'gzip'
+        self._reply(200, headers, body)
+
+    do_HEAD = do_GET
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() != 'chunked':
+            return [self.rfile.read(int(self.headers.get('Content-Length', 0)))]
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().split(';')[0].strip(), 16)
+            if size == 0:
+                self.rfile.readline()
+                return chunks
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+
+    def do_PUT(self):
+        stand_in = self.server.stand_in
+        filename = self._get_filename()
+        chunks = self._read_body()
+        stand_in.uploads.append((self.path, self.headers.get('Transfer-Encoding'), max([len(chunk) for chunk in chunks] or [0])))
+        if stand_in.before_put is not None:
+            stand_in.before_put(self.path)
+        with stand_in.put_lock:
+            exists = os.path.isfile(filename)
+            if self.headers.get('If-None-Match') == '*' and exists:
+                return self._reply(412)
+            if_match = self.headers.get('If-Match')
+            if if_match is not None and (not exists or _get_etag(filename) != if_match):
+                return self._reply(412)
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            with open(filename + '.upload', 'wb') as uploaded:
+                for chunk in chunks:
+                    uploaded.write(chunk)
+            os.rename(filename + '.upload', filename)
+        self._reply(204 if exists else 201)
+
+def _get_etag(filename):
+    with open(filename, 'rb') as served_file:
+        return '"%s"' % hashlib.md5(served_file.read()).hexdigest()
+
+class StandInRepositoryServer:
+    def __init__(self, root, gzip=False):
+        self.root = root
+        self.gzip = gzip
+        self.delay = 0
+        self.serve_ranges = True
+        # the next failing_gets GET requests are answered with 500
+        self.failing_gets = 0
+        self.requests = []
+        self.uploads = []
+        self.before_put = None
+        self.put_lock = threading.Lock()
+        self.__lock = threading.Lock()
+        self.__server = _ThreadedHTTPServer(('127.0.0.1', 0), _RepositoryRequestHandler)
+        self.__server.stand_in = self
+        self.__thread = None
+
+    def record(self, method, path, status):
+        with self.__lock:
+            self.requests.append((method, path, status))
+
+    def take_failing_get(self):
+        with self.__lock:
+            if self.failing_gets <= 0:
+                return False
+            self.failing_gets -= 1
+            return True
+
+    def get_url(self):
+        return 'http://127.0.0.1:%d' % self.__server.server_address[1]
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.__server.serve_forever)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__thread.join()
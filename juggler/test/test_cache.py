@@ -0,0 +1,86 @@
+"""
+    Juggler - Dirty dependency management and packaging for compiled code
+    Copyright (C) 2014  Christian Meyer
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import time
+from juggler import cache, listing
+from juggler.test.base_testcase import JugglerTestCase
+
+class TestCollectGarbage(JugglerTestCase):
+
+    def _add_build(self, name, version_string, size, accessed=None, downloaded=True):
+        listing.prepare_local_repository(self.local_repo_dir)
+        local_listing = listing.load_local_listing(self.local_repo_dir)
+        attributes = {'origin': 'http://example.com/repository'} if downloaded else {}
+        entry = local_listing.add_package(name, version_string, 'vanilla', attributes)
+        local_listing.store(self.local_repo_dir)
+        archive_filename = os.path.join(self.local_repo_dir, entry.get_filename())
+        with open(archive_filename, 'wb') as archive:
+            archive.write('x' * size)
+        if accessed is not None:
+            cache.record_access(self.local_repo_dir, [archive_filename], accessed)
+        return archive_filename
+
+    def _get_builds(self, name):
+        info = listing.load_local_listing(self.local_repo_dir).get_package_info(name, 'vanilla')
+        return [] if info is None else [str(build) for build in info.get_builds()]
+
+    def test_CollectOverBudget_LeastRecentlyUsedBuildsAreRemoved(self):
+        now = time.time()
+        oldest = self._add_build('Package', 'v1.0-b1', 1000, now - 300)
+        newest = self._add_build('Package', 'v1.0-b2', 1000, now - 100)
+        middle = self._add_build('Other', 'v1.0-b1', 1000, now - 200)
+        evicted = cache.collect_garbage(self.local_repo_dir, 1500)
+        self.assertEqual([os.path.basename(cached.archive_filename) for cached in evicted],
+                         [os.path.basename(oldest), os.path.basename(middle)])
+        self.assertFalse(os.path.exists(oldest))
+        self.assertTrue(os.path.exists(newest))
+        self.assertEqual(self._get_builds('Package'), ['1.0.0-b2'])
+        self.assertEqual(self._get_builds('Other'), [])
+        self.assertEqual(cache.load_access_times(self.local_repo_dir).keys(), [os.path.basename(newest)])
+
+    def test_CollectUnderBudget_NothingIsRemoved(self):
+        archive = self._add_build('Package', 'v1.0-b1', 1000)
+        self.assertEqual(cache.collect_garbage(self.local_repo_dir, 1000), [])
+        self.assertTrue(os.path.exists(archive))
+
+    def test_CollectPublishedBuilds_OnlyRemovedIfIncluded(self):
+        published = self._add_build('Package', 'v1.0-local', 1000, time.time() - 100, downloaded=False)
+        downloaded = self._add_build('Package', 'v1.0-b1', 1000, time.time())
+        cache.collect_garbage(self.local_repo_dir, 0)
+        self.assertTrue(os.path.exists(published))
+        self.assertFalse(os.path.exists(downloaded))
+        self.assertEqual(self._get_builds('Package'), ['1.0.0-local'])
+        cache.collect_garbage(self.local_repo_dir, 0, include_published=True)
+        self.assertEqual(self._get_builds('Package'), [])
+
+    def test_CollectWithKeptArchive_KeptArchiveSurvives(self):
+        kept = self._add_build('Package', 'v1.0-b1', 1000, time.time() - 100)
+        cache.collect_garbage(self.local_repo_dir, 0, keep=[kept])
+        self.assertTrue(os.path.exists(kept))
+
+    def test_GcCommand_RemovesDownloadedBuilds(self):
+        downloaded = self._add_build('Package', 'v1.0-b1', 1000)
+        self.assertEqual(self._run_juggler(['--user_config', self.user_config, 'gc', '--budget', '0']), 0)
+        self.assertFalse(os.path.exists(downloaded))
+
+    def test_GcCommandWithoutBudget_RefusesAndKeepsBuilds(self):
+        downloaded = self._add_build('Package', 'v1.0-b1', 1000)
+        with self.assertRaises(SystemExit):
+            self._run_juggler(['--user_config', self.user_config, 'gc'])
+        self.assertTrue(os.path.exists(downloaded))
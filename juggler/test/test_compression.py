@@ -0,0 +1,78 @@
+"""
+    Juggler - Dirty dependency management and packaging for compiled code
+    Copyright (C) 2014  Christian Meyer
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import gzip
+import random
+import tarfile
+import StringIO
+from juggler import compression
+
+class TestParallelGzipWriter(unittest.TestCase):
+
+    def _compress(self, chunks, threads, block_size=4096):
+        output = StringIO.StringIO()
+        with compression.ParallelGzipWriter(output, threads, block_size=block_size) as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+        return output.getvalue()
+
+    def _decompress(self, data):
+        return gzip.GzipFile(fileobj=StringIO.StringIO(data)).read()
+
+    def _random_chunks(self):
+        generator = random.Random(3)
+        words = ['static', 'library', 'symbol', 'object', '\x00\x01\x02']
+        return [''.join(generator.choice(words) for _ in range(generator.randrange(1, 2000))) for _ in range(40)]
+
+    def test_SeveralBlocks_GzipReadsOriginalData(self):
+        chunks = self._random_chunks()
+        self.assertEqual(self._decompress(self._compress(chunks, 4)), ''.join(chunks))
+
+    def test_NoData_ProducesValidEmptyStream(self):
+        self.assertEqual(self._decompress(self._compress([], 3)), '')
+
+    def test_DifferentThreadCounts_OutputIsIdentical(self):
+        chunks = self._random_chunks()
+        self.assertEqual(self._compress(chunks, 1), self._compress(chunks, 5))
+
+    def test_TarStream_TarfileCanExtractIt(self):
+        output = StringIO.StringIO()
+        content = 'x' * 100000
+        with compression.ParallelGzipWriter(output, 2, block_size=8192) as writer:
+            archive = tarfile.open(fileobj=writer, mode='w|')
+            info = tarfile.TarInfo('lib/libLarge.a')
+            info.size = len(content)
+            archive.addfile(info, StringIO.StringIO(content))
+            archive.close()
+        output.seek(0)
+        with tarfile.open(fileobj=output, mode='r:gz') as archive:
+            self.assertEqual(archive.extractfile('lib/libLarge.a').read(), content)
+
+class TestCodecs(unittest.TestCase):
+
+    def test_ParseCodecWithLevel_LevelIsReturned(self):
+        self.assertEqual(compression.parse_codec('gz:9'), ('gz', 9))
+        self.assertEqual(compression.parse_codec(' bz2 '), ('bz2', None))
+
+    def test_ParseInvalidCodec_RaisesUnknownCodec(self):
+        for string in ['zip', 'gz:10', 'bz2:0', 'tar:1', 'gz:fast']:
+            self.assertRaises(compression.UnknownCodec, compression.parse_codec, string)
+
+    def test_UnknownCodecInListing_FilenameStillDerived(self):
+        self.assertEqual(compression.get_extension('zst'), '.tar.zst')
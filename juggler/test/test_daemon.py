@@ -0,0 +1,160 @@
+"""
+    Juggler - Dirty dependency management and packaging for compiled code
+    Copyright (C) 2014  Christian Meyer
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import tarfile
+import tempfile
+import StringIO
+import subprocess
+from juggler import daemon, manifest
+from juggler.test.base_testcase import JugglerTestCase
+
+PRJ_REQUIRED_XML = '''
+    <Project>
+        <Name>Required</Name>
+        <Version>v1.0</Version>
+        <Requires/>
+        <Content/>
+    </Project>'''
+
+PRJ_REQUIRING_XML = '''
+    <Project>
+        <Name>Requiring</Name>
+        <Version>v1.0</Version>
+        <Requires>
+            <Package>
+                <Name>Required</Name>
+                <Version>v1</Version>
+            </Package>
+        </Requires>
+        <Content/>
+    </Project>'''
+
+DAEMON_SCRIPT = 'import sys; from juggler.__main__ import main; sys.exit(main(sys.argv[1:]))'
+
+class TestDaemon(JugglerTestCase):
+
+    def setUp(self):
+        JugglerTestCase.setUp(self)
+        self.socket_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.socket_dir, 'daemon.sock')
+        self.daemon = None
+
+    def tearDown(self):
+        if self.daemon is not None:
+            self.daemon.terminate()
+            self.daemon.wait()
+        shutil.rmtree(self.socket_dir)
+        JugglerTestCase.tearDown(self)
+
+    def _start_daemon(self):
+        package_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.daemon = subprocess.Popen([sys.executable, '-c', DAEMON_SCRIPT, 'daemon', '--daemon_socket', self.socket_path],
+                                   cwd=package_root, stdout=open(os.devnull, 'w'))
+        deadline = time.time() + 10
+        while not os.path.exists(self.socket_path):
+            self.assertIsNone(self.daemon.poll(), 'the daemon exited with %s' % self.daemon.returncode)
+            self.assertLess(time.time(), deadline, 'the daemon did not start serving')
+            time.sleep(0.05)
+
+    def _forward(self, command):
+        output = StringIO.StringIO()
+        args = ['--user_config', self.user_config, command, self.src_dir, self.bin_dir]
+        return daemon.forward(self.socket_path, args, output), output.getvalue()
+
+    def test_NoDaemon_CommandRunsInProcess(self):
+        self._with_project_config(PRJ_REQUIRED_XML)
+        self.assertIsNone(daemon.forward(self.socket_path, ['publish', self.src_dir, self.bin_dir]))
+        exit_code = self._run_juggler(['--user_config', self.user_config, '--daemon_socket', self.socket_path,
+                                       'publish', self.src_dir, self.bin_dir])
+        self.assertEqual(exit_code, 0)
+        self.assertIn('Required_vanilla-1.0.0-local.tar.gz', os.listdir(self.local_repo_dir))
+
+    def test_FetchTwiceThroughDaemon_PackageIsDeployed(self):
+        self._start_daemon()
+        self._with_project_config(PRJ_REQUIRED_XML)
+        exit_code, output = self._forward('publish')
+        self.assertEqual(exit_code, 0)
+        self.assertIn('Publishing project', output)
+
+        self._with_project_config(PRJ_REQUIRING_XML)
+        for _ in range(2):
+            exit_code, output = self._forward('fetch')
+            self.assertEqual(exit_code, 0, output)
+            self.assertIn('Resolved Required', output)
+        self.assertIsNotNone(manifest.load_manifest(os.path.join(self.bin_dir, '.juggler')).get_entry('Required'))
+
+    def test_PlanThroughDaemon_OnlyPlanIsWrittenToOutput(self):
+        self._start_daemon()
+        self._with_project_config(PRJ_REQUIRED_XML)
+        self.assertEqual(self._forward('publish')[0], 0)
+        self._with_project_config(PRJ_REQUIRING_XML)
+        output = StringIO.StringIO()
+        error_output = StringIO.StringIO()
+        args = ['--user_config', self.user_config, 'plan', self.src_dir, self.bin_dir]
+        self.assertEqual(daemon.forward(self.socket_path, args, output, error_output), 0)
+        plan = json.loads(output.getvalue())
+        self.assertEqual([package['name'] for package in plan['packages']], ['Required'])
+        self.assertIn('Resolved Required', error_output.getvalue())
+
+    def test_PublishThroughDaemon_ClientSourceDateEpochIsUsed(self):
+        self._start_daemon()
+        with open(os.path.join(self.src_dir, 'a.h'), 'w') as header:
+            header.write('a')
+        self._with_project_config(PRJ_REQUIRED_XML.replace('<Content/>', '<Content><SourcePath target="include">a.h</SourcePath></Content>'))
+        os.environ['SOURCE_DATE_EPOCH'] = '1400000000'
+        try:
+            self.assertEqual(self._forward('publish')[0], 0)
+        finally:
+            del os.environ['SOURCE_DATE_EPOCH']
+        with tarfile.open(os.path.join(self.local_repo_dir, 'Required_vanilla-1.0.0-local.tar.gz')) as archive:
+            self.assertEqual(set(member.mtime for member in archive.getmembers()), set([1400000000]))
+
+    def test_HandleRequest_CommandRunsWithClientEnvironment(self):
+        client, server = socket.socketpair()
+        seen = []
+        def run(argv):
+            seen.append((os.environ.get('JUGGLER_CLIENT_ONLY'), os.path.expanduser('~')))
+            return 0
+        request = {'argv': ['fetch'], 'cwd': os.getcwd(), 'env': {'JUGGLER_CLIENT_ONLY': 'yes', 'HOME': self.cnf_dir}}
+        client.sendall(json.dumps(request) + '\n')
+        home = os.environ.get('HOME')
+        try:
+            daemon.handle(server, run)
+        finally:
+            server.close()
+        self.assertEqual(json.loads(client.makefile('rb').readline()), {'exit': 0})
+        client.close()
+        self.assertEqual(seen, [('yes', self.cnf_dir)])
+        self.assertNotIn('JUGGLER_CLIENT_ONLY', os.environ)
+        self.assertEqual(os.environ.get('HOME'), home)
+
+    def test_InvalidArgumentsThroughDaemon_DaemonKeepsServing(self):
+        self._start_daemon()
+        self.assertEqual(daemon.forward(self.socket_path, ['fetch', '--no_such_option'], StringIO.StringIO(), StringIO.StringIO()), 2)
+        self._with_project_config(PRJ_REQUIRED_XML)
+        self.assertEqual(self._forward('publish')[0], 0)
+
+    def test_SecondDaemonOnSameSocket_RaisesDaemonFailed(self):
+        self._start_daemon()
+        self.assertRaises(daemon.DaemonFailed, daemon.serve, self.socket_path, None)
@@ -0,0 +1,444 @@
+"""
+    Juggler - Dirty dependency management and packaging for compiled code
+    Copyright (C) 2014  Christian Meyer
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import random
+import tempfile
+import shutil
+import time
+from juggler.test.base_testcase import JugglerTestCase
+from juggler.test.stand_in_server import StandInRepositoryServer
+from xml.etree import ElementTree
+from juggler import compression, dependency, download, listing, lockfile, manifest, publisher, store, version
+
+class TestDependencyManager(JugglerTestCase):
+
+    def _publish_to_remote(self, name, version_string, flavor='vanilla', content='content', requirements=None, codec='gz',
+                           record_digest=False):
+        listing.prepare_local_repository(self.remote_repo_dir)
+        remote_listing = listing.load_local_listing(self.remote_repo_dir)
+        entry = listing.PackageEntry(name, self.remote_repo_dir, version.parse_version(version_string), flavor, {'codec': codec})
+        archive_filename = os.path.join(self.remote_repo_dir, entry.get_filename())
+        payload_dir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(payload_dir, 'payload.txt'), 'w') as payload:
+                payload.write(content)
+            self._write_archive(archive_filename, codec, os.path.join(payload_dir, 'payload.txt'))
+        finally:
+            shutil.rmtree(payload_dir)
+        attributes = {'codec': codec}
+        if record_digest:
+            attributes['digest'] = manifest.compute_digest(archive_filename)
+            attributes['size'] = str(os.path.getsize(archive_filename))
+        entry = remote_listing.add_package(name, version_string, flavor, attributes, requirements)
+        remote_listing.store(self.remote_repo_dir)
+        return entry
+
+    def _write_archive(self, archive_filename, codec, payload_filename):
+        compression.write_archive(archive_filename, codec, None, 1,
+                                  lambda archive: archive.add(payload_filename, arcname='payload.txt'))
+
+    def _publish_headers_to_remote(self, version_string, changed_header):
+        for index in range(20):
+            with open(os.path.join(self.src_dir, 'header%02d.h' % index), 'w') as header:
+                generator = random.Random(index)
+                for _ in range(200):
+                    header.write('int function_%x(void);\n' % generator.getrandbits(64))
+                if index == changed_header:
+                    header.write('int changed(void);\n')
+        content = ElementTree.fromstring('<Content><Headers target="include">.</Headers></Content>')
+        distributer = publisher.Publisher(content, self.src_dir, self.bin_dir)
+        distributer.publish(self.remote_repo_dir, 'Headers', version.parse_version(version_string), 'vanilla', publish_delta=True)
+        return listing.load_local_listing(self.remote_repo_dir).get_package('Headers', version.parse_spec('==%s' % version_string[1:]))
+
+    def _required(self, *names):
+        return [{'name': name, 'version': version.parse_spec('')} for name in names]
+
+    def _read_payload(self, name):
+        with open(os.path.join(self.bin_dir, '.juggler', name, 'payload.txt')) as payload:
+            return payload.read()
+
+    def _create_manager(self, download_threads=1, wanted_names=None, deploy_mode='extract'):
+        return dependency.DependencyManager(self.local_repo_dir, ['file://%s' % self.remote_repo_dir], download_threads,
+                                            wanted_names=wanted_names, flavor='vanilla', deploy_mode=deploy_mode)
+
+    def test_DeployConcurrently_AllPackagesExtracted(self):
+        names = ['Package%d' % i for i in range(6)]
+        for name in names:
+            self._publish_to_remote(name, 'v1.0-b1', content=name)
+        manager = self._create_manager(download_threads=4)
+        manager.deploy(self._required(*names), os.path.join(self.bin_dir, '.juggler'), False, 'vanilla')
+        for name in names:
+            self.assertEqual(self._read_payload(name), name)
+        local_listing = listing.load_local_listing(self.local_repo_dir)
+        for name in names:
+            self.assertIsNotNone(local_listing.get_package(name))
+
+    def test_DeployConcurrently_FirstFailingPackageIsReported(self):
+        for name in ['Good', 'Broken', 'AlsoBroken']:
+            entry = self._publish_to_remote(name, 'v1.0-b1')
+            if name != 'Good':
+                os.remove(os.path.join(self.remote_repo_dir, entry.get_filename()))
+        manager = self._create_manager(download_threads=3)
+        with self.assertRaises(dependency.RequiredPackageNotAvailable) as context:
+            manager.deploy(self._required('Good', 'Broken', 'AlsoBroken'), os.path.join(self.bin_dir, '.juggler'), False, 'vanilla')
+        self.assertIn('Broken_vanilla', str(context.exception))
+        self.assertNotIn('AlsoBroken', str(context.exception))
+        self.assertEqual(self._read_payload('Good'), 'content')
+
+    def test_DeploySequentially_DownloadFailureRaisesRequiredPackageNotAvailable(self):
+        entry = self._publish_to_remote('Broken', 'v1.0-b1')
+        os.remove(os.path.join(self.remote_repo_dir, entry.get_filename()))
+        manager = self._create_manager()
+        self.assertRaises(dependency.RequiredPackageNotAvailable,
+                          manager.deploy, self._required('Broken'), os.path.join(self.bin_dir, '.juggler'), False, 'vanilla')
+
+    def test_DeployTwice_UnchangedPackageIsNotExtractedAgain(self):
+        self._publish_to_remote('Stable', 'v1.0-b1')
+        target = os.path.join(self.bin_dir, '.juggler')
+        self._create_manager().deploy(self._required('Stable'), target, False, 'vanilla')
+        marker = os.path.join(target, 'Stable', 'marker.txt')
+        open(marker, 'w').close()
+        self._create_manager().deploy(self._required('Stable'), target, False, 'vanilla')
+        self.assertTrue(os.path.exists(marker))
+
+    def test_DeployNewerVersion_PackageIsExtractedAgain(self):
+        self._publish_to_remote('Moving', 'v1.0-b1', content='old')
+        target = os.path.join(self.bin_dir, '.juggler')
+        self._create_manager().deploy(self._required('Moving'), target, False, 'vanilla')
+        self._publish_to_remote('Moving', 'v1.0-b2', content='new')
+        self._create_manager().deploy(self._required('Moving'), target, False, 'vanilla')
+        self.assertEqual(self._read_payload('Moving'), 'new')
+
+    def test_DeployWithFewerRequirements_StalePackageIsRemoved(self):
+        self._publish_to_remote('Kept', 'v1.0-b1')
+        self._publish_to_remote('Dropped', 'v1.0-b1')
+        target = os.path.join(self.bin_dir, '.juggler')
+        self._create_manager().deploy(self._required('Kept', 'Dropped'), target, False, 'vanilla')
+        self._create_manager().deploy(self._required('Kept'), target, False, 'vanilla')
+        self.assertTrue(os.path.isdir(os.path.join(target, 'Kept')))
+        self.assertFalse(os.path.exists(os.path.join(target, 'Dropped')))
+        self.assertEqual(manifest.load_manifest(target).get_names(), ['Kept'])
+
+    def test_DeployWithTransitiveRequirements_RequiredPackagesAreDeployed(self):
+        self._publish_to_remote('Application', 'v1.0-b1', requirements=[('Library', 'v2.1')])
+        self._publish_to_remote('Library', 'v2.1-b1', content='2.1', requirements=[('Base', '')])
+        self._publish_to_remote('Library', 'v2.2-b1', content='2.2')
+        self._publish_to_remote('Base', 'v0.1-b1', content='base')
+        self._publish_to_remote('Unrelated', 'v0.1-b1')
+        target = os.path.join(self.bin_dir, '.juggler')
+        self._create_manager(wanted_names=['Application']).deploy(self._required('Application'), target, False, 'vanilla')
+        self.assertEqual(self._read_payload('Library'), '2.1')
+        self.assertEqual(self._read_payload('Base'), 'base')
+        self.assertEqual(sorted(manifest.load_manifest(target).get_names()), ['Application', 'Base', 'Library'])
+        local_listing = listing.load_local_listing(self.local_repo_dir)
+        self.assertEqual(local_listing.get_package('Library').get_requirements()[0]['name'], 'Base')
+
+    def test_DeployWithConflictingRequirements_RaisesRequiredPackageNotAvailable(self):
+        self._publish_to_remote('First', 'v1.0-b1', requirements=[('Shared', 'v1')])
+        self._publish_to_remote('Second', 'v1.0-b1', requirements=[('Shared', 'v2')])
+        self._publish_to_remote('Shared', 'v1.0-b1')
+        self._publish_to_remote('Shared', 'v2.0-b1')
+        manager = self._create_manager(wanted_names=['First', 'Second'])
+        self.assertRaises(dependency.RequiredPackageNotAvailable,
+                          manager.deploy, self._required('First', 'Second'), os.path.join(self.bin_dir, '.juggler'), False, 'vanilla')
+
+    def test_DeployPackagesWithDifferentCodecs_ArchivesAreExtracted(self):
+        for codec in compression.get_supported_codecs():
+            entry = self._publish_to_remote('Packed_%s' % codec, 'v1.0-b1', content=codec, codec=codec)
+            self.assertTrue(entry.get_filename().endswith(compression.get_extension(codec)))
+        names = ['Packed_%s' % codec for codec in compression.get_supported_codecs()]
+        self._create_manager().deploy(self._required(*names), os.path.join(self.bin_dir, '.juggler'), False, 'vanilla')
+        local_listing = listing.load_local_listing(self.local_repo_dir)
+        for codec in compression.get_supported_codecs():
+            self.assertEqual(self._read_payload('Packed_%s' % codec), codec)
+            self.assertEqual(local_listing.get_package('Packed_%s' % codec).get_codec(), codec)
+
+    def test_DeploySymlinked_ProjectsShareOneExtraction(self):
+        self._publish_to_remote('Shared', 'v1.0-b1', content='shared')
+        first_target = os.path.join(self.bin_dir, '.juggler')
+        second_target = os.path.join(self.src_dir, '.juggler')
+        self._create_manager(deploy_mode='symlink').deploy(self._required('Shared'), first_target, False, 'vanilla')
+        self._create_manager(deploy_mode='symlink').deploy(self._required('Shared'), second_target, False, 'vanilla')
+        store_path = os.path.join(store.get_store_directory(self.local_repo_dir), 'Shared_vanilla-1.0.0-b1')
+        self.assertEqual(os.readlink(os.path.join(first_target, 'Shared')), store_path)
+        self.assertEqual(os.readlink(os.path.join(second_target, 'Shared')), store_path)
+        self.assertEqual(self._read_payload('Shared'), 'shared')
+        self.assertFalse(os.stat(os.path.join(store_path, 'payload.txt')).st_mode & 0222)
+
+    def test_DeploySymlinkedNameContainingTar_StorePathKeepsFullName(self):
+        self._publish_to_remote('Lib.tarball', 'v1.0-b1', content='shared')
+        target = os.path.join(self.bin_dir, '.juggler')
+        self._create_manager(deploy_mode='symlink').deploy(self._required('Lib.tarball'), target, False, 'vanilla')
+        store_path = os.path.join(store.get_store_directory(self.local_repo_dir), 'Lib.tarball_vanilla-1.0.0-b1')
+        self.assertEqual(os.readlink(os.path.join(target, 'Lib.tarball')), store_path)
+
+    def test_DeployHardlinked_FilesShareTheStoreInode(self):
+        self._publish_to_remote('Linked', 'v1.0-b1', content='old')
+        target = os.path.join(self.bin_dir, '.juggler')
+        self._create_manager(deploy_mode='hardlink').deploy(self._required('Linked'), target, False, 'vanilla')
+        store_file = os.path.join(store.get_store_directory(self.local_repo_dir), 'Linked_vanilla-1.0.0-b1', 'payload.txt')
+        self.assertEqual(os.stat(store_file).st_ino, os.stat(os.path.join(target, 'Linked', 'payload.txt')).st_ino)
+        self._publish_to_remote('Linked', 'v1.0-b2', content='new')
+        self._create_manager(deploy_mode='hardlink').deploy(self._required('Linked'), target, False, 'vanilla')
+        self.assertEqual(self._read_payload('Linked'), 'new')
+        self.assertFalse(os.path.islink(os.path.join(target, 'Linked')))
+
+    def test_DeploySymlinkedWithFewerRequirements_StaleLinkIsRemoved(self):
+        self._publish_to_remote('Kept', 'v1.0-b1')
+        self._publish_to_remote('Dropped', 'v1.0-b1')
+        target = os.path.join(self.bin_dir, '.juggler')
+        self._create_manager(deploy_mode='symlink').deploy(self._required('Kept', 'Dropped'), target, False, 'vanilla')
+        self._create_manager(deploy_mode='symlink').deploy(self._required('Kept'), target, False, 'vanilla')
+        self.assertFalse(os.path.lexists(os.path.join(target, 'Dropped')))
+        self.assertTrue(os.path.isdir(os.path.join(store.get_store_directory(self.local_repo_dir), 'Dropped_vanilla-1.0.0-b1')))
+
+    def test_DeployBuildWithDelta_ArchiveIsRebuiltFromLocalBase(self):
+        self._publish_headers_to_remote('v1.0.0-b1', None)
+        target = os.path.join(self.bin_dir, '.juggler')
+        self._create_manager().deploy(self._required('Headers'), target, False, 'vanilla')
+        entry = self._publish_headers_to_remote('v1.0.0-b2', 7)
+        self.assertEqual(entry.get_attribute('delta_base'), '1.0.0-b1')
+        self.assertLess(int(entry.get_attribute('delta_size')), int(entry.get_attribute('size')) / 5)
+        # only the delta is left to download
+        os.remove(os.path.join(self.remote_repo_dir, entry.get_filename()))
+        self._create_manager().deploy(self._required('Headers'), target, False, 'vanilla')
+        rebuilt = os.path.join(self.local_repo_dir, entry.get_filename())
+        self.assertEqual(manifest.compute_digest(rebuilt), entry.get_attribute('digest'))
+        with open(os.path.join(target, 'Headers', 'include', 'header07.h')) as header:
+            self.assertIn('changed', header.read())
+
+    def test_DeployBuildWithBrokenDelta_FullArchiveIsDownloaded(self):
+        self._publish_headers_to_remote('v1.0.0-b1', None)
+        target = os.path.join(self.bin_dir, '.juggler')
+        self._create_manager().deploy(self._required('Headers'), target, False, 'vanilla')
+        entry = self._publish_headers_to_remote('v1.0.0-b2', 3)
+        with open(os.path.join(self.remote_repo_dir, entry.get_delta_filename()), 'wb') as broken:
+            broken.write('not a delta')
+        self._create_manager().deploy(self._required('Headers'), target, False, 'vanilla')
+        self.assertEqual(manifest.compute_digest(os.path.join(self.local_repo_dir, entry.get_filename())), entry.get_attribute('digest'))
+        self.assertFalse(os.path.exists(os.path.join(self.local_repo_dir, entry.get_filename() + '.delta')))
+
+    def test_GetCandidatesWithPriorities_HighestPriorityRemoteWithMatchWins(self):
+        self._publish_to_remote('Prioritized', 'v1.0-b1', content='preferred')
+        fallback_dir = tempfile.mkdtemp()
+        try:
+            preferred_dir = self.remote_repo_dir
+            self.remote_repo_dir = fallback_dir
+            self._publish_to_remote('Prioritized', 'v2.0-b1', content='fallback')
+            self.remote_repo_dir = preferred_dir
+            remotes = ['file://%s' % fallback_dir, 'file://%s' % preferred_dir]
+            manager = dependency.DependencyManager(self.local_repo_dir, remotes, remote_priorities={remotes[1]: 1})
+            candidates = list(manager.get_candidates({'name': 'Prioritized', 'version': version.parse_spec('')}, False, 'vanilla'))
+            self.assertEqual([str(entry.get_version()) for entry in candidates], ['1.0.0-b1'])
+            self.assertEqual(candidates[0].get_path(), remotes[1])
+            candidates = list(manager.get_candidates({'name': 'Prioritized', 'version': version.parse_spec('v2')}, False, 'vanilla'))
+            self.assertEqual([entry.get_path() for entry in candidates], [remotes[0]])
+            manager = dependency.DependencyManager(self.local_repo_dir, remotes)
+            candidates = list(manager.get_candidates({'name': 'Prioritized', 'version': version.parse_spec('')}, False, 'vanilla'))
+            self.assertEqual([str(entry.get_version()) for entry in candidates], ['2.0.0-b1', '1.0.0-b1'])
+        finally:
+            shutil.rmtree(fallback_dir)
+
+    def test_GetCandidatesWithEqualVersions_LocalRepositoryWins(self):
+        self._publish_to_remote('Cached', 'v1.0-b1')
+        self._create_manager().deploy(self._required('Cached'), os.path.join(self.bin_dir, '.juggler'), False, 'vanilla')
+        manager = dependency.DependencyManager(self.local_repo_dir, ['file://%s' % self.remote_repo_dir],
+                                               remote_priorities={'file://%s' % self.remote_repo_dir: 5})
+        candidates = list(manager.get_candidates({'name': 'Cached', 'version': version.parse_spec('')}, False, 'vanilla'))
+        self.assertEqual([entry.get_path() for entry in candidates], [self.local_repo_dir])
+
+    def _serve_remote(self, delay):
+        server = StandInRepositoryServer(self.remote_repo_dir)
+        server.delay = delay
+        server.start()
+        self.addCleanup(server.stop)
+        return server
+
+    def test_LoadSlowRemotes_ListingsAreLoadedConcurrently(self):
+        self._publish_to_remote('Served', 'v1.0-b1')
+        servers = [self._serve_remote(0.5) for _ in range(4)]
+        start = time.time()
+        manager = dependency.DependencyManager(self.local_repo_dir, [server.get_url() for server in servers])
+        self.assertLess(time.time() - start, 1.5)
+        candidates = list(manager.get_candidates({'name': 'Served', 'version': version.parse_spec('')}, False, 'vanilla'))
+        # equal builds are merged, the first remote listing them wins
+        self.assertEqual([entry.get_path() for entry in candidates], [servers[0].get_url()])
+
+    def test_LoadHungRemote_RemoteIsSkippedAfterTimeout(self):
+        self._publish_to_remote('Served', 'v1.0-b1')
+        hung = self._serve_remote(3)
+        responsive = self._serve_remote(0)
+        start = time.time()
+        manager = dependency.DependencyManager(self.local_repo_dir, [hung.get_url(), responsive.get_url()],
+                                               remote_timeouts={hung.get_url(): (1, 0.5)})
+        self.assertLess(time.time() - start, 2)
+        candidates = list(manager.get_candidates({'name': 'Served', 'version': version.parse_spec('')}, False, 'vanilla'))
+        self.assertEqual([entry.get_path() for entry in candidates], [responsive.get_url()])
+
+    def test_DeployLargeArchive_RangesAreDownloadedFromMirrors(self):
+        generator = random.Random(5)
+        self._publish_to_remote('Large', 'v1.0-b1', content=''.join(chr(generator.getrandbits(8)) for _ in range(200000)),
+                                record_digest=True)
+        mirrors = [self._serve_remote(0), self._serve_remote(0)]
+        original_sizes = download.RANGE_SIZE, download.MIN_RANGED_SIZE
+        download.RANGE_SIZE, download.MIN_RANGED_SIZE = 20000, 40000
+        try:
+            manager = dependency.DependencyManager(self.local_repo_dir, [mirror.get_url() for mirror in mirrors], range_connections=3)
+            manager.deploy(self._required('Large'), os.path.join(self.bin_dir, '.juggler'), False, 'vanilla')
+        finally:
+            download.RANGE_SIZE, download.MIN_RANGED_SIZE = original_sizes
+        self.assertEqual(len(self._read_payload('Large')), 200000)
+        for mirror in mirrors:
+            self.assertIn(206, [status for _, _, status in mirror.requests])
+
+    def test_DeployLargeArchiveFromMirrorWithoutRanges_ArchiveIsDownloadedWhole(self):
+        generator = random.Random(5)
+        self._publish_to_remote('Large', 'v1.0-b1', content=''.join(chr(generator.getrandbits(8)) for _ in range(200000)),
+                                record_digest=True)
+        mirror = self._serve_remote(0)
+        mirror.serve_ranges = False
+        original_sizes = download.RANGE_SIZE, download.MIN_RANGED_SIZE
+        download.RANGE_SIZE, download.MIN_RANGED_SIZE = 20000, 40000
+        try:
+            manager = dependency.DependencyManager(self.local_repo_dir, [mirror.get_url()], range_connections=3)
+            manager.deploy(self._required('Large'), os.path.join(self.bin_dir, '.juggler'), False, 'vanilla')
+        finally:
+            download.RANGE_SIZE, download.MIN_RANGED_SIZE = original_sizes
+        self.assertEqual(len(self._read_payload('Large')), 200000)
+
+    def _create_streaming_manager(self, deploy_mode='extract'):
+        server = self._serve_remote(0)
+        return dependency.DependencyManager(self.local_repo_dir, [server.get_url()], deploy_mode=deploy_mode, stream_extraction=True)
+
+    def test_DeployStreamed_ArchiveIsExtractedAndCached(self):
+        self._publish_to_remote('Streamed', 'v1.0-b1', content='streamed', record_digest=True)
+        locked = self._create_streaming_manager().deploy(self._required('Streamed'), os.path.join(self.bin_dir, '.juggler'), False, 'vanilla')
+        self.assertEqual(self._read_payload('Streamed'), 'streamed')
+        entry = listing.load_local_listing(self.local_repo_dir).get_package('Streamed')
+        cached_archive = os.path.join(self.local_repo_dir, entry.get_filename())
+        self.assertEqual(manifest.compute_digest(cached_archive), locked[0]['digest'])
+        self.assertFalse(os.path.exists(cached_archive + '.part'))
+
+    def test_DeployStreamedSymlinked_StoreHoldsExtraction(self):
+        self._publish_to_remote('Streamed', 'v1.0-b1', content='streamed', codec='bz2')
+        self._create_streaming_manager('symlink').deploy(self._required('Streamed'), os.path.join(self.bin_dir, '.juggler'), False, 'vanilla')
+        self.assertTrue(os.path.islink(os.path.join(self.bin_dir, '.juggler', 'Streamed')))
+        self.assertEqual(self._read_payload('Streamed'), 'streamed')
+
+    def test_DeployStreamedWithWrongDigest_ExtractionIsRemoved(self):
+        self._publish_to_remote('Streamed', 'v1.0-b1', content='streamed', record_digest=True)
+        archive_filename = os.path.join(self.remote_repo_dir, listing.load_local_listing(self.remote_repo_dir).get_package('Streamed').get_filename())
+        self._write_archive(archive_filename, 'gz', self.user_config)
+        manager = self._create_streaming_manager()
+        self.assertRaises(dependency.RequiredPackageNotAvailable, manager.deploy, self._required('Streamed'),
+                          os.path.join(self.bin_dir, '.juggler'), False, 'vanilla')
+        self.assertFalse(os.path.exists(os.path.join(self.bin_dir, '.juggler', 'Streamed')))
+        self.assertEqual([name for name in os.listdir(self.local_repo_dir) if name.startswith('Streamed')], [])
+        self.assertIsNone(listing.load_local_listing(self.local_repo_dir).get_package('Streamed'))
+
+    def test_DeployWithCacheBudget_EarlierDownloadsAreEvicted(self):
+        first = self._publish_to_remote('First', 'v1.0-b1')
+        second = self._publish_to_remote('Second', 'v1.0-b1')
+        self._create_manager().deploy(self._required('First'), os.path.join(self.bin_dir, '.juggler'), False, 'vanilla')
+        manager = dependency.DependencyManager(self.local_repo_dir, ['file://%s' % self.remote_repo_dir], cache_budget=0)
+        manager.deploy(self._required('Second'), os.path.join(self.bin_dir, '.juggler'), False, 'vanilla')
+        self.assertFalse(os.path.exists(os.path.join(self.local_repo_dir, first.get_filename())))
+        self.assertTrue(os.path.exists(os.path.join(self.local_repo_dir, second.get_filename())))
+        local_listing = listing.load_local_listing(self.local_repo_dir)
+        self.assertIsNone(local_listing.get_package('First'))
+        self.assertIsNotNone(local_listing.get_package('Second'))
+
+    def test_Plan_NothingIsDownloadedAndSizesAreListed(self):
+        entry = self._publish_to_remote('Planned', 'v1.0-b1', record_digest=True)
+        target = os.path.join(self.bin_dir, '.juggler')
+        planned = self._create_manager().plan(self._required('Planned'), target, False, 'vanilla')
+        self.assertEqual(len(planned), 1)
+        self.assertEqual(planned[0]['version'], '1.0.0-b1')
+        self.assertEqual(planned[0]['source_type'], 'remote')
+        self.assertEqual(planned[0]['url'], 'file://%s/%s' % (self.remote_repo_dir, entry.get_filename()))
+        self.assertEqual(planned[0]['download_bytes'], int(entry.get_attribute('size')))
+        self.assertFalse(planned[0]['cached'])
+        self.assertFalse(planned[0]['deployed'])
+        self.assertFalse(os.path.exists(os.path.join(self.local_repo_dir, entry.get_filename())))
+        self.assertFalse(os.path.exists(target))
+
+    def test_PlanAfterDeploy_PackageIsCachedAndDeployed(self):
+        self._publish_to_remote('Planned', 'v1.0-b1', record_digest=True)
+        target = os.path.join(self.bin_dir, '.juggler')
+        self._create_manager().deploy(self._required('Planned'), target, False, 'vanilla')
+        planned = self._create_manager().plan(self._required('Planned'), target, False, 'vanilla')
+        self.assertEqual(planned[0]['source_type'], 'local')
+        self.assertIsNone(planned[0]['url'])
+        self.assertEqual(planned[0]['download_bytes'], 0)
+        self.assertTrue(planned[0]['cached'])
+        self.assertTrue(planned[0]['deployed'])
+
+    def test_PlanWithDelta_OnlyDeltaSizeIsExpected(self):
+        self._publish_headers_to_remote('v1.0.0-b1', None)
+        target = os.path.join(self.bin_dir, '.juggler')
+        self._create_manager().deploy(self._required('Headers'), target, False, 'vanilla')
+        entry = self._publish_headers_to_remote('v1.0.0-b2', 7)
+        planned = self._create_manager().plan(self._required('Headers'), target, False, 'vanilla')
+        self.assertEqual(planned[0]['delta_base'], '1.0.0-b1')
+        self.assertEqual(planned[0]['download_bytes'], int(entry.get_attribute('delta_size')))
+        self.assertFalse(planned[0]['deployed'])
+
+    def test_DeployLocked_PackagesAreFetchedWithoutRemoteListing(self):
+        self._publish_to_remote('Application', 'v1.0-b1', content='app', requirements=[('Library', '')])
+        self._publish_to_remote('Library', 'v1.0-b1', content='lib')
+        target = os.path.join(self.bin_dir, '.juggler')
+        lock_filename = os.path.join(self.bin_dir, lockfile.get_lockfile_filename())
+        locked = self._create_manager(wanted_names=['Application']).deploy(self._required('Application'), target, False, 'vanilla')
+        lockfile.store_lockfile(lock_filename, locked)
+
+        # newer builds and a vanished remote listing must not change a frozen fetch
+        self._publish_to_remote('Library', 'v1.1-b1', content='newer')
+        os.remove(os.path.join(self.remote_repo_dir, listing.get_listing_filename()))
+        shutil.rmtree(self.local_repo_dir)
+        shutil.rmtree(target)
+        locked_packages = lockfile.load_lockfile(lock_filename)
+        self.assertEqual([(package['name'], package['source']) for package in locked_packages],
+                         [('Application', 'file://%s' % self.remote_repo_dir), ('Library', 'file://%s' % self.remote_repo_dir)])
+        relocked = dependency.DependencyManager(self.local_repo_dir, []).deploy_locked(locked_packages, target)
+        self.assertEqual(self._read_payload('Application'), 'app')
+        self.assertEqual(self._read_payload('Library'), 'lib')
+        self.assertEqual(sorted(relocked), sorted(locked))
+        local_listing = listing.load_local_listing(self.local_repo_dir)
+        self.assertEqual(local_listing.get_package('Application').get_requirements()[0]['name'], 'Library')
+
+    def test_DeployLocked_ChangedArchiveIsRejected(self):
+        self._publish_to_remote('Tampered', 'v1.0-b1', content='original')
+        target = os.path.join(self.bin_dir, '.juggler')
+        locked = self._create_manager().deploy(self._required('Tampered'), target, False, 'vanilla')
+        self._publish_to_remote('Tampered', 'v1.0-b1', content='replaced')
+        shutil.rmtree(self.local_repo_dir)
+        shutil.rmtree(target)
+        with self.assertRaises(dependency.RequiredPackageNotAvailable) as context:
+            dependency.DependencyManager(self.local_repo_dir, []).deploy_locked(locked, target)
+        self.assertIn('digest', str(context.exception))
+        self.assertFalse(os.path.exists(os.path.join(self.local_repo_dir, 'Tampered_vanilla-1.0.0-b1.tar.gz')))
+        self.assertFalse(os.path.exists(os.path.join(target, 'Tampered')))
+
+    def test_CheckLockfile_ChangedRequirementIsReported(self):
+        locked = [{'name': 'Locked', 'version': '1.0.0-b1', 'flavor': 'vanilla', 'source': 'local', 'digest': '0', 'codec': 'gz', 'requirements': []}]
+        lockfile.check_lockfile(locked, [{'name': 'Locked', 'version': version.parse_spec('v1')}], 'vanilla')
+        self.assertRaises(lockfile.LockfileError, lockfile.check_lockfile,
+                          locked, [{'name': 'Locked', 'version': version.parse_spec('v2')}], 'vanilla')
+        self.assertRaises(lockfile.LockfileError, lockfile.check_lockfile,
+                          locked, self._required('Locked', 'Missing'), 'vanilla')
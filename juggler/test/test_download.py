@@ -0,0 +1,96 @@
+"""
+    Juggler - Dirty dependency management and packaging for compiled code
+    Copyright (C) 2014  Christian Meyer
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from juggler import download
+from juggler.test.stand_in_server import StandInRepositoryServer
+
+class TestRangedDownload(unittest.TestCase):
+
+    def setUp(self):
+        self.__served_dir = tempfile.mkdtemp()
+        self.__target_dir = tempfile.mkdtemp()
+        generator = random.Random(17)
+        self.__content = ''.join(chr(generator.getrandbits(8)) for _ in range(100000))
+        with open(os.path.join(self.__served_dir, 'archive.tar.gz'), 'wb') as served:
+            served.write(self.__content)
+
+    def tearDown(self):
+        shutil.rmtree(self.__served_dir)
+        shutil.rmtree(self.__target_dir)
+
+    def serve(self, delay=0, serve_ranges=True):
+        server = StandInRepositoryServer(self.__served_dir)
+        server.delay = delay
+        server.serve_ranges = serve_ranges
+        server.start()
+        self.addCleanup(server.stop)
+        return server
+
+    def download(self, servers, connections, range_size=10000):
+        urls = ['%s/archive.tar.gz' % server.get_url() for server in servers]
+        ranged_download = download.RangedDownload(urls, len(self.__content), connections, range_size=range_size)
+        target = os.path.join(self.__target_dir, 'archive.tar.gz')
+        ranged_download.run(target)
+        with open(target, 'rb') as downloaded:
+            return ranged_download, downloaded.read()
+
+    def test_DownloadFromTwoMirrors_FileIsComplete(self):
+        servers = [self.serve(), self.serve()]
+        ranged_download, content = self.download(servers, 4, range_size=7000)
+        self.assertEqual(content, self.__content)
+        self.assertEqual(sum(mirror.transferred for mirror in ranged_download.get_mirrors()), len(self.__content))
+        self.assertTrue(all(server.requests for server in servers))
+
+    def test_DownloadFromSlowAndFastMirror_FastMirrorServesMostRanges(self):
+        slow, fast = self.serve(delay=0.3), self.serve()
+        _, content = self.download([slow, fast], 2, range_size=5000)
+        self.assertEqual(content, self.__content)
+        self.assertLess(len(slow.requests), len(fast.requests))
+
+    def test_MirrorWithoutRanges_IsDroppedAndOthersFinish(self):
+        broken, working = self.serve(serve_ranges=False), self.serve()
+        ranged_download, content = self.download([broken, working], 2)
+        self.assertEqual(content, self.__content)
+        self.assertIsNotNone(ranged_download.get_mirrors()[0].error)
+
+    def test_NoMirrorServesRanges_FileIsDownloadedInOneStream(self):
+        server = self.serve(serve_ranges=False)
+        ranged_download, content = self.download([server], 2)
+        self.assertEqual(content, self.__content)
+        self.assertEqual(ranged_download.get_mirrors()[0].transferred, len(self.__content))
+        self.assertIsNone(ranged_download.get_mirrors()[0].error)
+
+    def test_RangeFailsOnce_MirrorIsAskedAgain(self):
+        server = self.serve()
+        server.failing_gets = 1
+        ranged_download, content = self.download([server], 1)
+        self.assertEqual(content, self.__content)
+        self.assertIsNone(ranged_download.get_mirrors()[0].error)
+
+    def test_MirrorKeepsFailing_RaisesDownloadFailed(self):
+        server = self.serve()
+        server.failing_gets = 100
+        urls = ['%s/archive.tar.gz' % server.get_url()]
+        ranged_download = download.RangedDownload(urls, len(self.__content), 1, range_size=10000)
+        self.assertRaises(download.DownloadFailed, ranged_download.run, os.path.join(self.__target_dir, 'archive.tar.gz'))
+        self.assertEqual(len(server.requests), download.RANGE_ATTEMPTS)
@@ -6,6 +6,8 @@ Created on 22.03.2015
 
 from juggler.test.base_testcase import JugglerTestCase
 import os
+import json
+import tarfile
 
 PRJ_EMPTY_LEGACY_XML = '''
     <Project>
@@ -31,3 +33,46 @@ class TestJuggler(JugglerTestCase):
         self.assertEqual(exit_code, 0)
         self.assertIn('Empty_vanilla-1.0.0-local.tar.gz',
                       os.listdir(self.local_repo_dir))
+
+    def test_publishWithTrace(self):
+        trace_file = os.path.join(self.cnf_dir, 'trace.json')
+        args = ['--user_config', self.user_config,
+                '--trace', trace_file,
+                'publish',
+                self.src_dir,
+                self.bin_dir]
+        self._with_project_config(PRJ_EMPTY_LEGACY_XML)
+        exit_code = self._run_juggler(args)
+        self.assertEqual(exit_code, 0)
+        with open(trace_file) as trace:
+            names = [event['name'] for event in json.load(trace)['traceEvents']]
+        self.assertIn('write archive', names)
+        self.assertIn('publish', names)
+
+    def test_publishWithCompressionThreads(self):
+        args = ['--user_config', self.user_config,
+                '--compression_threads', '3',
+                'publish',
+                self.src_dir,
+                self.bin_dir]
+        self._with_project_config(PRJ_EMPTY_LEGACY_XML)
+        exit_code = self._run_juggler(args)
+        self.assertEqual(exit_code, 0)
+        with tarfile.open(os.path.join(self.local_repo_dir, 'Empty_vanilla-1.0.0-local.tar.gz'), 'r:gz') as archive:
+            self.assertEqual(archive.getnames(), [])
+
+    def test_planWithoutRequirements(self):
+        plan_file = os.path.join(self.cnf_dir, 'plan.json')
+        args = ['--user_config', self.user_config,
+                '--plan_output', plan_file,
+                'plan',
+                self.src_dir,
+                self.bin_dir]
+        self._with_project_config(PRJ_EMPTY_LEGACY_XML)
+        exit_code = self._run_juggler(args)
+        self.assertEqual(exit_code, 0)
+        with open(plan_file) as plan:
+            planned = json.load(plan)
+        self.assertEqual(planned['packages'], [])
+        self.assertEqual(planned['download_bytes'], 0)
+        self.assertFalse(os.path.exists(os.path.join(self.bin_dir, '.juggler')))
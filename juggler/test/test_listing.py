@@ -18,9 +18,15 @@
 
 import unittest
 import os
+import random
 import shutil
 import tempfile
+import time
+import StringIO
+import threading
+import multiprocessing
 from juggler import version, listing
+from juggler.test import stand_in_server
 
 class TestListing(unittest.TestCase):
     
@@ -176,8 +182,357 @@ class TestListing(unittest.TestCase):
         self.assertEqual(package.get_version(),
                          version.parse_version('v2.1-b2'))
 
+    def test_StoreListing_CompactIndexIsWrittenAndUsed(self):
+        self.simulate_xml_load(self.get_extensive_build_listing()).store(self.__tempdir)
+        self.assertTrue(os.path.isfile(os.path.join(self.__tempdir, 'juggler_listing.idx')))
+        test_listing = listing.load_local_listing(self.__tempdir)
+        self.assertFalse(test_listing.is_empty())
+        self.check_package_retrieval(test_listing, 'SomePackage', 'latest', 'v2.1-local')
+        self.check_package_retrieval(test_listing, 'SomePackage', 'v1', 'v1.2-b2')
+        self.check_package_retrieval(test_listing, 'AnotherPackage', 'v0.1', 'v0.1-b15')
+        self.check_package_retrieval_with_flavor(test_listing, 'SomePackage', 'latest', 'chocolate', 'v1.2-local')
+        package = test_listing.get_package('SomePackage', version.parse_spec('latest'), ignore_local_build=True)
+        self.assertEqual(package.get_version(), version.parse_version('v2.1-b2'))
+        self.assertIsNone(test_listing.get_package('MissingPackage'))
+
+    def test_AddToIndexedListing_NewAndIndexedBuildsAreStored(self):
+        self.simulate_xml_load(self.get_extensive_build_listing()).store(self.__tempdir)
+        test_listing = listing.load_local_listing(self.__tempdir)
+        test_listing.add_package('SomePackage', 'v3.0-b1')
+        test_listing.add_package('NewPackage', 'v0.1-b1')
+        test_listing.store(self.__tempdir)
+        os.remove(os.path.join(self.__tempdir, 'juggler_listing.idx'))
+        reloaded = listing.load_local_listing(self.__tempdir)
+        self.check_package_retrieval(reloaded, 'SomePackage', 'latest', 'v3.0-b1')
+        self.check_package_retrieval(reloaded, 'SomePackage', 'v1.1', 'v1.1-b2')
+        self.check_package_retrieval(reloaded, 'AnotherPackage', 'latest', 'v1.0-b16')
+        self.check_package_retrieval(reloaded, 'NewPackage', 'latest', 'v0.1-b1')
+
+    def test_StoreBuildMetadata_MetadataSurvivesXmlAndIndex(self):
+        test_listing = listing.Listing(self.__tempdir)
+        test_listing.add_package('SomePackage', 'v1.0-b1', attributes={'custom': 'value'}, requirements=[('Other', 'v2.1')])
+        test_listing.add_package('SomePackage', 'v1.0-b0')
+        test_listing.store(self.__tempdir)
+        from_index = listing.load_local_listing(self.__tempdir)
+        from_xml = listing.load_listing(os.path.join(self.__tempdir, 'juggler_listing.xml'), self.__tempdir)
+        for loaded in [from_index, from_xml]:
+            package = loaded.get_package('SomePackage')
+            self.assertEqual(package.get_attribute('custom'), 'value')
+            self.assertEqual(package.get_requirements()[0]['name'], 'Other')
+            self.assertEqual(package.get_requirements()[0]['version'], version.parse_spec('v2.1'))
+            self.assertEqual(loaded.get_package('SomePackage', version.parse_spec('v1.0-b0')).get_requirements(), [])
+
+    def test_XmlChangedAfterStore_StaleIndexIsIgnored(self):
+        self.simulate_xml_load(self.get_extensive_build_listing()).store(self.__tempdir)
+        test_listing = self.simulate_xml_load(self.get_single_packet_listing())
+        self.assertIsNone(test_listing.get_package('AnotherPackage'))
+        self.check_package_retrieval(test_listing, 'SomePackage', 'latest', 'v1.0-b0')
+
+    def test_LoadWithWantedNames_OnlyWantedPackagesAreLoaded(self):
+        self.simulate_xml_load(self.get_extensive_build_listing())
+        test_listing = listing.load_listing(os.path.join(self.__tempdir, 'juggler_listing.xml'), self.__tempdir, ['AnotherPackage'])
+        self.assertIsNone(test_listing.get_package('SomePackage'))
+        self.check_package_retrieval(test_listing, 'AnotherPackage', 'latest', 'v1.0-b16')
+
+    def test_LoadWithFlavor_OnlyPackagesOfThatFlavorAreLoaded(self):
+        self.simulate_xml_load(self.get_extensive_build_listing())
+        test_listing = listing.load_listing(os.path.join(self.__tempdir, 'juggler_listing.xml'), self.__tempdir, ['SomePackage'], 'chocolate')
+        self.assertIsNone(test_listing.get_package('SomePackage'))
+        self.check_package_retrieval_with_flavor(test_listing, 'SomePackage', 'latest', 'chocolate', 'v1.2-local')
+
+    def test_LoadNestedElements_OnlyDirectChildrenAreConsidered(self):
+        test_listing = self.simulate_xml_load('<Listing> <Group> <Package name="Hidden"> <Build version="v1.0-b0"/> </Package> </Group>'
+                                              ' <Package name="Visible"> <Extra> <Build version="v9.0-b0"/> </Extra> <Build version="v1.0-b0"/> </Package> </Listing>')
+        self.assertIsNone(test_listing.get_package('Hidden'))
+        self.check_package_retrieval(test_listing, 'Visible', 'latest', 'v1.0-b0')
+
+    def test_PrereleaseSpecWithHigherPatchBuilds_MatchesLinearSearch(self):
+        # partial versions with a prerelease ignore the patch, v1.2-b3 sorts above 1.2.1-b1 but below 1.2.0
+        cases = [(['v1.2-b3', '1.2.1-b1'], 'v1.2-b3', '1.2.0-b3'),
+                 (['v1.2-b3', '1.2.1-b1', '1.2.2-b3'], 'v1.2-b3', '1.2.2-b3'),
+                 (['v2.1-local', '2.1.1-local', '2.1.2'], 'v2.1-local', '2.1.1-local'),
+                 (['1.2.1-b1', '1.2.0', '1.2.1'], '==1.2-b1', '1.2.1-b1')]
+        for build_strings, spec_string, expected in cases:
+            info = listing.PackageInfo('SomePackage', '.', 'vanilla')
+            for build_string in build_strings:
+                info.add_build(version.parse_version(build_string))
+            entry = info.get_entry(version.parse_spec(spec_string), False)
+            self.assertEqual(entry.get_version() if entry is not None else None, version.parse_version(expected),
+                             '%s in %s' % (spec_string, build_strings))
+
+    def test_ManyBuildsInRandomOrder_MatchesLinearSearch(self):
+        generator = random.Random(42)
+        build_strings = ['v%d.%d-%s' % (major, minor, build)
+                         for major in range(3)
+                         for minor in range(4)
+                         for build in ['b0', 'b1', 'b10', 'b2', 'local']]
+        build_strings += ['%d.%d.%d' % (major, minor, patch)
+                          for major in range(3)
+                          for minor in range(4)
+                          for patch in range(2)]
+        build_strings += ['%d.%d.%d-%s' % (major, minor, patch, build)
+                          for major in range(3)
+                          for minor in range(4)
+                          for patch in range(1, 3)
+                          for build in ['b1', 'b3', 'local']]
+        generator.shuffle(build_strings)
+        info = listing.PackageInfo('SomePackage', '.', 'vanilla')
+        for build_string in build_strings + build_strings[:10]:
+            info.add_build(version.parse_version(build_string))
+        self.assertEqual(len(info.get_builds()), len(build_strings))
+        self.assertEqual(info.get_builds(), sorted(info.get_builds()))
+
+        specs = ['latest', 'v1', 'v2.1', 'v1.3-b10', 'v3', 'v0.0-b2', 'v1.2-b3', 'v2.1-local', '==1.2.1-b1',
+                 '>=1.1.0,<2.1.0', '>1.2.0-b1', '<=1.2.0', '<1.2.0', '!=2.3.1', '==2.3.1', '>=0.1.0,!=2.3.1']
+        for spec_string in specs:
+            spec = version.parse_spec(spec_string)
+            for ignore_local_build in [False, True]:
+                candidates = [build for build in info.get_builds()
+                              if spec.match(build) and not (ignore_local_build and listing.is_local_build(build))]
+                expected = max(candidates) if candidates else None
+                entry = info.get_entry(spec, ignore_local_build)
+                actual = entry.get_version() if entry is not None else None
+                self.assertEqual(actual, expected, 'spec %s, ignore_local_build %s: expected %s - instead got %s' % (spec_string, ignore_local_build, expected, actual))
+
+    def test_LoadWithInternTable_BuildsAreShared(self):
+        xml = '''<Listing>
+            <Package name="SomePackage"> <Build version="v1.0-b0" codec="gz" digest="abc"> <Requires> <Package name="Other" version="v1"/> </Requires> </Build> </Package>
+            <Package name="Other"> <Build version="v1.0-b0" codec="gz" digest="def"/> </Package>
+        </Listing>'''
+        interned = listing.InternTable()
+        first = listing.load_listing(StringIO.StringIO(xml), 'http://first', interned=interned)
+        second = listing.load_listing(StringIO.StringIO(xml), 'http://second', interned=interned)
+        unshared = listing.load_listing(StringIO.StringIO(xml), 'http://unshared')
+        first_entry = first.get_package('SomePackage')
+        self.assertIs(first_entry.get_version(), first.get_package('Other').get_version())
+        self.assertIs(first_entry.get_version(), second.get_package('SomePackage').get_version())
+        self.assertIsNot(first_entry.get_version(), unshared.get_package('SomePackage').get_version())
+        self.assertEqual(first_entry.get_path(), 'http://first')
+        self.assertEqual(second.get_package('SomePackage').get_metadata(), ({'codec': 'gz', 'digest': 'abc'}, [('Other', 'v1')]))
+        self.assertEqual(second.get_package('Other').get_metadata(), ({'codec': 'gz', 'digest': 'def'}, []))
+
+    def test_StoreAddedBuild_OnlyJournalIsWritten(self):
+        self.simulate_xml_load(self.get_single_packet_listing()).store(self.__tempdir)
+        with open(os.path.join(self.__tempdir, 'juggler_listing.xml')) as xmlfile:
+            snapshot = xmlfile.read()
+        test_listing = listing.load_local_listing(self.__tempdir)
+        test_listing.add_package('SomePackage', 'v2.0-b1', attributes={'digest': 'line\nbreak'})
+        test_listing.store(self.__tempdir, compact_journal=False)
+        with open(os.path.join(self.__tempdir, 'juggler_listing.xml')) as xmlfile:
+            self.assertEqual(xmlfile.read(), snapshot)
+        with open(os.path.join(self.__tempdir, 'juggler_listing.journal')) as journal:
+            self.assertEqual(len(journal.readlines()), 1)
+        reloaded = listing.load_local_listing(self.__tempdir)
+        self.check_package_retrieval(reloaded, 'SomePackage', 'latest', 'v2.0-b1')
+        self.assertEqual(reloaded.get_package('SomePackage').get_attribute('digest'), 'line\nbreak')
+
+    def test_StoreUnchangedListing_NothingIsWritten(self):
+        self.simulate_xml_load(self.get_single_packet_listing()).store(self.__tempdir)
+        stored = os.stat(os.path.join(self.__tempdir, 'juggler_listing.xml'))
+        listing.load_local_listing(self.__tempdir).store(self.__tempdir, compact_journal=False)
+        self.assertEqual(os.stat(os.path.join(self.__tempdir, 'juggler_listing.xml')), stored)
+        self.assertFalse(os.path.exists(os.path.join(self.__tempdir, 'juggler_listing.journal')))
+
+    def test_LoadJournalWithTruncatedRecord_RecordIsIgnored(self):
+        self.simulate_xml_load(self.get_single_packet_listing()).store(self.__tempdir)
+        test_listing = listing.load_local_listing(self.__tempdir)
+        test_listing.add_package('SomePackage', 'v2.0-b1')
+        test_listing.store(self.__tempdir, compact_journal=False)
+        with open(os.path.join(self.__tempdir, 'juggler_listing.journal'), 'a') as journal:
+            journal.write('<Package name="SomePackage" flavor="vanilla"><Build vers')
+        self.check_package_retrieval(listing.load_local_listing(self.__tempdir), 'SomePackage', 'latest', 'v2.0-b1')
+
+    def test_StoreWithCompaction_JournalIsMergedIntoListing(self):
+        self.simulate_xml_load(self.get_single_packet_listing()).store(self.__tempdir)
+        for build in range(3):
+            test_listing = listing.load_local_listing(self.__tempdir)
+            test_listing.add_package('SomePackage', 'v2.0-b%d' % build)
+            test_listing.store(self.__tempdir, compact_journal=build == 2)
+        self.assertFalse(os.path.exists(os.path.join(self.__tempdir, 'juggler_listing.journal')))
+        from_xml = listing.load_listing(os.path.join(self.__tempdir, 'juggler_listing.xml'), self.__tempdir)
+        self.assertEqual(len(from_xml.get_package_info('SomePackage').get_builds()), 4)
+
+    def test_ConcurrentProcessesStore_NoBuildIsLost(self):
+        self.simulate_xml_load(self.get_single_packet_listing()).store(self.__tempdir)
+        workers = [multiprocessing.Process(target=add_builds, args=(self.__tempdir, worker)) for worker in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        test_listing = listing.load_local_listing(self.__tempdir)
+        self.assertEqual(len(test_listing.get_package_info('SomePackage').get_builds()), 1 + 4 * 10)
+
+    def test_CachedLocalListingUnchanged_SameListingIsReturned(self):
+        self.simulate_xml_load(self.get_single_packet_listing()).store(self.__tempdir)
+        cache = listing.ListingCache()
+        cached = cache.get_local_listing(self.__tempdir)
+        generation = cache.get_generation()
+        self.assertIs(cache.get_local_listing(self.__tempdir), cached)
+        self.assertEqual(cache.get_generation(), generation)
+
+    def test_CachedLocalListingJournalGrows_OnlyNewRecordsAreReplayed(self):
+        self.simulate_xml_load(self.get_single_packet_listing()).store(self.__tempdir)
+        cache = listing.ListingCache()
+        cached = cache.get_local_listing(self.__tempdir)
+        generation = cache.get_generation()
+        writer = listing.load_local_listing(self.__tempdir)
+        writer.add_package('SomePackage', 'v2.0-b1')
+        writer.store(self.__tempdir, compact_journal=False)
+        self.assertIs(cache.get_local_listing(self.__tempdir), cached)
+        self.assertGreater(cache.get_generation(), generation)
+        self.check_package_retrieval(cached, 'SomePackage', 'latest', 'v2.0-b1')
+
+    def test_CachedLocalListingCompacted_ListingIsLoadedAgain(self):
+        self.simulate_xml_load(self.get_single_packet_listing()).store(self.__tempdir)
+        cache = listing.ListingCache()
+        cached = cache.get_local_listing(self.__tempdir)
+        writer = listing.load_local_listing(self.__tempdir)
+        writer.add_package('SomePackage', 'v2.0-b1')
+        writer.store(self.__tempdir, compact_journal=True)
+        reloaded = cache.get_local_listing(self.__tempdir)
+        self.assertIsNot(reloaded, cached)
+        self.check_package_retrieval(reloaded, 'SomePackage', 'latest', 'v2.0-b1')
+
+    def test_CachedResolutionAfterListingChanged_ResolutionIsDropped(self):
+        self.simulate_xml_load(self.get_single_packet_listing()).store(self.__tempdir)
+        cache = listing.ListingCache()
+        cache.get_local_listing(self.__tempdir)
+        cache.store_resolution('key', ['resolved'])
+        self.assertEqual(cache.get_resolution('key'), ['resolved'])
+        writer = listing.load_local_listing(self.__tempdir)
+        writer.add_package('SomePackage', 'v2.0-b1')
+        writer.store(self.__tempdir, compact_journal=False)
+        cache.get_local_listing(self.__tempdir)
+        self.assertIsNone(cache.get_resolution('key'))
+
     def simulate_xml_load(self, xml_data):
         with open(os.path.join(self.__tempdir, 'juggler_listing.xml'), 'w') as xmlfile:
             xmlfile.write(xml_data)
         test_listing = listing.load_local_listing(self.__tempdir)
         return test_listing
+
+def add_builds(path, worker):
+    for build in range(10):
+        test_listing = listing.load_local_listing(path)
+        test_listing.add_package('SomePackage', 'v%d.%d-b1' % (worker + 2, build))
+        test_listing.store(path, compact_journal=build % 3 == 0)
+
+class TestRemoteListingCache(unittest.TestCase):
+
+    def setUp(self):
+        self.__remote_dir = tempfile.mkdtemp()
+        self.__cache_dir = os.path.join(tempfile.mkdtemp(), 'cache')
+        with open(os.path.join(self.__remote_dir, 'juggler_listing.xml'), 'w') as xmlfile:
+            xmlfile.write('<Listing> <Package name="SomePackage"> <Build version="v1.0-b0"/> </Package> </Listing>')
+
+    def tearDown(self):
+        shutil.rmtree(self.__remote_dir)
+        shutil.rmtree(os.path.dirname(self.__cache_dir))
+
+    def serve(self, gzip=False):
+        server = stand_in_server.StandInRepositoryServer(self.__remote_dir, gzip)
+        server.start()
+        self.addCleanup(server.stop)
+        return server
+
+    def load(self, server, max_age=0):
+        return listing.load_remote_listing(server.get_url(), self.__cache_dir, max_age)
+
+    def get_listing_statuses(self, server):
+        return [status for (_, path, status) in server.requests if path == '/' + listing.get_listing_filename()]
+
+    def append_remote_journal(self, build_string):
+        listing.append_journal(self.__remote_dir, [('SomePackage', build_string, 'vanilla', {}, [])])
+
+    def test_LoadTwice_SecondLoadIsRevalidated(self):
+        server = self.serve()
+        self.load(server)
+        test_listing = self.load(server)
+        self.assertEqual(self.get_listing_statuses(server), [200, 304])
+        self.assertEqual(test_listing.get_package('SomePackage').get_version(),
+                         version.parse_version('v1.0-b0'))
+        self.assertEqual(test_listing.get_root(), server.get_url())
+
+    def test_LoadTwiceWithinMaxAge_SecondLoadSkipsRequest(self):
+        server = self.serve()
+        self.load(server, max_age=3600)
+        requests = len(server.requests)
+        test_listing = self.load(server, max_age=3600)
+        self.assertEqual(len(server.requests), requests)
+        self.assertEqual(self.get_listing_statuses(server), [200])
+        self.assertIsNotNone(test_listing.get_package('SomePackage'))
+
+    def test_LoadRemoteWithJournal_JournaledBuildsAreLoaded(self):
+        server = self.serve()
+        self.append_remote_journal('v1.1-b0')
+        self.assertEqual(str(self.load(server).get_package('SomePackage').get_version()), '1.1.0-b0')
+        self.append_remote_journal('v1.2-b0')
+        self.assertEqual(str(self.load(server).get_package('SomePackage').get_version()), '1.2.0-b0')
+        uncached = listing.load_remote_listing(server.get_url())
+        self.assertEqual(str(uncached.get_package('SomePackage').get_version()), '1.2.0-b0')
+        self.assertEqual(self.get_listing_statuses(server), [200, 304, 200])
+
+    def test_LoadGzipEncodedListing_ListingIsDecoded(self):
+        server = self.serve(gzip=True)
+        test_listing = self.load(server)
+        self.assertIsNotNone(test_listing.get_package('SomePackage'))
+
+    def test_LoadSlowRemote_TimesOutWithFileNotFound(self):
+        server = self.serve()
+        server.delay = 2
+        start = time.time()
+        self.assertRaises(listing.FileNotFound, listing.load_remote_listing, server.get_url(), self.__cache_dir, timeouts=(1, 0.2))
+        self.assertRaises(listing.FileNotFound, listing.load_remote_listing, server.get_url(), timeouts=(1, 0.2))
+        self.assertLess(time.time() - start, 2)
+
+    def test_CachedRemoteListingNotModified_ListingIsNotParsedAgain(self):
+        server = self.serve()
+        cache = listing.ListingCache()
+        cached = cache.get_remote_listing(server.get_url(), self.__cache_dir)
+        self.assertIs(cache.get_remote_listing(server.get_url(), self.__cache_dir), cached)
+        self.assertEqual(self.get_listing_statuses(server), [200, 304])
+
+    def test_CachedRemoteListingJournalGrows_ListingIsParsedAgain(self):
+        server = self.serve()
+        cache = listing.ListingCache()
+        cached = cache.get_remote_listing(server.get_url(), self.__cache_dir)
+        self.append_remote_journal('v1.1-b0')
+        reloaded = cache.get_remote_listing(server.get_url(), self.__cache_dir)
+        self.assertIsNot(reloaded, cached)
+        self.assertEqual(str(reloaded.get_package('SomePackage').get_version()), '1.1.0-b0')
+        self.assertIs(cache.get_remote_listing(server.get_url(), self.__cache_dir), reloaded)
+
+    def test_CachedRemoteListingReplaced_InternTableIsStartedAgain(self):
+        server = self.serve()
+        cache = listing.ListingCache()
+        other_cache_dir = os.path.join(os.path.dirname(self.__cache_dir), 'other')
+        first = cache.get_remote_listing(server.get_url(), self.__cache_dir)
+        second = cache.get_remote_listing(server.get_url(), other_cache_dir)
+        self.assertIs(first.get_package('SomePackage').get_version(), second.get_package('SomePackage').get_version())
+        remote_file = os.path.join(self.__remote_dir, 'juggler_listing.xml')
+        with open(remote_file, 'w') as xmlfile:
+            xmlfile.write('<Listing> <Package name="SomePackage"> <Build version="v1.0-b0"/> <Build version="v0.9-b0"/> </Package> </Listing>')
+        # the server compares modification times in seconds
+        os.utime(remote_file, (time.time() + 10, time.time() + 10))
+        replaced = cache.get_remote_listing(server.get_url(), self.__cache_dir)
+        self.assertIsNot(replaced, first)
+        self.assertIsNot(replaced.get_package('SomePackage').get_version(), second.get_package('SomePackage').get_version())
+
+    def test_LoadConcurrently_CachedListingIsComplete(self):
+        server = self.serve()
+        loaded = []
+        def load():
+            loaded.append(self.load(server))
+        threads = [threading.Thread(target=load) for index in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(loaded), 8)
+        self.assertEqual(sorted(os.listdir(self.__cache_dir)), ['cache_info.xml', 'juggler_listing.xml'])
+        self.assertIsNotNone(self.load(server, max_age=3600).get_package('SomePackage'))
+
+    def test_LoadMissingRemote_RaisesFileNotFound(self):
+        server = self.serve()
+        os.remove(os.path.join(self.__remote_dir, 'juggler_listing.xml'))
+        self.assertRaises(listing.FileNotFound, self.load, server)
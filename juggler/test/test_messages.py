@@ -0,0 +1,58 @@
+"""
+    Juggler - Dirty dependency management and packaging for compiled code
+    Copyright (C) 2014  Christian Meyer
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+import unittest
+import StringIO
+import threading
+from juggler import messages
+
+class TestMessages(unittest.TestCase):
+
+    def test_CapturedThreads_MainIndentationIsUntouched(self):
+        outputs = [None] * 8
+        def worker(index):
+            messages.StartCapture()
+            messages.Indent()
+            messages.INFO('package %d' % index)
+            messages.Unindent()
+            outputs[index] = messages.StopCapture()
+        messages.Indent()
+        try:
+            threads = [threading.Thread(target=worker, args=(index,)) for index in range(len(outputs))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(messages.indent_level, 1)
+        finally:
+            messages.Unindent()
+        self.assertEqual(outputs, [['    package %d' % index] for index in range(len(outputs))])
+
+    def test_PrintCaptured_LinesGoToStdout(self):
+        stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            messages.StartCapture()
+            messages.WARNING('late')
+            lines = messages.StopCapture()
+            self.assertEqual(sys.stdout.getvalue(), '')
+            messages.PrintCaptured(lines)
+            self.assertEqual(sys.stdout.getvalue(), 'Warning: late\n')
+        finally:
+            sys.stdout = stdout
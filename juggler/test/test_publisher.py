@@ -0,0 +1,183 @@
+"""
+    Juggler - Dirty dependency management and packaging for compiled code
+    Copyright (C) 2014  Christian Meyer
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import shutil
+import random
+import time
+import tarfile
+from xml.etree import ElementTree
+from juggler.test.base_testcase import JugglerTestCase
+from juggler import publisher, version, compression, listing, manifest, upload
+from juggler.test.stand_in_server import StandInRepositoryServer
+
+CONTENT_XML = '''
+    <Content>
+        <BinaryPath target="lib">build/libProject.a</BinaryPath>
+        <Headers target="include/project" %s>include</Headers>
+    </Content>'''
+
+class TestPublisher(JugglerTestCase):
+
+    def _write(self, relative_path, content, mtime=None):
+        filename = os.path.join(self.src_dir, relative_path)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as written:
+            written.write(content)
+        if mtime is not None:
+            os.utime(filename, (mtime, mtime))
+
+    def _create_project(self, names, mtime):
+        self._write(os.path.join('build', 'libProject.a'), 'library', mtime)
+        for name in names:
+            self._write(os.path.join('include', name), name, mtime)
+
+    def _publish(self, repository, header_attributes='', codec='gz', threads=1):
+        content = ElementTree.fromstring(CONTENT_XML % header_attributes)
+        distributer = publisher.Publisher(content, self.src_dir, self.src_dir)
+        distributer.publish(repository, 'Project', version.parse_version('v1.0-b1'), 'vanilla', [], threads, codec)
+        return os.path.join(repository, 'Project_vanilla-1.0.0-b1%s' % compression.get_extension(codec))
+
+    def _read(self, filename):
+        with open(filename, 'rb') as archive:
+            return archive.read()
+
+    def test_DefaultPatterns_CommonHeaderExtensionsArePacked(self):
+        self._create_project(['a.h', 'b.hpp', os.path.join('detail', 'c.inl'), 'd.cpp'], None)
+        with tarfile.open(self._publish(self.local_repo_dir)) as archive:
+            self.assertEqual(archive.getnames(), ['lib/libProject.a', 'include/project/a.h', 'include/project/b.hpp',
+                                                  'include/project/detail/c.inl'])
+
+    def test_IncludeAndExcludePatterns_OnlyMatchingHeadersArePacked(self):
+        self._create_project(['a.h', 'b.hpp', os.path.join('detail', 'c.hpp'), 'e.hpp'], None)
+        filename = self._publish(self.local_repo_dir, 'include="*.hpp" exclude="detail/* e.*"')
+        with tarfile.open(filename) as archive:
+            self.assertEqual(archive.getnames(), ['lib/libProject.a', 'include/project/b.hpp'])
+
+    def test_PublishIdenticalContentTwice_ArchivesAreIdentical(self):
+        names = ['z.h', 'a.h', os.path.join('m', 'n.hpp')]
+        second_repo_dir = os.path.join(self.cnf_dir, 'second')
+        for codec in compression.get_supported_codecs():
+            self._create_project(names, 1000000000)
+            first = self._read(self._publish(self.local_repo_dir, codec=codec))
+            shutil.rmtree(os.path.join(self.src_dir, 'include'))
+            self._create_project(reversed(names), 1400000000)
+            second = self._read(self._publish(second_repo_dir, codec=codec, threads=3))
+            self.assertEqual(first, second, 'archives differ for %s' % codec)
+
+    def test_NormalizedMembers_OwnerAndTimeAreFixed(self):
+        self._create_project(['a.h'], 1400000000)
+        with tarfile.open(self._publish(self.local_repo_dir)) as archive:
+            for member in archive.getmembers():
+                self.assertEqual((member.mtime, member.uid, member.gid, member.uname, member.gname),
+                                 (publisher.get_normalized_mtime(), 0, 0, '', ''))
+
+    def test_PublishTwice_BuildsAreJournaledWithoutRewritingSnapshot(self):
+        self._create_project(['a.h'], None)
+        self._publish(self.local_repo_dir)
+        snapshot = os.path.join(self.local_repo_dir, listing.get_listing_filename())
+        written = os.stat(snapshot).st_ino
+        content = ElementTree.fromstring(CONTENT_XML % '')
+        distributer = publisher.Publisher(content, self.src_dir, self.src_dir)
+        for build in ['v1.0-b2', 'v1.0-b3']:
+            distributer.publish(self.local_repo_dir, 'Project', version.parse_version(build), 'vanilla')
+        self.assertEqual(os.stat(snapshot).st_ino, written)
+        self.assertTrue(os.path.isfile(os.path.join(self.local_repo_dir, listing.get_journal_filename())))
+        published = listing.load_local_listing(self.local_repo_dir).get_packages('Project')
+        self.assertEqual([str(entry.get_version()) for entry in published], ['1.0.0-b3', '1.0.0-b2', '1.0.0-b1'])
+
+    def test_InvalidSourceDateEpoch_RaisesBeforeWriting(self):
+        self._create_project(['a.h'], None)
+        previous = os.environ.get('SOURCE_DATE_EPOCH')
+        os.environ['SOURCE_DATE_EPOCH'] = 'yesterday'
+        try:
+            self.assertRaises(publisher.InvalidSourceDateEpoch, self._publish, self.local_repo_dir)
+        finally:
+            if previous is None:
+                del os.environ['SOURCE_DATE_EPOCH']
+            else:
+                os.environ['SOURCE_DATE_EPOCH'] = previous
+        self.assertEqual(os.listdir(self.local_repo_dir), ['juggler_listing.xml'])
+
+class TestRemotePublisher(JugglerTestCase):
+
+    def setUp(self):
+        JugglerTestCase.setUp(self)
+        self.server = StandInRepositoryServer(self.remote_repo_dir)
+        self.server.start()
+        self.chunk_size = upload.CHUNK_SIZE
+        upload.CHUNK_SIZE = 16 * 1024
+
+    def tearDown(self):
+        upload.CHUNK_SIZE = self.chunk_size
+        self.server.stop()
+        JugglerTestCase.tearDown(self)
+
+    def _publish(self, name, version_string):
+        generator = random.Random(name)
+        library = os.path.join(self.bin_dir, 'libProject.a')
+        with open(library, 'wb') as written:
+            written.write(''.join(chr(generator.randrange(256)) for _ in range(200000)))
+        content = ElementTree.fromstring('<Content><BinaryPath target="lib">libProject.a</BinaryPath></Content>')
+        distributer = publisher.Publisher(content, self.src_dir, self.bin_dir)
+        distributer.publish_remote(self.server.get_url(), name, version.parse_version(version_string), 'vanilla', [], 2)
+
+    def _load_remote_listing(self):
+        return listing.load_local_listing(self.remote_repo_dir)
+
+    def test_PublishRemote_ArchiveIsStreamedInBoundedChunks(self):
+        self._publish('Project', 'v1.0-b1')
+        entry = self._load_remote_listing().get_package('Project')
+        archive = os.path.join(self.remote_repo_dir, entry.get_filename())
+        self.assertEqual(manifest.compute_digest(archive), entry.get_attribute('digest'))
+        self.assertEqual(str(os.path.getsize(archive)), entry.get_attribute('size'))
+        path, transfer_encoding, largest_chunk = self.server.uploads[0]
+        self.assertEqual(path, '/' + entry.get_filename())
+        self.assertEqual(transfer_encoding, 'chunked')
+        self.assertEqual(largest_chunk, upload.CHUNK_SIZE)
+        with tarfile.open(archive) as published:
+            self.assertEqual(published.getnames(), ['lib/libProject.a'])
+
+    def test_PublishRemoteWhileListingChanges_UpdateIsRetried(self):
+        self._publish('First', 'v1.0-b1')
+        def publish_concurrently(path):
+            if path.endswith(listing.get_listing_filename()):
+                self.server.before_put = None
+                self._publish('Second', 'v1.0-b1')
+        self.server.before_put = publish_concurrently
+        self._publish('Third', 'v1.0-b1')
+        remote_listing = self._load_remote_listing()
+        for name in ['First', 'Second', 'Third']:
+            self.assertIsNotNone(remote_listing.get_package(name))
+        self.assertIn(('PUT', '/' + listing.get_listing_filename(), 412), self.server.requests)
+
+    def test_PublishRemoteToSlowRepository_TimesOutWithUploadFailed(self):
+        self.server.delay = 2
+        content = ElementTree.fromstring('<Content/>')
+        distributer = publisher.Publisher(content, self.src_dir, self.bin_dir)
+        start = time.time()
+        self.assertRaises(upload.UploadFailed, distributer.publish_remote, self.server.get_url(),
+                          'Project', version.parse_version('v1.0-b1'), 'vanilla', timeouts=(1, 0.2))
+        self.assertLess(time.time() - start, 2)
+
+    def test_PublishToFileRepository_RaisesUploadFailed(self):
+        content = ElementTree.fromstring('<Content/>')
+        distributer = publisher.Publisher(content, self.src_dir, self.bin_dir)
+        self.assertRaises(upload.UploadFailed, distributer.publish_remote, 'file://%s' % self.remote_repo_dir,
+                          'Project', version.parse_version('v1.0-b1'), 'vanilla')
@@ -0,0 +1,132 @@
+"""
+    Juggler - Dirty dependency management and packaging for compiled code
+    Copyright (C) 2014  Christian Meyer
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import time
+import random
+from juggler import version, resolver
+
+class FakeBuild():
+    def __init__(self, version_string, requirements):
+        self.__version = version.parse_version(version_string)
+        self.__requirements = [{'name': name, 'version': version.parse_spec(spec)} for name, spec in requirements]
+
+    def get_version(self):
+        return self.__version
+
+    def get_requirements(self):
+        return self.__requirements
+
+class FakeRepository():
+    def __init__(self):
+        self.__builds = {}
+        self.queries = 0
+
+    def add(self, name, version_string, *requirements):
+        self.__builds.setdefault(name, []).append(FakeBuild(version_string, requirements))
+
+    def get_candidates(self, name, spec):
+        self.queries += 1
+        builds = sorted(self.__builds.get(name, []), key=lambda build: version.get_sort_key(build.get_version()), reverse=True)
+        return iter([build for build in builds if spec.match(build.get_version())])
+
+class TestResolver(unittest.TestCase):
+
+    def resolve(self, repository, *requirements):
+        required = [{'name': name, 'version': version.parse_spec(spec)} for name, spec in requirements]
+        resolution = resolver.Resolver(repository.get_candidates).resolve(required)
+        return [(name, str(build.get_version())) for name, _, build in resolution]
+
+    def test_RequiredPackageWithoutRequirements_NewestIsPicked(self):
+        repository = FakeRepository()
+        repository.add('A', 'v1.0-b1')
+        repository.add('A', 'v1.1-b1')
+        self.assertEqual(self.resolve(repository, ('A', '')), [('A', '1.1.0-b1')])
+
+    def test_TransitiveRequirements_AllPackagesAreResolvedInDiscoveryOrder(self):
+        repository = FakeRepository()
+        repository.add('A', 'v1.0-b1', ('B', 'v1'))
+        repository.add('B', 'v1.0-b1', ('C', ''))
+        repository.add('B', 'v2.0-b1')
+        repository.add('C', 'v0.1-b1')
+        self.assertEqual(self.resolve(repository, ('A', '')),
+                         [('A', '1.0.0-b1'), ('B', '1.0.0-b1'), ('C', '0.1.0-b1')])
+
+    def test_DiamondRequirements_VersionsAreIntersected(self):
+        repository = FakeRepository()
+        repository.add('A', 'v1.0-b1', ('C', '>=1.1.0'))
+        repository.add('B', 'v1.0-b1', ('C', '<1.3.0'))
+        for minor in range(5):
+            repository.add('C', 'v1.%d-b1' % minor)
+        self.assertIn(('C', '1.2.0-b1'), self.resolve(repository, ('A', ''), ('B', '')))
+
+    def test_NewestBuildConflicts_OlderBuildIsPicked(self):
+        repository = FakeRepository()
+        repository.add('A', 'v1.0-b1', ('C', 'v1'))
+        repository.add('A', 'v2.0-b1', ('C', 'v2'))
+        repository.add('B', 'v1.0-b1', ('D', ''))
+        repository.add('D', 'v1.0-b1', ('C', 'v1'))
+        repository.add('C', 'v1.0-b1')
+        repository.add('C', 'v2.0-b1')
+        resolved = dict(self.resolve(repository, ('A', ''), ('B', '')))
+        self.assertEqual(resolved['A'], '1.0.0-b1')
+        self.assertEqual(resolved['C'], '1.0.0-b1')
+
+    def test_ConflictDeepInGraph_SearchJumpsBackToCulprit(self):
+        repository = FakeRepository()
+        repository.add('A', 'v1.0-b1', ('X', 'v1'))
+        repository.add('A', 'v2.0-b1', ('X', 'v2'))
+        # many independent packages between the culprit and the conflict
+        for index in range(30):
+            repository.add('Filler%d' % index, 'v1.0-b1')
+            repository.add('Filler%d' % index, 'v1.1-b1')
+        repository.add('Late', 'v1.0-b1', ('X', 'v1'))
+        repository.add('X', 'v1.0-b1')
+        repository.add('X', 'v2.0-b1')
+        requirements = [('A', '')] + [('Filler%d' % index, '') for index in range(30)] + [('Late', '')]
+        resolved = dict(self.resolve(repository, *requirements))
+        self.assertEqual(resolved['A'], '1.0.0-b1')
+        self.assertEqual(resolved['Filler0'], '1.1.0-b1')
+
+    def test_UnsatisfiableRequirements_RaisesResolutionFailed(self):
+        repository = FakeRepository()
+        repository.add('A', 'v1.0-b1', ('C', 'v1'))
+        repository.add('B', 'v1.0-b1', ('C', 'v2'))
+        repository.add('C', 'v1.0-b1')
+        repository.add('C', 'v2.0-b1')
+        with self.assertRaises(resolver.ResolutionFailed) as context:
+            self.resolve(repository, ('A', ''), ('B', ''))
+        self.assertIn('C', str(context.exception))
+
+    def test_MissingPackage_RaisesResolutionFailed(self):
+        repository = FakeRepository()
+        self.assertRaises(resolver.ResolutionFailed, self.resolve, repository, ('Missing', ''))
+
+    def test_LargeGraph_ResolvesQuickly(self):
+        generator = random.Random(7)
+        repository = FakeRepository()
+        names = ['Package%03d' % index for index in range(400)]
+        for index, name in enumerate(names):
+            for minor in range(10):
+                requirements = [(names[generator.randrange(index + 1, len(names))], 'v1')
+                                for _ in range(3) if index + 1 < len(names)]
+                repository.add(name, 'v1.%d-b1' % minor, *requirements)
+        start = time.time()
+        resolved = self.resolve(repository, *[(name, '') for name in names[:20]])
+        self.assertLess(time.time() - start, 1.0)
+        self.assertEqual(len(resolved), len(set(name for name, _ in resolved)))
@@ -0,0 +1,76 @@
+"""
+    Juggler - Dirty dependency management and packaging for compiled code
+    Copyright (C) 2014  Christian Meyer
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import pstats
+import shutil
+import tempfile
+import unittest
+from juggler import tracing
+
+class TestTracing(unittest.TestCase):
+
+    def setUp(self):
+        self.__tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        tracing.disable()
+        shutil.rmtree(self.__tempdir)
+
+    def _write_and_load(self):
+        filename = os.path.join(self.__tempdir, 'trace.json')
+        tracing.write(filename)
+        with open(filename) as trace_file:
+            return json.load(trace_file)['traceEvents']
+
+    def test_NestedSpans_AreWrittenAsCompleteEvents(self):
+        tracing.enable()
+        with tracing.span('fetch', 'juggler'):
+            with tracing.span('download', 'fetch', package='SomePackage') as download_span:
+                download_span.add_bytes(1024)
+                download_span.add_bytes(1024)
+        events = self._write_and_load()
+        self.assertEqual([event['name'] for event in events], ['download', 'fetch'])
+        download, fetch = events
+        self.assertEqual(download['ph'], 'X')
+        self.assertEqual(download['args']['package'], 'SomePackage')
+        self.assertEqual(download['args']['bytes'], 2048)
+        self.assertGreaterEqual(download['ts'], fetch['ts'])
+        self.assertLessEqual(download['ts'] + download['dur'], fetch['ts'] + fetch['dur'])
+
+    def test_FailingSpan_RecordsError(self):
+        tracing.enable()
+        with self.assertRaises(ValueError):
+            with tracing.span('extract', 'fetch'):
+                raise ValueError('broken archive')
+        self.assertEqual(self._write_and_load()[0]['args']['error'], 'broken archive')
+
+    def test_Disabled_NothingIsRecorded(self):
+        with tracing.span('download', 'fetch') as download_span:
+            download_span.add_bytes(10)
+        self.assertFalse(tracing.is_enabled())
+        tracing.write(os.path.join(self.__tempdir, 'trace.json'))
+        self.assertFalse(os.path.exists(os.path.join(self.__tempdir, 'trace.json')))
+
+    def test_Profile_StatisticsAreWritten(self):
+        filename = os.path.join(self.__tempdir, 'juggler.prof')
+        tracing.start_profile()
+        sorted(range(1000), reverse=True)
+        tracing.stop_profile(filename)
+        self.assertGreater(pstats.Stats(filename).total_calls, 0)
@@ -43,3 +43,10 @@ class TestVersionInfo(unittest.TestCase):
         self.assertTrue(self.do_match('', 'v1.2-b4'))
         self.assertTrue(self.do_match('latest', 'v1.2-local'))
 
+
+    def test_intern_version(self):
+        interned_versions = {}
+        interned = version.intern_version('v1.2-b4', interned_versions)
+        self.assertEqual(interned, version.parse_version('v1.2-b4'))
+        self.assertIs(version.intern_version('v1.2-b4', interned_versions), interned)
+        self.assertIsNot(version.intern_version('v1.2-b4', {}), interned)
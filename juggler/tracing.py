@@ -0,0 +1,135 @@
+"""
+    Juggler - Dirty dependency management and packaging for compiled code
+    Copyright (C) 2014  Christian Meyer
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import time
+import threading
+
+'''
+timed spans of the phases of a fetch or publish, written as complete events of the Chrome trace
+event format that chrome://tracing and Perfetto load
+
+    with tracing.span('download', 'fetch', package='RequiredPackage') as download_span:
+        ...
+        download_span.add_bytes(len(data))
+
+Spans of the same thread nest, every thread gets a row of its own. Spans with bytes report the
+throughput in MiB/s as well. Nothing is recorded unless tracing was enabled, a disabled span
+costs a function call.
+'''
+class Tracer():
+    def __init__(self):
+        self.__events = []
+        self.__lock = threading.Lock()
+        self.__origin = time.time()
+
+    def record(self, name, category, start, end, args):
+        event = {'name': name, 'cat': category, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.current_thread().ident,
+                 'ts': int((start - self.__origin) * 1000000), 'dur': int((end - start) * 1000000), 'args': args}
+        with self.__lock:
+            self.__events.append(event)
+
+    def get_events(self):
+        with self.__lock:
+            return list(self.__events)
+
+    def write(self, filename):
+        with open(filename, 'w') as trace_file:
+            json.dump({'traceEvents': self.get_events(), 'displayTimeUnit': 'ms'}, trace_file, indent=1, sort_keys=True)
+
+class Span():
+    def __init__(self, tracer, name, category, args):
+        self.__tracer = tracer
+        self.__name = name
+        self.__category = category
+        self.__args = args
+        self.__bytes = None
+        self.__start = None
+
+    def add_bytes(self, count):
+        self.__bytes = (self.__bytes or 0) + count
+
+    def set_argument(self, key, value):
+        self.__args[key] = value
+
+    def __enter__(self):
+        self.__start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.time()
+        if self.__bytes is not None:
+            self.__args['bytes'] = self.__bytes
+            if end > self.__start:
+                self.__args['MiB/s'] = round(self.__bytes / (end - self.__start) / (1024 * 1024), 3)
+        if exc_type is not None:
+            self.__args['error'] = str(exc_value)
+        self.__tracer.record(self.__name, self.__category, self.__start, end, self.__args)
+
+class DisabledSpan():
+    def add_bytes(self, count):
+        pass
+
+    def set_argument(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+tracer = None
+profiler = None
+disabled_span = DisabledSpan()
+
+def enable():
+    global tracer
+    tracer = Tracer()
+
+def disable():
+    global tracer
+    tracer = None
+
+def is_enabled():
+    return tracer is not None
+
+def span(name, category, **args):
+    if tracer is None:
+        return disabled_span
+    return Span(tracer, name, category, args)
+
+def write(filename):
+    if tracer is not None:
+        tracer.write(filename)
+
+def start_profile():
+    '''cProfile only sees the thread that started it, concurrent downloads show up in the trace instead'''
+    global profiler
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+def stop_profile(filename):
+    global profiler
+    if profiler is None:
+        return
+    profiler.disable()
+    profiler.dump_stats(filename)
+    profiler = None
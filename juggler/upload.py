@@ -0,0 +1,163 @@
+"""
+    Juggler - Dirty dependency management and packaging for compiled code
+    Copyright (C) 2014  Christian Meyer
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import socket
+import hashlib
+import httplib
+import urlparse
+import StringIO
+from juggler import listing
+
+CHUNK_SIZE = 1024 * 1024
+LISTING_UPDATE_ATTEMPTS = 5
+
+class UploadFailed(Exception):
+    pass
+
+def open_connection(url, timeouts):
+    '''timeouts are the connect and read timeouts in seconds like for download.open_url, None waits forever'''
+    connect_timeout, read_timeout = timeouts or (None, None)
+    parts = urlparse.urlsplit(url)
+    if parts.scheme == 'http':
+        connection = httplib.HTTPConnection(parts.netloc, timeout=connect_timeout)
+    elif parts.scheme == 'https':
+        connection = httplib.HTTPSConnection(parts.netloc, timeout=connect_timeout)
+    else:
+        raise UploadFailed('I can only publish to http and https repositories, not to %s' % url)
+    connection.connect()
+    connection.sock.settimeout(read_timeout)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    return connection, path
+
+class ChunkedUpload(object):
+    '''
+    Write only file object sending everything written to it as the body of a PUT request with chunked
+    transfer encoding. At most CHUNK_SIZE bytes are held back, whatever the size of the upload.
+    '''
+    def __init__(self, url, timeouts=None):
+        self.__url = url
+        self.__buffer = []
+        self.__buffered = 0
+        self.__digest = hashlib.sha256()
+        self.__size = 0
+        try:
+            self.__connection, path = open_connection(url, timeouts)
+            self.__connection.putrequest('PUT', path)
+            self.__connection.putheader('Transfer-Encoding', 'chunked')
+            self.__connection.putheader('Content-Type', 'application/octet-stream')
+            self.__connection.endheaders()
+        except (socket.error, httplib.HTTPException) as error:
+            raise UploadFailed('I could not start uploading to %s: %s' % (url, error))
+
+    def get_digest(self):
+        return self.__digest.hexdigest()
+
+    def get_size(self):
+        return self.__size
+
+    def write(self, data):
+        if not data:
+            return
+        self.__digest.update(data)
+        self.__size += len(data)
+        self.__buffer.append(data)
+        self.__buffered += len(data)
+        if self.__buffered >= CHUNK_SIZE:
+            pending = ''.join(self.__buffer)
+            sent = 0
+            while len(pending) - sent >= CHUNK_SIZE:
+                self.__send_chunk(pending[sent:sent + CHUNK_SIZE])
+                sent += CHUNK_SIZE
+            self.__buffer = [pending[sent:]]
+            self.__buffered = len(pending) - sent
+
+    def __send_chunk(self, chunk):
+        if not chunk:
+            return
+        try:
+            self.__connection.send('%x\r\n' % len(chunk))
+            self.__connection.send(chunk)
+            self.__connection.send('\r\n')
+        except (socket.error, httplib.HTTPException) as error:
+            raise UploadFailed('Uploading to %s failed: %s' % (self.__url, error))
+
+    def close(self):
+        self.__send_chunk(''.join(self.__buffer))
+        self.__buffer = []
+        self.__buffered = 0
+        try:
+            self.__connection.send('0\r\n\r\n')
+            response = self.__connection.getresponse()
+            response.read()
+        except (socket.error, httplib.HTTPException) as error:
+            raise UploadFailed('Uploading to %s failed: %s' % (self.__url, error))
+        finally:
+            self.__connection.close()
+        if not response.status in (200, 201, 204):
+            raise UploadFailed('%s refused the upload: %d %s' % (self.__url, response.status, response.reason))
+
+    def abort(self):
+        self.__connection.close()
+
+def request(method, url, body=None, headers={}, timeouts=None):
+    '''returns status, headers and body of the response'''
+    try:
+        connection, path = open_connection(url, timeouts)
+        try:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            return response.status, dict(response.getheaders()), response.read()
+        finally:
+            connection.close()
+    except (socket.error, httplib.HTTPException) as error:
+        raise UploadFailed('%s %s failed: %s' % (method, url, error))
+
+def update_remote_listing(repository_url, update, timeouts=None):
+    '''
+    applies update(listing) to the listing of an HTTP repository. The new listing is only accepted
+    by the server if nobody changed it since it was downloaded (If-Match), otherwise the update is
+    tried again on the changed listing.
+    '''
+    listing_url = '/'.join([repository_url, listing.get_listing_filename()])
+    for _ in range(LISTING_UPDATE_ATTEMPTS):
+        status, headers, body = request('GET', listing_url, timeouts=timeouts)
+        if status == 404:
+            remote_listing = listing.Listing(repository_url)
+            precondition = {'If-None-Match': '*'}
+        elif status == 200:
+            if not 'etag' in headers:
+                raise UploadFailed('%s does not send an ETag, I can not update it safely' % listing_url)
+            try:
+                remote_listing = listing.load_listing(StringIO.StringIO(body), repository_url)
+            except listing.InvalidFile as error:
+                raise UploadFailed('I can not update %s: %s' % (listing_url, error))
+            precondition = {'If-Match': headers['etag']}
+        else:
+            raise UploadFailed('I could not download %s: %d' % (listing_url, status))
+        update(remote_listing)
+        updated = StringIO.StringIO()
+        remote_listing.write(updated)
+        precondition['Content-Type'] = 'application/xml'
+        status, _, _ = request('PUT', listing_url, updated.getvalue(), precondition, timeouts)
+        if status in (200, 201, 204):
+            return
+        if status != 412:
+            raise UploadFailed('%s refused the updated listing: %d' % (listing_url, status))
+    raise UploadFailed('%s kept changing while I tried to update it' % listing_url)
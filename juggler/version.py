@@ -23,6 +23,16 @@ def parse_version(string):
         return Version.coerce(string[1:])
     return Version(string)
 
+def intern_version(string, interned_versions):
+    '''
+    like parse_version, but equal strings give the same Version object kept in interned_versions,
+    which must never be changed
+    '''
+    interned = interned_versions.get(string)
+    if interned is None:
+        interned = interned_versions.setdefault(string, parse_version(string))
+    return interned
+
 def parse_spec(string):
     if string == '' or string == 'latest':
         return Spec('*')
@@ -38,3 +48,21 @@ def parse_spec(string):
             return Spec('%s,<%d.%d' % (cleaned, v.major, v.minor + 1))
         
     return Spec(string)
+
+def get_identifier_key(identifier):
+    if identifier.isdigit():
+        return (0, int(identifier))
+    return (1, identifier)
+
+def get_sort_key(build_version):
+    # orders complete versions exactly like semantic_version does, but as a plain tuple
+    # that is computed once instead of on every comparison
+    if build_version.prerelease:
+        prerelease_key = (0,) + tuple(get_identifier_key(identifier) for identifier in build_version.prerelease)
+    else:
+        prerelease_key = (1,)
+    if build_version.build:
+        build_key = (1,) + tuple(get_identifier_key(identifier) for identifier in build_version.build)
+    else:
+        build_key = (0,)
+    return (build_version.major, build_version.minor, build_version.patch, prerelease_key, build_key)